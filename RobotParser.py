@@ -1,97 +1,225 @@
 #!/usr/bin/env python3
 # Author: Emmanuel Odeke <odeke@ualberta.ca>
 
+import re
 import time
+import threading
 import utils
-
-firstLetterCompile = utils.regexCompile('([a-z])')
+import robotsCache
+
+from concurrent.futures import ThreadPoolExecutor
+
+TERMINAL = None # Trie key under which a node stores the rule ending there
+DEFAULT_PREFETCH_WORKERS = 8
+
+try:
+    from urllib.parse import urlsplit
+except ImportError: # Python2.X
+    from urlparse import urlsplit
+
+class RobotRules:
+    # Compiled Allow/Disallow rules of one robots.txt group. Plain path
+    # prefixes live in a character trie, so the longest matching prefix is
+    # found in a single walk of the path; the few rules using '*' or '$' are
+    # kept as regexes sorted longest first and only tried when they could beat
+    # the trie's match. The longest matching rule wins, Allow on ties.
+    def __init__(self, crawlDelay=None):
+        self.crawlDelay = crawlDelay
+        self.__trie = dict()
+        self.__wildcards = [] # [(len(pattern), isAllow, compiled)...]
+        self.__ruleCount = 0
+
+    def __len__(self):
+        return self.__ruleCount
+
+    def addRule(self, pattern, isAllow):
+        if not pattern:
+            return # An empty Disallow allows everything
+
+        self.__ruleCount += 1
+        if '*' in pattern or pattern.endswith('$'):
+            anchored = pattern.endswith('$')
+            body = pattern[:-1] if anchored else pattern
+            regex = '.*'.join(re.escape(part) for part in body.split('*'))
+            compiled = re.compile(regex + ('$' if anchored else ''), re.UNICODE)
+            self.__wildcards.append((len(pattern), isAllow, compiled))
+            self.__wildcards.sort(key=lambda rule: (-rule[0], not rule[1]))
+            return
+
+        node = self.__trie
+        for ch in pattern:
+            node = node.setdefault(ch, dict())
+
+        # Allow wins over a Disallow of the very same pattern
+        node[TERMINAL] = node.get(TERMINAL, False) or isAllow
+
+    def isAllowed(self, path):
+        if not path.startswith('/'):
+            path = '/' + path
+        if path == '/robots.txt':
+            return True
+
+        bestLength, bestAllow = -1, True
+        node = self.__trie
+        for i, ch in enumerate(path):
+            node = node.get(ch, None)
+            if node is None:
+                break
+            if TERMINAL in node:
+                bestLength, bestAllow = i + 1, node[TERMINAL]
+
+        for length, isAllow, compiled in self.__wildcards:
+            if length < bestLength or (length == bestLength and not isAllow):
+                break
+            if compiled.match(path):
+                return isAllow
+
+        return bestAllow
+
+def parseGroups(robotFile):
+    # Returns [(userAgents, [(pattern, isAllow)...], crawlDelay)...]
+    groups = []
+    agents, rules, crawlDelay = None, None, None
+    for line in robotFile.split('\n'):
+        line = line.split('#', 1)[0].strip()
+        if ':' not in line:
+            continue
+
+        key, value = line.split(':', 1)
+        key, value = key.strip().lower(), value.strip()
+        if key == 'user-agent':
+            if agents is None or rules or crawlDelay is not None: # A new group starts
+                agents, rules, crawlDelay = [], [], None
+                groups.append([agents, rules, crawlDelay])
+            if value: # An empty agent names no crawler, its group applies to none
+                agents.append(value.lower())
+        elif agents is None: # Rules before any User-agent line are ignored
+            continue
+        elif key in ('allow', 'disallow'):
+            rules.append((value, key == 'allow'))
+        elif key == 'crawl-delay':
+            crawlDelay = value
+            groups[-1][2] = value
+
+    return [tuple(group) for group in groups]
+
+def productToken(agent):
+    # 'Rosebot/1.0 (+http://x)' => 'rosebot', the part User-agent lines name
+    parts = agent.strip().lower().split('/', 1)[0].split()
+    return parts[0] if parts else ''
+
+def compileRules(robotFile, crawlerName=utils.CRAWLER_NAME):
+    # Compiles the rules of the groups naming crawlerName's product token,
+    # compared whole and case insensitively, or else of the '*' groups
+    groups = parseGroups(robotFile)
+    token = productToken(crawlerName)
+    selected = [g for g in groups if any(a != '*' and productToken(a) == token for a in g[0])]
+    if not selected:
+        selected = [g for g in groups if '*' in g[0]]
+
+    robotRules = RobotRules()
+    for agents, rules, crawlDelay in selected:
+        for pattern, isAllow in rules:
+            robotRules.addRule(pattern, isAllow)
+        if crawlDelay is not None:
+            robotRules.crawlDelay = crawlDelay
+
+    return robotRules
+
+def urlPath(url):
+    parts = urlsplit(url)
+    path = parts.path or '/'
+    if parts.query:
+        path = '%s?%s'%(path, parts.query)
+    return path
 
 class RobotParser:
-    def __init__(self):
+    # Args: snapshotPath => Optional robots.txt snapshot shared by crawler
+    #         processes, see robotsCache.RobotsCache
+    def __init__(self, snapshotPath=None, fetchFunc=robotsCache.fetchRobotFile,
+            prefetchWorkers=DEFAULT_PREFETCH_WORKERS):
         self.__initTime__ = time.time()
         self.__rulesDict__ = dict()
+        self.__cache = robotsCache.RobotsCache(
+            self.__compileEntry, fetchFunc=fetchFunc, snapshotPath=snapshotPath
+        )
+        self.__prefetchWorkers = max(1, prefetchWorkers)
+        self.__prefetchLock = threading.Lock()
+        self.__prefetching = set() # Domains queued up for a background fetch
+        self.__executor = None # Started on the first prefetch
 
     def addRobotRule(self, url): 
         topDomain = utils.getTopDomain(url)
         if topDomain:
             robotPath = utils.robotsTxt(topDomain)
 
+    def __compileEntry(self, domain, robotFile):
+        self.parseRobotFile(domain, robotFile)
+        return self.__rulesDict__.get(domain, None)
+
     def parseRobotFile(self, domain, robotFile):
-        if not robotFile: # Avoid urls without robots.txt -- debatable issue.
+        if not robotFile:
             return None
-        splitL = robotFile.split('\n')
-        spLen = len(splitL)
-        tokenCreator = lambda v, s=':': tuple(map(lambda a: a.strip(' '), v.split(s)))
-        domainAllows = {}
-        domainDisAllows = {}
-        for i in range(spLen):
-            line = splitL[i]
-            if (not line) or line[0] == '#':
-                continue
-
-            attrs = tokenCreator(line)
-            if attrs and attrs[0] == 'User-agent':
-                clausePresent = (attrs[1] == utils.CRAWLER_NAME or attrs[1] == '*')
-                if not clausePresent:
-                    continue
-
-                i += 1
-
-                while i < spLen:
-                    l = splitL[i]
-                    cont = tokenCreator(l)
-                    if cont[0] == 'User-agent':
-                        break
-
-                    i += 1
-                    if (not l) or l[0] == '#':
-                       continue 
-                   
-                    selector = domainDisAllows 
-                    if cont[0] == 'Allow':
-                        selector = domainAllows
-                    elif not (cont[0] == 'Disallow' and cont[1]):
-                        continue
-                
-                    firstCh = firstLetterCompile.search(cont[1])
-                    key = '*'
-                    if firstCh:
-                        key = firstCh.groups(1)[0]
-
-                    try:
-                        selector.setdefault(key, []).append(utils.regexCompile(cont[1]))
-                    except:
-                        pass
-
-        self.__rulesDict__[domain] = {'allow': domainAllows, 'disallow': domainDisAllows}
+
+        robotRules = compileRules(robotFile)
+        if robotRules.crawlDelay is not None:
+            # Space out our requests to this domain as asked
+            utils.politeScheduler.setCrawlDelay(domain, robotRules.crawlDelay)
+
+        self.__rulesDict__[domain] = robotRules
         return True
 
     def canVisit(self, url):
         topDomain = utils.getTopDomain(url)
-        retrRules = self.__rulesDict__.get(topDomain, None)
-        if retrRules is None: # Cache miss
-            robotsUrl = utils.robotsTxt(url)
-            roboFileBuf = utils.dlAndDecode(robotsUrl)
-            if not self.parseRobotFile(topDomain, roboFileBuf):
+        if not topDomain:
+            return False
+
+        entry = self.__cache.get(topDomain)
+        if entry.status == robotsCache.STATUS_UNREACHABLE:
+            return False # Retried once the negative entry expires
+        if entry.rules is None: # No robots.txt or an empty one
+            return True
+
+        return entry.rules.isAllowed(urlPath(url))
+
+    def prefetch(self, url):
+        # Fetches url's robots.txt in the background unless it is cached or
+        # already on its way, so that 'canVisit' finds it ready. Returns True
+        # iff a fetch was queued up
+        topDomain = utils.getTopDomain(url)
+        if not topDomain or self.__cache.peek(topDomain) is not None:
+            return False
+
+        with self.__prefetchLock:
+            if topDomain in self.__prefetching or self.__cache.isFetching(topDomain):
                 return False
-            retr = self.__rulesDict__[topDomain]
-
-        sp = tuple(filter(lambda a: a, url.split(topDomain)))
-        if sp:
-            firstCh = firstLetterCompile.search(sp[0])
-            if firstCh:
-                # Time to probe
-                fCh = firstCh.groups(1)[0]
-                retr = self.__rulesDict__[topDomain]['disallow']
-                compList = retr.get(fCh, None)
-                if compList:
-                    for comp in compList:
-                        if comp.search(sp[0]):
-                            return False 
-
-                    return True
+
+            if self.__executor is None:
+                self.__executor = ThreadPoolExecutor(max_workers=self.__prefetchWorkers)
+            self.__prefetching.add(topDomain)
+            self.__executor.submit(self.__prefetchDomain, topDomain)
+
         return True
-                    
+
+    def __prefetchDomain(self, topDomain):
+        try:
+            self.__cache.get(topDomain)
+        finally:
+            with self.__prefetchLock:
+                self.__prefetching.discard(topDomain)
+
+    def close(self):
+        # Waits for the prefetches still running
+        with self.__prefetchLock:
+            executor, self.__executor = self.__executor, None
+        if executor is not None:
+            executor.shutdown(wait=True)
+
+    def getCache(self):
+        return self.__cache
+
+    def saveSnapshot(self, path=None):
+        return self.__cache.saveSnapshot(path)
 
     def getRules(self):
         return self.__rulesDict__
@@ -4,6 +4,8 @@
 
 import re, urllib.request
 
+import utils
+
 nameCompile = re.compile(".*/problems/(.*pdf)", re.UNICODE|re.IGNORECASE)
 probsCompile = re.compile(
     '"(http://[^"]*/problems/[^"]*\.pdf)"', re.UNICODE|re.IGNORECASE
@@ -20,6 +22,5 @@ for match in matches:
         if not fileName:
             print('Could not extract a name from', match)
         else:
-            dlData = urllib.request.urlopen(match)
-            with open(fileName, 'wb') as f:
-                f.write(dlData.read()) and print("%s written to memory"%(fileName))
+            with utils.openUrl(match) as dlData:
+                utils.streamToFile(dlData, fileName) and print("%s written to memory"%(fileName))
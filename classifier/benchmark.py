@@ -0,0 +1,246 @@
+#!/usr/bin/env python3
+# Benchmarks of the classifier's ingestion, pairwise ranking and clustering on
+# a synthetic corpus of configurable size and on the bundled trainingSamples.
+# Each stage reports its throughput, timed untraced, and its peak traced memory
+# from a separate pass; results are written as JSON and can be compared against
+# an earlier run's. tracemalloc only sees the benchmark's own process, so with
+# --processes above 1 the ingestion figure leaves out the pool's workers.
+
+import io
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import optparse
+import platform
+import tempfile
+import contextlib
+import tracemalloc
+
+import classifier
+import rankCache
+import similarity
+import candidateIndex
+
+DEFAULT_SAMPLES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'trainingSamples')
+DEFAULT_PIVOTS = [
+    'Africa', 'Career', 'Inflation', 'Hunger', 'Obama', 'Gaza',
+    'Privacy', 'Ukraine', 'Snowden', 'Bloomberg', 'Malaysia'
+]
+ALPHABET = 'abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ'
+
+def syntheticVocabulary(size, rng, minLen=2, maxLen=12):
+    vocabulary = set()
+    while len(vocabulary) < size:
+        length = rng.randint(minLen, maxLen)
+        vocabulary.add(''.join(rng.choice(ALPHABET) for i in range(length)))
+    return sorted(vocabulary)
+
+def writeSyntheticCorpus(dirPath, vocabulary, fileCount, linesPerFile, wordsPerLine, rng):
+    # Words are drawn with Zipf like frequencies, as in natural text
+    weights = [1.0 / (rank + 1) for rank in range(len(vocabulary))]
+    paths = []
+    for i in range(fileCount):
+        path = os.path.join(dirPath, 'doc%05d.txt'%(i))
+        with open(path, 'w', **classifier.fOpenArgs) as f:
+            for j in range(linesPerFile):
+                words = rng.choices(vocabulary, weights=weights, k=wordsPerLine)
+                f.write(' '.join(words) + '.\n')
+        paths.append(path)
+    return paths
+
+def samplePaths(dirPath):
+    paths = []
+    for root, dirs, files in os.walk(dirPath):
+        for name in files:
+            paths.append(os.path.join(root, name))
+    return sorted(paths)
+
+@contextlib.contextmanager
+def timed(result):
+    # Fills result with the block's wall time
+    start = time.time()
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            yield result
+    finally:
+        result['seconds'] = time.time() - start
+
+@contextlib.contextmanager
+def traced(result):
+    # Fills result with the block's peak traced memory, in this process only
+    tracemalloc.start()
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            yield result
+    finally:
+        result['parentPeakBytes'] = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+def measure(result, run):
+    # Times one call of run then repeats it traced, as tracing slows down
+    # the very allocations it records
+    # Returns: the timed call's value
+    with timed(result):
+        value = run()
+    with traced(result):
+        run()
+    return value
+
+def perSecond(count, seconds):
+    return (count / seconds) if seconds > 0 else None
+
+def benchIngest(paths, processCount):
+    result = dict(files=len(paths), processCount=processCount)
+    index = measure(result, lambda: classifier.readInFileContent(paths, processCount=processCount))
+
+    occurrences = sum(index.occurrenceCount(term) for term in index)
+    result.update(
+        terms=len(index), wordsIngested=occurrences,
+        wordsPerSecond=perSecond(occurrences, result['seconds'])
+    )
+    return index, result
+
+def benchRankWords(vocabulary, pivots, pairLimit, rng):
+    # Scores pairs through rankWords twice: once cold, once from the cache.
+    # Both phases are timed on one cache, then traced again on a fresh one
+    words = vocabulary if len(vocabulary) * len(pivots) <= pairLimit else rng.sample(
+        vocabulary, max(1, pairLimit // max(1, len(pivots)))
+    )
+    def rankAll():
+        for pivot in pivots:
+            for word in words:
+                classifier.rankStatDict(classifier.rankWords(pivot, word))
+
+    result = dict(pairs=len(words) * len(pivots), cold=dict(), warm=dict())
+    for measureBlock in (timed, traced):
+        cache = rankCache.RankCache()
+        classifier.useRankCache(cache)
+        for phase in ('cold', 'warm'):
+            with measureBlock(result[phase]):
+                rankAll()
+
+        if measureBlock is timed:
+            result['cache'] = cache.getStats()
+
+    for phase in ('cold', 'warm'):
+        result[phase]['pairsPerSecond'] = perSecond(result['pairs'], result[phase]['seconds'])
+
+    classifier.useRankCache(rankCache.RankCache())
+    return result
+
+def benchClusters(index, pivots, threshold):
+    vocabulary = list(index.keys())
+    prefilter = candidateIndex.CandidateIndex(vocabulary)
+    for pivot in pivots:
+        prefilter.candidates(pivot, threshold)
+
+    result = dict(
+        engine=type(similarity.SimilarityEngine([])).__name__,
+        pivots=len(pivots), vocabulary=len(vocabulary), threshold=threshold,
+        pairs=len(vocabulary) * len(pivots), pruning=prefilter.getStats()
+    )
+    clusterDict = measure(result, lambda: classifier.createClusters(
+        index, pivotCount=len(pivots), summary=True, threshold=threshold, retrPivots=pivots
+    ))
+
+    result.update(
+        pairsPerSecond=perSecond(result['pairs'], result['seconds']),
+        hits=sum(len(pickList) for pickList in clusterDict.values())
+    )
+    return result
+
+def runCorpus(name, paths, options, rng):
+    pivots = list(DEFAULT_PIVOTS)
+    index, ingest = benchIngest(paths, options.processCount)
+    vocabulary = sorted(index.keys())
+    if vocabulary:
+        pivots += rng.sample(vocabulary, min(options.randomPivots, len(vocabulary)))
+
+    return dict(
+        corpus=name,
+        ingest=ingest,
+        rankWords=benchRankWords(vocabulary, pivots, options.pairLimit, rng),
+        createClusters=benchClusters(index, pivots, options.threshold)
+    )
+
+def compare(current, baseline):
+    # Yields (path, baseline, current, ratio) for the matching rate metrics
+    def walk(cur, base, path):
+        for key, value in cur.items():
+            other = base.get(key, None) if hasattr(base, 'get') else None
+            if isinstance(value, dict):
+                for item in walk(value, other or dict(), path + [key]):
+                    yield item
+            elif key.endswith('PerSecond') and value and other:
+                yield '.'.join(path + [key]), other, value, value / other
+
+    baseRuns = dict((run['corpus'], run) for run in baseline.get('runs', []))
+    for run in current['runs']:
+        for item in walk(run, baseRuns.get(run['corpus'], dict()), [run['corpus']]):
+            yield item
+
+def cliParser():
+    parser = optparse.OptionParser(usage='%prog [options]')
+    parser.add_option('--vocabulary', dest='vocabularySize', type='int', default=5000,
+        help="Distinct words in the synthetic corpus")
+    parser.add_option('--files', dest='fileCount', type='int', default=200,
+        help="Files in the synthetic corpus")
+    parser.add_option('--lines', dest='linesPerFile', type='int', default=100,
+        help="Lines per synthetic file")
+    parser.add_option('--words-per-line', dest='wordsPerLine', type='int', default=12)
+    parser.add_option('--samples', dest='samplesDir', default=DEFAULT_SAMPLES_DIR,
+        help="Directory of real pages to benchmark too, '' to skip")
+    parser.add_option('--random-pivots', dest='randomPivots', type='int', default=5,
+        help="Pivots drawn from the vocabulary on top of the default ones")
+    parser.add_option('--threshold', dest='threshold', type='float', default=0.85)
+    parser.add_option('--pair-limit', dest='pairLimit', type='int', default=50000,
+        help="Most pairs to score through rankWords")
+    parser.add_option('--processes', dest='processCount', type='int', default=1,
+        help="Ingestion processes, see readInFileContent")
+    parser.add_option('--seed', dest='seed', type='int', default=2014)
+    parser.add_option('-o', '--output', dest='outputPath', default='',
+        help="Write the results as JSON to this path")
+    parser.add_option('--baseline', dest='baselinePath', default='',
+        help="Compare throughputs against the results JSON of an earlier run")
+    return parser.parse_args()
+
+def main():
+    options, args = cliParser()
+    rng = random.Random(options.seed)
+    results = dict(
+        createdAt=time.time(), python=platform.python_version(),
+        numpy=similarity.np is not None, options=vars(options), runs=[]
+    )
+
+    corpusDir = tempfile.mkdtemp(prefix='classifierBench')
+    try:
+        vocabulary = syntheticVocabulary(options.vocabularySize, rng)
+        paths = writeSyntheticCorpus(
+            corpusDir, vocabulary, options.fileCount, options.linesPerFile, options.wordsPerLine, rng
+        )
+        results['runs'].append(runCorpus('synthetic', paths, options, rng))
+    finally:
+        shutil.rmtree(corpusDir, ignore_errors=True)
+
+    samples = samplePaths(options.samplesDir) if options.samplesDir else []
+    if samples:
+        results['runs'].append(runCorpus('trainingSamples', samples, options, rng))
+
+    serialized = json.dumps(results, indent=2, sort_keys=True)
+    if options.outputPath:
+        with open(options.outputPath, 'w') as f:
+            f.write(serialized)
+    else:
+        print(serialized)
+
+    if options.baselinePath:
+        with open(options.baselinePath, 'r') as f:
+            baseline = json.load(f)
+        for metric, before, after, ratio in compare(results, baseline):
+            sys.stderr.write('%-50s %12.1f -> %12.1f  x%.2f\n'%(metric, before, after, ratio))
+
+if __name__ == '__main__':
+    main()
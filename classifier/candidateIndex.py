@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+# Prefilter for pivot matching. Words are bucketed by length and then by a
+# 64 bit signature of their character set, and an upper bound on a word's
+# rank against a pivot is computed per bucket so that whole buckets which
+# cannot reach the threshold are skipped before any word is ranked.
+#
+# With Lw, Lp the word and pivot lengths, S the sum of the pivot counts of
+# the characters both share and D, A the deletions and additions:
+#   rank = 3*inplace + 2*moves - D - A = inplace + 2*S - D - A
+# and inplace <= min(Lw - D, S, Lp). Signature bits set in the word but not
+# the pivot are distinct characters the pivot lacks so their count bounds D
+# from below, those set in the pivot but not the word bound A from below,
+# and S <= Lp - A.
+
+import threading
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+SIGNATURE_BITS = 64
+
+def signature(word):
+    sig = 0
+    for ch in word:
+        sig |= 1 << (ord(ch) % SIGNATURE_BITS)
+    return sig
+
+def popCount(n):
+    return bin(n).count('1')
+
+def upperBound(wordLen, wordSig, pivotLen, pivotSig):
+    # The best rank any word of length wordLen and signature wordSig could
+    # have against a pivot of length pivotLen and signature pivotSig
+    minDeletions = popCount(wordSig & ~pivotSig)
+    minAdditions = popCount(pivotSig & ~wordSig)
+    maxShared = pivotLen - minAdditions
+    maxInplace = min(wordLen - minDeletions, maxShared, pivotLen)
+    return maxInplace + (2 * maxShared) - minDeletions - minAdditions
+
+def lengthBound(wordLen, pivotLen):
+    # upperBound for the most favourable signature of a word of wordLen
+    return min(wordLen, pivotLen) + (2 * pivotLen)
+
+def popCounts(sigs):
+    # Vectorized popCount of an array of uint64 signatures
+    table = np.array([popCount(i) for i in range(256)], dtype=np.int64)
+    return table[sigs.view(np.uint8)].reshape(-1, 8).sum(axis=1)
+
+class CandidateIndex:
+    # With NumPy available the bounds of all buckets are computed at once
+    def __init__(self, words=None):
+        self.__buckets = dict() # wordLen -> {signature: [index...]}
+        self.__size = 0
+        self.__arrays = None # Flattened buckets for NumPy, rebuilt after adds
+        self.__lock = threading.Lock()
+        self.__stats = dict(queries=0, scanned=0, candidates=0)
+
+        for index, word in enumerate(words or []):
+            self.add(index, word)
+
+    def __len__(self):
+        return self.__size
+
+    def getStats(self):
+        with self.__lock:
+            stats = dict(self.__stats)
+            stats['pruneRate'] = 1.0 - (float(stats['candidates']) / stats['scanned']) if stats['scanned'] else 0.0
+            return stats
+
+    def add(self, index, word):
+        # Registers the word found at 'index' of the ranked vocabulary
+        bySignature = self.__buckets.setdefault(len(word), dict())
+        bySignature.setdefault(signature(word), []).append(index)
+        self.__size += 1
+        self.__arrays = None
+
+    def __flatten(self):
+        lens, sigs, members, starts = [], [], [], []
+        for wordLen, bySignature in self.__buckets.items():
+            for wordSig, indices in bySignature.items():
+                lens.append(wordLen)
+                sigs.append(wordSig)
+                starts.append(len(members))
+                members.extend(indices)
+
+        lens = np.array(lens, dtype=np.int64)
+        counts = np.diff(np.array(starts + [len(members)], dtype=np.int64))
+        return lens, np.array(sigs, dtype=np.uint64), np.array(members, dtype=np.int64), counts
+
+    def __npCandidates(self, pivotLen, pivotSig, minRank):
+        if self.__arrays is None:
+            self.__arrays = self.__flatten()
+        lens, sigs, members, counts = self.__arrays
+        if not len(lens):
+            return []
+
+        pivotSig = np.uint64(pivotSig)
+        minDeletions = popCounts(sigs & ~pivotSig)
+        minAdditions = popCounts(~sigs & pivotSig)
+        maxShared = pivotLen - minAdditions
+        maxInplace = np.minimum(np.minimum(lens - minDeletions, maxShared), pivotLen)
+        bounds = maxInplace + (2 * maxShared) - minDeletions - minAdditions
+
+        picked = np.repeat(bounds >= minRank, counts)
+        return np.sort(members[picked]).tolist()
+
+    def candidates(self, pivot, threshold):
+        # Returns the sorted indices of the words that may rank >= threshold
+        pivotLen = len(pivot)
+        if not pivotLen:
+            return []
+
+        pivotSig = signature(pivot)
+        # 3*pivotLen is the pivot's own rank, less some slack for rounding
+        minRank = (threshold * 3 * pivotLen) - 1e-9
+        if np is not None:
+            picked = self.__npCandidates(pivotLen, pivotSig, minRank)
+        else:
+            picked = []
+            for wordLen, bySignature in self.__buckets.items():
+                if lengthBound(wordLen, pivotLen) < minRank:
+                    continue
+
+                for wordSig, indices in bySignature.items():
+                    if upperBound(wordLen, wordSig, pivotLen, pivotSig) >= minRank:
+                        picked.extend(indices)
+
+        with self.__lock:
+            self.__stats['queries'] += 1
+            self.__stats['scanned'] += self.__size
+            self.__stats['candidates'] += len(picked)
+
+        return sorted(picked)
@@ -5,8 +5,23 @@ import os
 import sys
 import time
 import random
-
-WORD_RANK_CACHE = dict() # Useful to memoize expensively computed ranks
+import collections
+import multiprocessing
+
+import rankCache
+import invertedIndex
+import similarity
+import candidateIndex
+import clusterStore
+
+# Bounded memo of rankWords' pair by pair ranks. createClusters ranks through
+# the similarity engine instead and does not consult it: across runs its
+# results are reused through CLUSTERS_FLAG, see clusterStore
+WORD_RANK_CACHE = rankCache.RankCache()
+INDEX_FLAG = '--index='
+PROCESSES_FLAG = '--processes='
+CLUSTERS_FLAG = '--clusters='
+SHARD_MAX_PATHS = 64 # Paths per task handed to an ingestion worker
 fOpenArgs = {}
 pyVersion = int(sys.hexversion/(1<<24))
 if pyVersion >= 3:
@@ -40,145 +55,205 @@ def getWordDict(word):
 
     return wordDict
 
+def useRankCache(cache):
+    # Swaps in another rankCache.RankCache eg one persisted to disk, for
+    # callers of rankWords
+    global WORD_RANK_CACHE
+    WORD_RANK_CACHE = cache
+
 def rankWords(subject, query):
-    # Return the edit distance of subject to query
-    memRank = WORD_RANK_CACHE.get(subject, None)
-    if isinstance(memRank, dict):
-        queryMemRank = memRank.get(query, None)
-        if isinstance(queryMemRank, dict): return queryMemRank
+    # Return the edit distance of subject to query as a rankCache.RankStats
+    memRank = WORD_RANK_CACHE.get(subject, query)
+    if memRank is not None:
+        return memRank
 
     queryDict = getWordDict(query)
     subjectDict = getWordDict(subject)
 
-    statDict = DynaItem(
-        deletions=0, inplace=0, additions=0, moves=0
-    )
-
+    deletions = inplace = moves = 0
     for qCh, indexDict in queryDict.items():
         subjectLookUp = subjectDict.get(qCh, None)
         if not subjectLookUp:
-            statDict.deletions += len(indexDict)
+            deletions += len(indexDict)
         else:
             inplaceIndices = [i for i in indexDict if i in subjectLookUp]
             inplaceLen = len(inplaceIndices)
-            statDict.inplace += inplaceLen
-            statDict.moves += len(subjectLookUp) - inplaceLen
+            inplace += inplaceLen
+            moves += len(subjectLookUp) - inplaceLen
 
-    additions = [c for c in subjectDict if c not in queryDict]
-    statDict.additions += len(additions)
+    additions = len([c for c in subjectDict if c not in queryDict])
 
-    if isinstance(memRank, dict):
-        memRank[query] = statDict
-    else:
-        savDict = dict()
-        savDict[query] = statDict
-        WORD_RANK_CACHE[subject] = savDict
+    return WORD_RANK_CACHE.put(
+        subject, query, rankCache.RankStats(deletions, inplace, additions, moves)
+    )
 
-    return statDict
+def indexShard(args):
+    # Builds the partial index of a shard of paths in a pool worker, its
+    # documents numbered from firstDocId on as if indexed in sequence.
+    # Returns: (the number of paths, their InvertedIndex)
+    paths, foldCase, firstDocId = args
+    shardIndex = invertedIndex.InvertedIndex(foldCase=foldCase, firstDocId=firstDocId)
+    for path in paths:
+        indexFile(shardIndex, path)
+    return len(paths), shardIndex
+
+def indexFile(wordsIndex, path):
+    try:
+        wordsIndex.addFile(path)
+    except Exception: # TODO: Handle this error
+        sys.stderr.write(
+            '\033[91mSkipping processing of: %s\033[00m\n'%(path)
+        )
 
-def readInFileContent(pathList):
+def readInFileContent(pathList, foldCase=False, processCount=1):
     # Extract the content from a file and create a map of each word
-    # and it's unique locations ie line number, word index on the line
+    # and it's unique locations ie line number, character offset on the line,
+    # as an invertedIndex.InvertedIndex. With processCount > 1 the paths are
+    # sharded across a process pool and the partial indices merged in order,
+    # so that documents and occurrences come out as they would serially
     if not pathList:
         return {'reason': 'Expecting a pathList'}
 
-    paths = set(
+    paths = list(collections.OrderedDict.fromkeys(
         filter(lambda p: p and os.path.exists(p) and os.path.isfile(p), pathList)
-    )
+    ))
     if not paths:
         return {'reason': 'No valid path could be found'}
 
     pLen = len(paths)
-    wordsDict = dict()
+    wordsIndex = invertedIndex.InvertedIndex(foldCase=foldCase)
     start = time.time()
-    for i, path in enumerate(paths):
-        with open(path, **fOpenArgs) as f:
-            lineno = 0
-            try:
-                for l in f:
-                    l = l.strip('\n').strip(' ')
-                    lineno += 1
-                    lineContent = filter(lambda e: e, l.split(' '))
-                    charno = 0 # Local word index
-                    for w in lineContent:
-                        wItem = wordsDict.get(w, [])
-                        locationStateInfo = dict(
-                            lineno=lineno, charno=charno, source=path
-                        )
-                        wItem.append(locationStateInfo)
-                        if not wItem is None:
-                            wordsDict[w] = wItem
-
-                        charno += len(w)
-
-            except Exception: # TODO: Handle this error
-                sys.stderr.write(
-                    '\033[91mSkipping processing of: %s\033[00m\n'%(path)
-                )
-
-        sys.stdout.write('Processed: %d/%d files in %2.2f seconds\r'%(
-            i + 1, pLen, time.time()-start)
-        )
+    reportProgress = lambda i: sys.stdout.write(
+        'Processed: %d/%d files in %2.2f seconds\r'%(i, pLen, time.time()-start)
+    )
+    if processCount > 1 and pLen > 1:
+        shardSize = max(1, min(SHARD_MAX_PATHS, pLen // (processCount * 4)))
+        shards = [(paths[i:i + shardSize], foldCase, i) for i in range(0, pLen, shardSize)]
+        pool = multiprocessing.Pool(processes=min(processCount, len(shards)))
+        try:
+            done = 0
+            for shardLen, shardIndex in pool.imap(indexShard, shards):
+                wordsIndex.merge(shardIndex)
+                done += shardLen
+                reportProgress(done)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        for i, path in enumerate(paths):
+            indexFile(wordsIndex, path)
+            reportProgress(i + 1)
+
     sys.stdout.write(
         '\nFile Processing done in %2.2f seconds\n'%(time.time() - start)
     )
-    return wordsDict
+    return wordsIndex
 
 def rankStatDict(stDict):
     return (stDict.inplace * 3) + (stDict.moves * 2) +\
            ((stDict.deletions + stDict.additions) * -1)
 
 def createClusters(content, pivotCount=2, summary=False, sorting=False, threshold=0.5, retrPivots=[]):
-    pivots = retrPivots
+    pivots = list(retrPivots)
     insufficient = lambda p: len(p) < pivotCount
     while insufficient(pivots):
-        pivots += random.sample(content.keys(), pivotCount - len(pivots))
-        pivots = set(pivots)
+        pivots += random.sample(list(content.keys()), pivotCount - len(pivots))
+        pivots = list(set(pivots))
 
     clusterDict = dict()
+    engine = similarity.SimilarityEngine(content.keys()) # Encoded once for all pivots
+    words = engine.getWords()
+    prefilter = candidateIndex.CandidateIndex(words)
 
     for pivot in pivots:
-        maxStDict = DynaItem(inplace=len(pivot), moves=0, additions=0, deletions=0)
-        maxRank = rankStatDict(maxStDict)
         pickList = []
 
-        for key in content:
+        # Only words whose rank bound can reach threshold get ranked
+        candidates = prefilter.candidates(pivot, threshold)
+        for index, percentRank in engine.matches(pivot, threshold, candidates):
+            key = words[index]
             if key is not pivot:
-                stDict = rankWords(pivot, key)
-                rank = rankStatDict(stDict)
-                percentRank = (float)(rank)/maxRank
-                if percentRank >= threshold:
-                    pickList.append(DynaItem(
-                        key=key, rank=percentRank, occurances=content[key]
-                    ))
+                pickList.append(DynaItem(
+                    key=key, rank=percentRank, occurances=content[key]
+                ))
 
         if sorting:
             pickList.sort(key=lambda a: a.rank, reverse=True)
 
-        sys.stdout.write('\033[47m%s\033[00m %s'%(
-            pivot, 'Hits:' 
-        ))
-        if summary:
-            sys.stdout.write(' %d\n'%(len(pickList)))
-        else:
-            sys.stdout.write('\n')
-            for p in pickList:
-                sys.stdout.write('\t%s\n'%(p))
-
+        reportCluster(pivot, pickList, summary)
         clusterDict[pivot] = pickList
 
     return clusterDict
 
+def reportCluster(pivot, pickList, summary=False):
+    sys.stdout.write('\033[47m%s\033[00m %s'%(
+        pivot, 'Hits:' 
+    ))
+    if summary:
+        sys.stdout.write(' %d\n'%(len(pickList)))
+    else:
+        sys.stdout.write('\n')
+        for p in pickList:
+            sys.stdout.write('\t%s\n'%(p))
+
+def updateClusters(statePath, pathList, pivots, summary=False, sorting=False,
+        threshold=0.5, processCount=1):
+    # Incremental counterpart of createClusters: only the files of pathList
+    # not ingested by earlier runs are read, and only the words they add are
+    # ranked against the pivots, see clusterStore.ClusterStore
+    store = clusterStore.ClusterStore(statePath, threshold=threshold)
+    try:
+        store.addPivots(pivots)
+        newPaths = store.newPaths(pathList)
+        if newPaths:
+            delta = readInFileContent(newPaths, processCount=processCount)
+            if isinstance(delta, invertedIndex.InvertedIndex):
+                print('New words: %d'%(store.update(delta)))
+
+        content = store.getIndex()
+        clusterDict = dict()
+        for pivot, members in store.clusters(sorting=sorting).items():
+            pickList = [
+                DynaItem(key=key, rank=rank, occurances=content[key]) for key, rank in members
+            ]
+            reportCluster(pivot, pickList, summary)
+            clusterDict[pivot] = pickList
+
+        store.save()
+    finally:
+        store.close()
+
+    return clusterDict
+
 def main():
-    argc = len(sys.argv)
-    srcPath = sys.argv[1:] if argc > 1 else [__file__]
-    wDict = readInFileContent(srcPath)
-    clusterDict = createClusters(wDict, threshold=0.85,
-        retrPivots=[
-            'Africa', 'Career', 'Inflation', 'Hunger', 'Obama', 'Gaza',
-            'Privacy', 'Ukraine', 'Snowden', 'Bloomberg', 'Malaysia'
-        ]
-    )
+    args, indexPath, clustersPath, processCount = [], '', '', 1
+    for a in sys.argv[1:]:
+        if a.startswith(INDEX_FLAG): # Build the index once, then load it
+            indexPath = a[len(INDEX_FLAG):]
+        elif a.startswith(CLUSTERS_FLAG): # Only cluster what is new since the last run
+            clustersPath = a[len(CLUSTERS_FLAG):]
+        elif a.startswith(PROCESSES_FLAG): # Ingest the files in parallel
+            processCount = int(a[len(PROCESSES_FLAG):] or multiprocessing.cpu_count())
+        else:
+            args.append(a)
+
+    pivots = [
+        'Africa', 'Career', 'Inflation', 'Hunger', 'Obama', 'Gaza',
+        'Privacy', 'Ukraine', 'Snowden', 'Bloomberg', 'Malaysia'
+    ]
+    srcPath = args if args else [__file__]
+    if clustersPath:
+        updateClusters(clustersPath, srcPath, pivots, threshold=0.85, processCount=processCount)
+        return
+
+    if indexPath and os.path.exists(indexPath):
+        wDict = invertedIndex.InvertedIndex.load(indexPath)
+    else:
+        wDict = readInFileContent(srcPath, processCount=processCount)
+        if indexPath and isinstance(wDict, invertedIndex.InvertedIndex):
+            wDict.save(indexPath)
+
+    clusterDict = createClusters(wDict, threshold=0.85, retrPivots=pivots)
 
 if __name__ == '__main__':
     main()
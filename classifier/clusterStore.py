@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+# Persisted clustering state for incremental runs: the word index of every
+# document ingested so far and, per pivot, the words ranking at or above the
+# threshold. New documents are merged into the index and only the words they
+# introduce are ranked against the pivots; a new pivot is ranked against the
+# whole vocabulary once. State lives next to 'statePath' as
+#   statePath.index         => invertedIndex.InvertedIndex.save format
+#   statePath.clusters.json => threshold, pivots and their members' ranks
+
+import os
+import json
+
+import similarity
+import candidateIndex
+import invertedIndex
+
+INDEX_SUFFIX = '.index'
+CLUSTERS_SUFFIX = '.clusters.json'
+
+class ClusterStore:
+    def __init__(self, statePath, threshold=0.5, foldCase=False):
+        self.__statePath = statePath
+        self.__indexPath = statePath + INDEX_SUFFIX
+        self.__clustersPath = statePath + CLUSTERS_SUFFIX
+        self.__threshold = threshold
+        self.__clusters = dict() # pivot -> {word: percentRank}
+
+        if os.path.exists(self.__indexPath):
+            self.__index = invertedIndex.InvertedIndex.load(self.__indexPath)
+        else:
+            self.__index = invertedIndex.InvertedIndex(foldCase=foldCase)
+
+        if os.path.exists(self.__clustersPath):
+            with open(self.__clustersPath, 'r') as f:
+                saved = json.load(f)
+            if saved.get('threshold', None) == threshold:
+                self.__clusters = saved.get('clusters', dict())
+            else: # Memberships depend on the threshold
+                self.addPivots(list(saved.get('clusters', dict()).keys()))
+
+    def getIndex(self):
+        return self.__index
+
+    def getPivots(self):
+        return list(self.__clusters.keys())
+
+    def newPaths(self, pathList):
+        # Returns the paths of pathList not ingested yet
+        known = set(self.__index.getDocs())
+        return [p for p in pathList if p not in known]
+
+    def __rank(self, pivots, words):
+        # Adds the words ranking >= threshold against each pivot to its cluster
+        if not (pivots and words):
+            return 0
+
+        engine = similarity.SimilarityEngine(words)
+        prefilter = candidateIndex.CandidateIndex(words)
+        added = 0
+        for pivot in pivots:
+            members = self.__clusters.setdefault(pivot, dict())
+            candidates = prefilter.candidates(pivot, self.__threshold)
+            for index, percentRank in engine.matches(pivot, self.__threshold, candidates):
+                members[words[index]] = percentRank
+                added += 1
+        return added
+
+    def addPivots(self, pivots):
+        # Ranks the whole vocabulary against the pivots not clustered yet
+        fresh = [p for p in pivots if p and p not in self.__clusters]
+        for pivot in fresh:
+            self.__clusters[pivot] = dict()
+        return self.__rank(fresh, list(self.__index.keys()))
+
+    def update(self, deltaIndex):
+        # Merges the index of newly crawled documents, ranking only the words
+        # it introduces. Returns the number of new words
+        newWords = [w for w in deltaIndex if w not in self.__index]
+        self.__index.merge(deltaIndex)
+        self.__rank(list(self.__clusters.keys()), newWords)
+        return len(newWords)
+
+    def clusters(self, sorting=False):
+        # Returns {pivot: [(word, percentRank)...]}
+        result = dict()
+        for pivot, members in self.__clusters.items():
+            pickList = list(members.items())
+            if sorting:
+                pickList.sort(key=lambda a: a[1], reverse=True)
+            result[pivot] = pickList
+        return result
+
+    def save(self):
+        # Written aside then renamed into place: the loaded index may still be
+        # mapped from the old file
+        tmpPath = self.__freshPath(self.__indexPath)
+        self.__index.save(tmpPath)
+        os.replace(tmpPath, self.__indexPath)
+
+        tmpPath = self.__freshPath(self.__clustersPath)
+        with open(tmpPath, 'w') as f:
+            json.dump(dict(threshold=self.__threshold, clusters=self.__clusters), f)
+        os.replace(tmpPath, self.__clustersPath)
+
+    def __freshPath(self, path):
+        # A temporary path next to path, free so that open() creates the file
+        # with the umask's usual mode
+        tmpPath = '%s.%d.tmp'%(path, os.getpid())
+        if os.path.exists(tmpPath): # Left behind by a crashed run
+            os.remove(tmpPath)
+        return tmpPath
+
+    def close(self):
+        self.__index.close(keepMapped=False)
@@ -0,0 +1,240 @@
+#!/usr/bin/env python3
+# Inverted index of the words in a set of documents. Each document path is
+# stored once and referred to by its id, and each term's postings are a flat
+# array('I') of (docId, lineno, offset) triples rather than a dict per
+# occurrence. Ids are handed out in the order documents are added, from
+# firstDocId on, so that indices built apart over consecutive runs of
+# documents are merged by appending their postings as they are. An index
+# can be saved to a single file and loaded back through mmap, its postings
+# then being read straight from the mapped pages.
+#
+# On disk: MAGIC, the header length as 8 little endian bytes, a JSON header
+# listing the documents and each term's slice of the postings, padding to a
+# multiple of 4 bytes, then every posting as native uint32s.
+
+import re
+import sys
+import json
+import mmap
+import struct
+
+from array import array
+
+try:
+    from collections.abc import Mapping
+except ImportError: # Python2.X
+    from collections import Mapping
+
+MAGIC = b'CLIDX001'
+POSTING_WIDTH = 3 # docId, lineno, offset
+tokenCompile = re.compile(r"\w+(?:['\-]\w+)*", re.UNICODE)
+
+pyVersion = int(sys.hexversion/(1<<24))
+fOpenArgs = {}
+if pyVersion >= 3:
+    fOpenArgs = {'encoding': 'utf-8'}
+
+def tokenize(line, foldCase=False):
+    # Yields (offset, token) for the words on line, without the punctuation
+    # around them. Words keep their case unless foldCase is set since the
+    # classifier's ranks are case sensitive
+    for match in tokenCompile.finditer(line):
+        token = match.group(0)
+        yield match.start(), (token.lower() if foldCase else token)
+
+class InvertedIndex(Mapping):
+    # Maps each term to the list of its occurrences as
+    # dict(lineno, charno, source), built on access from the postings
+    def __init__(self, foldCase=False, firstDocId=0):
+        self.foldCase = foldCase
+        self.__firstDocId = firstDocId
+        self.__docs = [] # docId - firstDocId -> path
+        self.__docIds = dict()
+        self.__postings = dict() # term -> array('I'), built or copied in memory
+        self.__mapped = dict() # term -> (start, count) into __mappedView
+        self.__mappedView = None
+        self.__mmap = None
+
+    def getDocs(self):
+        return list(self.__docs)
+
+    def getFirstDocId(self):
+        return self.__firstDocId
+
+    def docId(self, path):
+        # Returns the interned id of path, assigning one on first sight
+        docId = self.__docIds.get(path, None)
+        if docId is None:
+            docId = self.__docIds[path] = self.__firstDocId + len(self.__docs)
+            self.__docs.append(path)
+        return docId
+
+    def __termPostings(self, term):
+        postings = self.__postings.get(term, None)
+        if postings is None:
+            postings = self.__postings[term] = array('I')
+            span = self.__mapped.pop(term, None)
+            if span is not None: # Copy on write out of the mapped file
+                start, count = span
+                postings.frombytes(self.__mappedView[start:start + count].tobytes())
+        return postings
+
+    def addOccurrence(self, term, docId, lineno, offset):
+        self.__termPostings(term).extend((docId, lineno, offset))
+
+    def addLines(self, path, lines):
+        # Indexes the words of an iterable of lines from the document at path
+        docId = self.docId(path)
+        lineno = 0
+        for line in lines:
+            lineno += 1
+            for offset, token in tokenize(line, self.foldCase):
+                self.addOccurrence(token, docId, lineno, offset)
+        return lineno
+
+    def addFile(self, path):
+        with open(path, **fOpenArgs) as f:
+            return self.addLines(path, f)
+
+    def merge(self, other):
+        # Adds every posting of the index other. If other's documents are all
+        # new and numbered on from this index's own, its postings are appended
+        # a term at a time as whole blocks, otherwise they are renumbered
+        otherDocs = other.getDocs()
+        isContiguous = other.getFirstDocId() == self.__firstDocId + len(self.__docs)
+        if isContiguous and not any(path in self.__docIds for path in otherDocs):
+            for path in otherDocs:
+                self.docId(path)
+            for term in other:
+                self.__termPostings(term).frombytes(memoryview(other.postings(term)).cast('B'))
+            return self
+
+        otherFirstDocId = other.getFirstDocId()
+        remap = array('I', (self.docId(path) for path in otherDocs))
+        for term in other:
+            postings = array('I', other.postings(term))
+            postings[0::POSTING_WIDTH] = array(
+                'I', (remap[docId - otherFirstDocId] for docId in postings[0::POSTING_WIDTH])
+            )
+            self.__termPostings(term).extend(postings)
+        return self
+
+    def postings(self, term):
+        # Returns the flat (docId, lineno, offset...) postings of term
+        postings = self.__postings.get(term, None)
+        if postings is not None:
+            return postings
+
+        span = self.__mapped.get(term, None)
+        if span is None:
+            raise KeyError(term)
+        start, count = span
+        return self.__mappedView[start:start + count]
+
+    def occurrenceCount(self, term):
+        return len(self.postings(term)) // POSTING_WIDTH
+
+    def __getitem__(self, term):
+        postings = self.postings(term)
+        docs, firstDocId = self.__docs, self.__firstDocId
+        return [
+            dict(lineno=postings[i + 1], charno=postings[i + 2], source=docs[postings[i] - firstDocId])
+            for i in range(0, len(postings), POSTING_WIDTH)
+        ]
+
+    def __contains__(self, term):
+        return term in self.__postings or term in self.__mapped
+
+    def __iter__(self):
+        for term in self.__postings:
+            yield term
+        for term in list(self.__mapped.keys()):
+            if term not in self.__postings:
+                yield term
+
+    def __len__(self):
+        return len(self.__postings) + len(self.__mapped)
+
+    def save(self, path):
+        terms, offset = [], 0
+        for term in self:
+            count = len(self.postings(term))
+            terms.append([term, offset, count])
+            offset += count
+
+        header = json.dumps(dict(
+            docs=self.__docs, firstDocId=self.__firstDocId, terms=terms,
+            foldCase=self.foldCase, byteorder=sys.byteorder
+        )).encode('utf-8')
+        padding = (-(len(MAGIC) + 8 + len(header))) % 4
+
+        with open(path, 'wb') as f:
+            f.write(MAGIC)
+            f.write(struct.pack('<Q', len(header)))
+            f.write(header)
+            f.write(b'\0' * padding)
+            for term, start, count in terms:
+                f.write(self.postings(term).tobytes())
+
+        return offset
+
+    @classmethod
+    def load(cls, path):
+        # Returns the index saved at path with its postings left in the
+        # memory mapped file until they are read or added to
+        f = open(path, 'rb')
+        try:
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        finally:
+            f.close()
+
+        if mm[:len(MAGIC)] != MAGIC:
+            mm.close()
+            raise ValueError('%s is not a saved InvertedIndex'%(path))
+
+        headerStart = len(MAGIC) + 8
+        headerLen = struct.unpack('<Q', mm[len(MAGIC):headerStart])[0]
+        header = json.loads(mm[headerStart:headerStart + headerLen].decode('utf-8'))
+        if header['byteorder'] != sys.byteorder:
+            mm.close()
+            raise ValueError('%s was saved on a %s endian machine'%(path, header['byteorder']))
+
+        dataStart = headerStart + headerLen
+        dataStart += (-dataStart) % 4
+
+        index = cls(foldCase=header.get('foldCase', False), firstDocId=header.get('firstDocId', 0))
+        for docPath in header['docs']:
+            index.docId(docPath)
+        index.__mmap = mm
+        index.__mappedView = memoryview(mm)[dataStart:].cast('I')
+        for term, start, count in header['terms']:
+            index.__mapped[term] = (start, count)
+
+        return index
+
+    def close(self, keepMapped=True):
+        # Unmaps the saved file, first copying the postings still only
+        # mapped unless keepMapped is False ie the index is done with
+        if self.__mmap is not None:
+            for term in list(self.__mapped.keys()):
+                if keepMapped:
+                    self.__termPostings(term)
+                else:
+                    self.__mapped.pop(term)
+            self.__mappedView.release()
+            self.__mmap.close()
+            self.__mappedView = self.__mmap = None
+
+    def byteSize(self):
+        # Bytes of postings held in memory, mapped ones excluded
+        return sum(p.buffer_info()[1] * p.itemsize for p in self.__postings.values())
+
+def main():
+    paths = sys.argv[1:]
+    index = InvertedIndex()
+    for path in paths:
+        index.addFile(path)
+    print('terms', len(index), 'docs', len(index.getDocs()), 'bytes', index.byteSize())
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+# Bounded memo of classifier.rankWords results. Each (subject, query) pair maps
+# to a RankStats tuple of its four counters, the least recently used pairs
+# being evicted once 'maxEntries' is reached. An optional SQLite file backs
+# the memory so that later runs reuse the ranks computed by earlier ones.
+# createClusters ranks through similarity's engines and does not use it.
+
+import sqlite3
+import threading
+import collections
+
+DEFAULT_MAX_ENTRIES = 1<<18
+DEFAULT_WRITE_BATCH = 1024 # Pairs buffered before being written to disk
+
+RankStats = collections.namedtuple('RankStats', 'deletions inplace additions moves')
+
+class RankCache:
+    def __init__(self, maxEntries=DEFAULT_MAX_ENTRIES, dbPath=None, writeBatch=DEFAULT_WRITE_BATCH):
+        self.__maxEntries = max(1, maxEntries)
+        self.__lock = threading.RLock()
+        self.__lru = collections.OrderedDict() # (subject, query) -> RankStats
+        self.__stats = dict(hits=0, misses=0, diskHits=0, stores=0, evictions=0)
+
+        self.__dbPath = dbPath
+        self.__conn = None
+        self.__unsaved = [] # Pairs stored since the last write to disk
+        self.__writeBatch = max(1, writeBatch)
+        if dbPath:
+            self.__conn = sqlite3.connect(dbPath, check_same_thread=False)
+            self.__conn.execute(
+                'CREATE TABLE IF NOT EXISTS ranks (subject TEXT, query TEXT, deletions INTEGER, '
+                'inplace INTEGER, additions INTEGER, moves INTEGER, PRIMARY KEY (subject, query))'
+            )
+            self.__conn.commit()
+
+    def getStats(self):
+        with self.__lock:
+            stats = dict(self.__stats)
+            lookups = stats['hits'] + stats['misses']
+            stats.update(
+                entries=len(self.__lru), maxEntries=self.__maxEntries,
+                hitRate=(float(stats['hits']) / lookups) if lookups else 0.0
+            )
+            return stats
+
+    def __len__(self):
+        return len(self.__lru)
+
+    def get(self, subject, query):
+        # Returns the RankStats memoized for the pair, or None
+        key = (subject, query)
+        with self.__lock:
+            stats = self.__lru.pop(key, None)
+            if stats is not None:
+                self.__lru[key] = stats
+                self.__stats['hits'] += 1
+                return stats
+
+            if self.__conn is not None:
+                row = self.__conn.execute(
+                    'SELECT deletions, inplace, additions, moves FROM ranks WHERE subject=? AND query=?',
+                    key
+                ).fetchone()
+                if row:
+                    stats = RankStats(*row)
+                    self.__remember(key, stats)
+                    self.__stats['hits'] += 1
+                    self.__stats['diskHits'] += 1
+                    return stats
+
+            self.__stats['misses'] += 1
+            return None
+
+    def put(self, subject, query, stats):
+        key = (subject, query)
+        stats = RankStats(*stats)
+        with self.__lock:
+            self.__remember(key, stats)
+            self.__stats['stores'] += 1
+            if self.__conn is not None:
+                self.__unsaved.append(key + tuple(stats))
+                if len(self.__unsaved) >= self.__writeBatch:
+                    self.flush()
+
+        return stats
+
+    def __remember(self, key, stats):
+        self.__lru.pop(key, None)
+        self.__lru[key] = stats
+        while len(self.__lru) > self.__maxEntries:
+            self.__lru.popitem(last=False)
+            self.__stats['evictions'] += 1
+
+    def flush(self):
+        # Writes the pairs stored since the last flush to disk
+        with self.__lock:
+            if self.__conn is None or not self.__unsaved:
+                return 0
+
+            unsaved, self.__unsaved = self.__unsaved, []
+            self.__conn.executemany(
+                'INSERT OR REPLACE INTO ranks (subject, query, deletions, inplace, additions, moves) '
+                'VALUES (?, ?, ?, ?, ?, ?)', unsaved
+            )
+            self.__conn.commit()
+            return len(unsaved)
+
+    def clear(self):
+        with self.__lock:
+            self.__lru.clear()
+
+    def close(self):
+        with self.__lock:
+            if self.__conn is not None:
+                self.flush()
+                self.__conn.close()
+                self.__conn = None
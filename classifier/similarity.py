@@ -0,0 +1,182 @@
+#!/usr/bin/env python3
+# Batched version of classifier.rankWords: the vocabulary is encoded once and
+# each pivot is then ranked against every word in a handful of array
+# operations instead of a DynaItem and two getWordDict maps per pair.
+# NumPy is used when available, otherwise a pure Python engine computing the
+# same statistics from per-word character counts is used.
+#
+# For a pivot and a word, with counts of each character in either:
+#   inplace   => Positions i where word[i] == pivot[i]
+#   deletions => Characters of the word absent from the pivot, with repeats
+#   moves     => Sum of the pivot counts of the characters shared with the
+#                word, less inplace
+#   additions => Distinct characters of the pivot absent from the word
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+def rankFromStats(inplace, moves, deletions, additions):
+    # Same weighing as classifier.rankStatDict
+    return (inplace * 3) + (moves * 2) - (deletions + additions)
+
+def maxRank(pivot):
+    return rankFromStats(len(pivot), 0, 0, 0)
+
+def countChars(word):
+    counts = dict()
+    for ch in word:
+        counts[ch] = counts.get(ch, 0) + 1
+    return counts
+
+class PySimilarityEngine:
+    def __init__(self, words):
+        self.__words = list(words)
+        self.__counts = [countChars(w) for w in self.__words]
+
+    def getWords(self):
+        return self.__words
+
+    def __len__(self):
+        return len(self.__words)
+
+    def statsFor(self, pivot, index):
+        word, wCounts = self.__words[index], self.__counts[index]
+        pCounts = countChars(pivot)
+        inplace = sum(1 for a, b in zip(word, pivot) if a == b)
+        deletions = moves = 0
+        for ch, count in wCounts.items():
+            pCount = pCounts.get(ch, 0)
+            if pCount:
+                moves += pCount
+            else:
+                deletions += count
+
+        additions = sum(1 for ch in pCounts if ch not in wCounts)
+        return dict(inplace=inplace, moves=moves - inplace, deletions=deletions, additions=additions)
+
+    def ranks(self, pivot, rows=None):
+        # Returns the rank of every word, or only of those at the indices
+        # 'rows', against pivot as a fraction of the best possible rank
+        best = float(maxRank(pivot))
+        results = []
+        for i in (range(len(self.__words)) if rows is None else rows):
+            st = self.statsFor(pivot, i)
+            results.append(
+                rankFromStats(st['inplace'], st['moves'], st['deletions'], st['additions']) / best
+            )
+        return results
+
+    def matches(self, pivot, threshold, rows=None):
+        # Returns [(index, percentRank)...] of the words ranking >= threshold,
+        # 'rows' restricting the words considered eg to pruned candidates
+        indices = range(len(self.__words)) if rows is None else rows
+        return [(i, r) for i, r in zip(indices, self.ranks(pivot, rows)) if r >= threshold]
+
+class NumpySimilarityEngine:
+    # The vocabulary is kept in two sparse, flattened encodings:
+    #  + one entry per (word, distinct character) with its count, for the
+    #    count based statistics which become weighted bincounts per word
+    #  + one entry per (word, position) with its character, for inplace
+    def __init__(self, words):
+        self.__words = list(words)
+        alphabet = dict()
+        countRows, charCodes, countValues = [], [], []
+        posRows, posIndices, posChars = [], [], []
+        for row, word in enumerate(self.__words):
+            for ch, count in countChars(word).items():
+                countRows.append(row)
+                charCodes.append(alphabet.setdefault(ch, len(alphabet)))
+                countValues.append(count)
+
+            for i, ch in enumerate(word):
+                posRows.append(row)
+                posIndices.append(i)
+                posChars.append(alphabet[ch])
+
+        self.__alphabet = alphabet
+        self.__countRows = np.array(countRows, dtype=np.int64)
+        self.__countChars = np.array(charCodes, dtype=np.int64)
+        self.__countValues = np.array(countValues, dtype=np.int64)
+        self.__posRows = np.array(posRows, dtype=np.int64)
+        self.__posIndices = np.array(posIndices, dtype=np.int64)
+        self.__posChars = np.array(posChars, dtype=np.int64)
+        self.__maxLen = max([len(w) for w in self.__words] or [0])
+
+        # Entries are laid out word after word, these locate each word's run
+        self.__countLens = np.bincount(self.__countRows, minlength=len(self.__words))
+        self.__posLens = np.array([len(w) for w in self.__words], dtype=np.int64)
+        self.__countStarts = np.cumsum(self.__countLens) - self.__countLens
+        self.__posStarts = np.cumsum(self.__posLens) - self.__posLens
+
+    def getWords(self):
+        return self.__words
+
+    def __len__(self):
+        return len(self.__words)
+
+    def __gather(self, starts, lengths, rows):
+        # Returns the entry positions of the words 'rows' and, for each, its
+        # word's index within rows
+        lens = lengths[rows]
+        localRows = np.repeat(np.arange(len(rows), dtype=np.int64), lens)
+        firstOfEach = np.cumsum(lens) - lens
+        positions = np.repeat(starts[rows] - firstOfEach, lens) + np.arange(lens.sum(), dtype=np.int64)
+        return positions, localRows
+
+    def stats(self, pivot, rows=None):
+        # Returns a dict of arrays of each statistic, one entry per word or
+        # per index in 'rows' if set
+        alphabetSize = len(self.__alphabet)
+        pCounts = np.zeros(alphabetSize, dtype=np.int64)
+        pivotCodes = np.full(self.__maxLen + 1, -1, dtype=np.int64)
+        distinct = countChars(pivot)
+        for i, ch in enumerate(pivot):
+            code = self.__alphabet.get(ch, -2) # -2: in no word, never matches
+            if code >= 0:
+                pCounts[code] += 1
+            if i <= self.__maxLen:
+                pivotCodes[i] = code
+
+        posRows, posIndices, posChars = self.__posRows, self.__posIndices, self.__posChars
+        countRows, charCodes, countValues = self.__countRows, self.__countChars, self.__countValues
+        wordCount = len(self.__words)
+        if rows is not None:
+            rows = np.asarray(rows, dtype=np.int64)
+            wordCount = len(rows)
+            positions, posRows = self.__gather(self.__posStarts, self.__posLens, rows)
+            posIndices, posChars = posIndices[positions], posChars[positions]
+            positions, countRows = self.__gather(self.__countStarts, self.__countLens, rows)
+            charCodes, countValues = charCodes[positions], countValues[positions]
+
+        perWord = lambda rowIds, weights: np.bincount(
+            rowIds, weights=weights, minlength=wordCount
+        ).astype(np.int64)
+
+        inplace = perWord(posRows, (pivotCodes[posIndices] == posChars).astype(np.int64))
+        sharedCounts = pCounts[charCodes]
+        isShared = sharedCounts > 0
+        moves = perWord(countRows, sharedCounts) - inplace
+        deletions = perWord(countRows, np.where(isShared, 0, countValues))
+        additions = len(distinct) - perWord(countRows, isShared.astype(np.int64))
+
+        return dict(inplace=inplace, moves=moves, deletions=deletions, additions=additions)
+
+    def ranks(self, pivot, rows=None):
+        st = self.stats(pivot, rows)
+        rank = rankFromStats(st['inplace'], st['moves'], st['deletions'], st['additions'])
+        return rank.astype(np.float64) / float(maxRank(pivot))
+
+    def matches(self, pivot, threshold, rows=None):
+        ranks = self.ranks(pivot, rows)
+        hits = np.nonzero(ranks >= threshold)[0]
+        if rows is None:
+            return [(int(i), float(ranks[i])) for i in hits]
+        return [(int(rows[i]), float(ranks[i])) for i in hits]
+
+def SimilarityEngine(words):
+    # Returns the fastest engine available for the vocabulary 'words'
+    if np is not None:
+        return NumpySimilarityEngine(words)
+    return PySimilarityEngine(words)
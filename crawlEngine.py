@@ -0,0 +1,289 @@
+#!/usr/bin/env python3
+# Frontier based crawl engine: an explicit work-queue drained by a pool of
+# worker threads. Tasks are plain callables and may submit further tasks to
+# the engine, which is how crawlers expand the link graph without recursion.
+
+import sys
+import time
+import heapq
+import itertools
+import threading
+import collections
+
+import utils
+import seenSet
+
+try:
+    import queue
+except ImportError: # Python2.X
+    import Queue as queue
+
+DEFAULT_WORKER_COUNT = 8
+
+# Frontier priorities: tasks that already hold their host's turn go first
+ADMITTED, NORMAL, SENTINEL = 0, 1, 2
+
+class CrawlEngine:
+    # Tasks submitted with 'submitFor' fetch a url: a worker only runs one
+    # once the host's politeness budget, see hostScheduler, lets it through.
+    # Until then it waits in its host's ready queue, without holding a worker,
+    # and a timer thread hands it back to the frontier when the host frees up
+    def __init__(self, workerCount=DEFAULT_WORKER_COUNT, seen=None, scheduler=None,
+            seenErrorRate=seenSet.DEFAULT_ERROR_RATE, exactLookup=None, exactRecord=None):
+        # seen => The set of keys already submitted via 'submitOnce', by
+        #         default a fresh seenSet.SeenSet for this crawl. Being a Bloom
+        #         filter it takes about seenErrorRate of the keys it never saw
+        #         for seen ones, dropping their tasks, unless exactLookup(key)
+        #         is given to settle its 'maybe' answers exactly, exactRecord
+        #         storing each newly seen key for it
+        # scheduler => hostScheduler.HostScheduler, utils.politeScheduler by default
+        self.__workerCount = max(1, int(workerCount or 1))
+        if seen is None:
+            seen = seenSet.SeenSet(
+                errorRate=seenErrorRate, exactLookup=exactLookup, exactRecord=exactRecord
+            )
+        self.__seen = seen
+        self.__scheduler = utils.politeScheduler if scheduler is None else scheduler
+        self.__frontier = queue.PriorityQueue()
+        self.__sequence = itertools.count() # Keeps the frontier FIFO per priority
+        self.__workers = []
+        self.__stopEvent = threading.Event()
+
+        self.__hostCond = threading.Condition()
+        self.__hostQueues = dict() # host key -> deque of tasks waiting for a turn
+        self.__wakeups = [] # Heap of (at, host key)
+        self.__wakeAt = dict() # host key -> time of its one live wakeup
+        self.__timer = None
+        self.__timerDone = False
+
+    def getWorkerCount(self):
+        return self.__workerCount
+
+    def pendingCount(self):
+        # Approximate number of tasks still waiting to be picked up
+        with self.__hostCond:
+            waiting = sum(len(tasks) for tasks in self.__hostQueues.values())
+        return self.__frontier.qsize() + waiting
+
+    def __put(self, task, priority=NORMAL):
+        self.__frontier.put((priority, next(self.__sequence), task))
+
+    def submit(self, func, *args, **kwargs):
+        # Queue up 'func(*args, **kwargs)' to be run by the next idle worker
+        if self.__stopEvent.is_set():
+            return False
+
+        self.__put((None, func, args, kwargs))
+        return True
+
+    def submitFor(self, url, func, *args, **kwargs):
+        # Like 'submit' for a task fetching url: it is run with the turn to
+        # hit url's host already taken, see hostScheduler.holdTurn
+        if self.__stopEvent.is_set():
+            return False
+
+        self.__put((url, func, args, kwargs))
+        return True
+
+    def markSeen(self, key):
+        # Returns True iff key had not been seen by this engine before
+        return key is not None and self.__seen.add(key)
+
+    def submitOnce(self, key, func, *args, **kwargs):
+        # Like 'submit' but drops the task if key was already submitted
+        if not self.markSeen(key):
+            return False
+        return self.submit(func, *args, **kwargs)
+
+    def __admit(self, url, task):
+        # Returns True iff the task may run now, else parks it on its host's
+        # ready queue behind any tasks already waiting there
+        key = self.__scheduler.hostKey(url)
+        with self.__hostCond:
+            waiting = self.__hostQueues.get(key, None)
+            if waiting:
+                waiting.append(task)
+                return False
+
+            delay = self.__scheduler.tryAcquire(url)
+            if not delay:
+                return True
+
+            self.__hostQueues[key] = collections.deque([task])
+            self.__scheduleWakeup(key, delay)
+            return False
+
+    def __scheduleWakeup(self, key, delay):
+        at = time.time() + delay
+        liveAt = self.__wakeAt.get(key, None)
+        if liveAt is not None and liveAt <= at:
+            return
+
+        self.__wakeAt[key] = at
+        heapq.heappush(self.__wakeups, (at, key))
+        self.__hostCond.notify_all()
+
+    def __releaseWaiting(self, key):
+        # Moves the tasks at the head of key's ready queue to the frontier for
+        # as long as the host grants turns. Called with __hostCond held
+        waiting = self.__hostQueues.get(key, None)
+        while waiting:
+            url = waiting[0][0]
+            priority = NORMAL # Only to be drained once stopped
+            if not self.__stopEvent.is_set():
+                delay = self.__scheduler.tryAcquire(url)
+                if delay:
+                    self.__scheduleWakeup(key, delay)
+                    return
+                priority = ADMITTED
+
+            self.__put(waiting.popleft(), priority)
+            self.__frontier.task_done() # For the 'get' that parked it
+
+        self.__hostQueues.pop(key, None)
+
+    def __timerLoop(self):
+        with self.__hostCond:
+            while not self.__timerDone:
+                if not self.__wakeups:
+                    self.__hostCond.wait()
+                    continue
+
+                at, key = self.__wakeups[0]
+                now = time.time()
+                if at > now:
+                    self.__hostCond.wait(at - now)
+                    continue
+
+                heapq.heappop(self.__wakeups)
+                if self.__wakeAt.get(key, None) != at: # Superseded by an earlier one
+                    continue
+                del self.__wakeAt[key]
+                self.__releaseWaiting(key)
+
+    def __hostFreed(self, url):
+        # One of the engine's own turns on the host ended, let the next go
+        key = self.__scheduler.hostKey(url)
+        with self.__hostCond:
+            if key in self.__hostQueues:
+                self.__scheduleWakeup(key, 0)
+
+    def __workerLoop(self):
+        while True:
+            priority, sequence, task = self.__frontier.get()
+            isParked = False
+            try:
+                if task is None: # Sentinel, time to exit
+                    return
+
+                url, func, args, kwargs = task
+                if self.__stopEvent.is_set(): # Drain without running
+                    if url is not None and priority == ADMITTED:
+                        self.__scheduler.release(url)
+                    continue
+
+                if url is not None:
+                    if priority != ADMITTED and not self.__admit(url, task):
+                        isParked = True
+                        continue
+                    self.__scheduler.holdTurn(url)
+
+                try:
+                    func(*args, **kwargs)
+                except Exception as e:
+                    utils.streamPrintFlush(
+                        '\033[91mTask %s failed: %s\033[00m\n'%(
+                            getattr(func, '__name__', func), e
+                        ), sys.stderr
+                    )
+                finally:
+                    if url is not None:
+                        self.__scheduler.dropTurn(url)
+                        self.__hostFreed(url)
+            finally:
+                if not isParked: # Else done once it leaves the ready queue
+                    self.__frontier.task_done()
+
+    def start(self):
+        if self.__workers:
+            return
+
+        self.__stopEvent.clear()
+        self.__timerDone = False
+        self.__timer = threading.Thread(target=self.__timerLoop, name='crawler-timer')
+        self.__timer.daemon = True
+        self.__timer.start()
+        for i in range(self.__workerCount):
+            th = threading.Thread(target=self.__workerLoop, name='crawler-%d'%(i))
+            th.daemon = True
+            th.start()
+            self.__workers.append(th)
+
+    def join(self):
+        # Blocks until every submitted task, including ones submitted
+        # by other tasks while running, has completed
+        self.__frontier.join()
+        with self.__hostCond:
+            self.__timerDone = True
+            self.__hostCond.notify_all()
+        self.__timer.join()
+
+        for i in range(len(self.__workers)):
+            self.__put(None, SENTINEL)
+        for th in self.__workers:
+            th.join()
+
+        self.__workers = []
+
+    def stop(self):
+        # Abandon any tasks not yet started; running tasks are left to finish
+        self.__stopEvent.set()
+        with self.__hostCond: # Parked tasks go back to be drained
+            for key in list(self.__hostQueues.keys()):
+                self.__releaseWaiting(key)
+
+    def run(self):
+        self.start()
+        try:
+            self.join()
+        except KeyboardInterrupt:
+            self.stop()
+            self.join()
+            raise
+
+class PageTally:
+    # Counts down the outstanding tasks of a page eg its file downloads,
+    # invoking 'onDone(successCount)' exactly once after the last one reports
+    def __init__(self, expected, onDone):
+        self.__lock = threading.Lock()
+        self.__remaining = expected
+        self.__successes = 0
+        self.__onDone = onDone
+
+    def report(self, success):
+        with self.__lock:
+            self.__remaining -= 1
+            if success:
+                self.__successes += 1
+            isLast = (self.__remaining == 0)
+
+        if isLast:
+            self.__onDone(self.__successes)
+
+def main():
+    engine = CrawlEngine(workerCount=4)
+    results = []
+    lock = threading.Lock()
+
+    def countDown(n):
+        with lock:
+            results.append(n)
+        if n > 0:
+            engine.submit(countDown, n - 1)
+
+    engine.submit(countDown, 10)
+    engine.run()
+    print(sorted(results))
+
+if __name__ == '__main__':
+    main()
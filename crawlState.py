@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+# On-disk crawl state backed by SQLite: the hits/misses caches keyed by the
+# url hash digest and the pending frontier, so that an interrupted crawl can
+# resume without re-fetching pages and files it already completed.
+
+import json
+import sqlite3
+import threading
+
+try:
+    from collections.abc import MutableMapping
+except ImportError: # Python2.X
+    from collections import MutableMapping
+
+DEFAULT_STATE_PATH = 'crawlState.db'
+
+class PersistentDict(MutableMapping):
+    # A dict whose entries are written through to a table of the state store.
+    # All entries are loaded up front so reads never touch the disk.
+    def __init__(self, state, tableName):
+        self.__state = state
+        self.__tableName = tableName
+        self.__index = state.loadTable(tableName)
+
+    def __getitem__(self, key):
+        return self.__index[key]
+
+    def __setitem__(self, key, value):
+        self.__index[key] = value
+        self.__state.putEntry(self.__tableName, key, value)
+
+    def __delitem__(self, key):
+        del self.__index[key]
+        self.__state.deleteEntry(self.__tableName, key)
+
+    def __iter__(self):
+        return iter(list(self.__index.keys()))
+
+    def __len__(self):
+        return len(self.__index)
+
+    def __contains__(self, key):
+        return key in self.__index
+
+    def clear(self):
+        self.__index.clear()
+        self.__state.clearTable(self.__tableName)
+
+class CrawlState:
+    def __init__(self, dbPath=DEFAULT_STATE_PATH):
+        self.__dbPath = dbPath
+        self.__lock = threading.RLock()
+        self.__conn = sqlite3.connect(dbPath, check_same_thread=False)
+        self.__conn.execute('PRAGMA journal_mode=WAL')
+        self.__conn.execute('PRAGMA synchronous=NORMAL')
+        self.__conn.execute(
+            'CREATE TABLE IF NOT EXISTS frontier ('
+            'id INTEGER PRIMARY KEY AUTOINCREMENT, payload TEXT NOT NULL)'
+        )
+        self.__conn.commit()
+        self.__tables = dict()
+
+    def getPath(self):
+        return self.__dbPath
+
+    def __ensureTable(self, tableName):
+        if not tableName.isalnum():
+            raise ValueError('Invalid table name %s'%(tableName))
+
+        with self.__lock:
+            self.__conn.execute(
+                'CREATE TABLE IF NOT EXISTS %s (urlHash TEXT PRIMARY KEY, value TEXT)'%(
+                    tableName
+                )
+            )
+            self.__conn.commit()
+
+    def table(self, tableName):
+        # Returns the PersistentDict for 'tableName', creating it if need be
+        with self.__lock:
+            pDict = self.__tables.get(tableName, None)
+            if pDict is None:
+                self.__ensureTable(tableName)
+                pDict = PersistentDict(self, tableName)
+                self.__tables[tableName] = pDict
+
+            return pDict
+
+    def loadTable(self, tableName):
+        with self.__lock:
+            rows = self.__conn.execute(
+                'SELECT urlHash, value FROM %s'%(tableName)
+            ).fetchall()
+
+        return dict((key, json.loads(value)) for key, value in rows)
+
+    def putEntry(self, tableName, key, value):
+        with self.__lock:
+            self.__conn.execute(
+                'INSERT OR REPLACE INTO %s (urlHash, value) VALUES (?, ?)'%(tableName),
+                (key, json.dumps(value))
+            )
+            self.__conn.commit()
+
+    def clearTable(self, tableName):
+        with self.__lock:
+            self.__conn.execute('DELETE FROM %s'%(tableName))
+            self.__conn.commit()
+
+    def deleteEntry(self, tableName, key):
+        with self.__lock:
+            self.__conn.execute('DELETE FROM %s WHERE urlHash=?'%(tableName), (key,))
+            self.__conn.commit()
+
+    def pushFrontier(self, payload):
+        # Records a pending crawl task, returns its id for 'popFrontier'
+        with self.__lock:
+            cursor = self.__conn.execute(
+                'INSERT INTO frontier (payload) VALUES (?)', (json.dumps(payload),)
+            )
+            self.__conn.commit()
+            return cursor.lastrowid
+
+    def popFrontier(self, frontierId):
+        if frontierId is None:
+            return
+
+        with self.__lock:
+            self.__conn.execute('DELETE FROM frontier WHERE id=?', (frontierId,))
+            self.__conn.commit()
+
+    def pendingFrontier(self):
+        # Returns [(frontierId, payload)...] of tasks that never completed
+        with self.__lock:
+            rows = self.__conn.execute(
+                'SELECT id, payload FROM frontier ORDER BY id'
+            ).fetchall()
+
+        return [(frontierId, json.loads(payload)) for frontierId, payload in rows]
+
+    def clearFrontier(self):
+        with self.__lock:
+            self.__conn.execute('DELETE FROM frontier')
+            self.__conn.commit()
+
+    def close(self):
+        with self.__lock:
+            self.__conn.close()
+
+def main():
+    import sys
+    state = CrawlState(sys.argv[1] if len(sys.argv) > 1 else DEFAULT_STATE_PATH)
+    print('hits', len(state.table('hits')), 'misses', len(state.table('misses')))
+    for frontierId, payload in state.pendingFrontier():
+        print(frontierId, payload)
+
+if __name__ == '__main__':
+    main()
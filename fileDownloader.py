@@ -7,21 +7,53 @@
 import os
 import sys
 import time
+import optparse
+import threading
+import collections
 
 import utils
+import crawlEngine
+import linkExtractor
+import urlCanon
+import crawlState as crawlStateModule
+import httpCache
 
 DEBUG = True # Set to False to turn off verbosity
+MAX_FILE_SIZE = None # In bytes, files larger than this are skipped. None for no limit
 startTimeSecs = time.time()
 
 hitsDict = {}
 missesDict = {}
 dlCache = dict(misses=missesDict, hits=hitsDict)
-
-def getFiles(url, extCompile, recursionDepth=5, httpDomain=utils.HTTPS_DOMAIN, baseDir=None):
+cacheLock = threading.Lock()
+inFlight = set() # Hashes of urls currently being downloaded by some worker
+crawlState = None # Set by useCrawlState for persistent and resumable crawls
+isResuming = False # Whether this run carries on the crawl of the persisted state
+visitedDict = None # Hashes of the pages fetched by this crawl, see useCrawlState
+seenDict = None # Hashes of the keys marked seen by this crawl, see newEngine
+
+def useCrawlState(state, resuming=False):
+  # Backs hitsDict, missesDict and the frontier by 'state' so they survive restarts.
+  # Unless resuming, a new crawl starts: the pages visited and keys seen by
+  # the last one are forgotten so that periodic recrawls fetch pages again
+  global crawlState, hitsDict, missesDict, dlCache, visitedDict, seenDict, isResuming
+  crawlState = state
+  isResuming = resuming
+  visitedDict = state.table('visited')
+  seenDict = state.table('seen')
+  if not resuming:
+    visitedDict.clear()
+    seenDict.clear()
+  hitsDict = state.table('hits')
+  missesDict = state.table('misses')
+  dlCache = dict(misses=missesDict, hits=hitsDict)
+
+def getFiles(url, extCompile, recursionDepth=5, httpDomain=utils.HTTPS_DOMAIN, baseDir=None, workerCount=crawlEngine.DEFAULT_WORKER_COUNT):
   # Args: url, extCompile=> A pattern object of the extension(s) to match
   #      recursionDepth => An integer that indicates how deep to scrap
   #                        Note: A negative recursion depth indicates that you want
   #                          to keep crawling as far as the program can go
+  #      workerCount => Number of worker threads fetching pages and files in parallel
   if not recursionDepth:
     return
   elif not hasattr(extCompile, 'search'):
@@ -30,39 +62,246 @@ def getFiles(url, extCompile, recursionDepth=5, httpDomain=utils.HTTPS_DOMAIN, b
     , sys.stderr)
     return
 
+  engine = newEngine(workerCount)
+  queuePage(engine, url, extCompile, recursionDepth, httpDomain, baseDir)
+  engine.run()
+
+class TargetEngine:
+  # Stands in for the shared CrawlEngine while crawling one target of a batch:
+  # at most maxActive of the target's tasks are handed to the engine at once,
+  # the rest wait their turn here without holding up a worker thread.
+  # Seen keys are kept apart per target, as are the stats
+  def __init__(self, engine, name, maxActive=None):
+    self.__engine = engine
+    self.__name = name
+    self.__maxActive = max(1, maxActive or engine.getWorkerCount())
+    self.__active = 0
+    self.__waiting = collections.deque()
+    self.__lock = threading.Lock()
+    self.__stats = dict(pages=0, files=0, failures=0, startedAt=None, finishedAt=None)
+
+  def getName(self):
+    return self.__name
+
+  def getStats(self):
+    with self.__lock:
+      stats = dict(self.__stats)
+
+    seconds = 0
+    if stats['startedAt'] is not None:
+      seconds = stats['finishedAt'] - stats['startedAt']
+    stats['seconds'] = seconds
+    stats['pagesPerSecond'] = (stats['pages'] / seconds) if seconds else 0.0
+    stats['filesPerSecond'] = (stats['files'] / seconds) if seconds else 0.0
+    return stats
+
+  def markSeen(self, key):
+    return key is not None and self.__engine.markSeen('%s %s'%(self.__name, key))
+
+  def submitOnce(self, key, func, *args, **kwargs):
+    if not self.markSeen(key):
+      return False
+    return self.submit(func, *args, **kwargs)
+
+  def submit(self, func, *args, **kwargs):
+    return self.submitFor(None, func, *args, **kwargs)
+
+  def submitFor(self, url, func, *args, **kwargs):
+    # See CrawlEngine.submitFor, url is None for tasks fetching nothing
+    with self.__lock:
+      if self.__active >= self.__maxActive:
+        self.__waiting.append((url, func, args, kwargs))
+        return True
+      self.__active += 1
+
+    return self.__dispatch(url, func, args, kwargs)
+
+  def __dispatch(self, url, func, args, kwargs):
+    if url is None:
+      return self.__engine.submit(self.__run, func, args, kwargs)
+    return self.__engine.submitFor(url, self.__run, func, args, kwargs)
+
+  def __run(self, func, args, kwargs):
+    with self.__lock:
+      if self.__stats['startedAt'] is None:
+        self.__stats['startedAt'] = time.time()
+
+    failed = True
+    try:
+      func(*args, **kwargs)
+      failed = False
+    finally:
+      with self.__lock:
+        if func is crawlPage:
+          self.__stats['pages'] += 1
+        elif func is dlForPage:
+          self.__stats['files'] += 1
+        if failed:
+          self.__stats['failures'] += 1
+        self.__stats['finishedAt'] = time.time()
+
+        nextTask = self.__waiting.popleft() if self.__waiting else None
+        if nextTask is None:
+          self.__active -= 1
+
+      if nextTask is not None: # Hand the slot straight over
+        self.__dispatch(*nextTask)
+
+def readManifest(stream):
+  # Yields the (url, extensions, depth) targets of a manifest laid out like
+  # the 'oxy' file: the answers to main's three prompts, per target, one per
+  # line. Blank lines and lines starting with '#' are skipped between targets
+  # only; within one a blank extensions line means the default extensions
+  group = []
+  for line in stream:
+    line = line.strip()
+    if not group and (not line or line.startswith('#')):
+      continue
+
+    group.append(line)
+    if len(group) < 3:
+      continue
+
+    url, extensions, depth = group
+    group = []
+    try:
+      depth = int(depth)
+    except ValueError:
+      utils.streamPrintFlush(
+        "Skipping target %s, recursion depth %r is not an integer\n"%(url, depth), sys.stderr
+      )
+      continue
+    yield url, extensions, depth
+
+  if group:
+    utils.streamPrintFlush(
+      "Ignoring the incomplete target at the manifest's end: %s\n"%(group), sys.stderr
+    )
+
+def runBatch(targets, workerCount=crawlEngine.DEFAULT_WORKER_COUNT, perTargetWorkers=None):
+  # Crawls all the (url, extensions, depth) targets at once on one pool of
+  # workerCount threads, each target running at most perTargetWorkers tasks
+  # at a time. Returns the TargetEngine of each target, for its stats
+  engine = newEngine(workerCount)
+  targetEngines = []
+  for url, extensions, depth in targets:
+    if not (url and depth):
+      continue
+
+    formedRegex = utils.extensionify(extensions or utils.DEFAULT_EXTENSIONS_REGEX)
+    targetEngine = TargetEngine(engine, '%d:%s'%(len(targetEngines), url), perTargetWorkers)
+    targetEngines.append(targetEngine)
+    queuePage(targetEngine, url, utils.regexCompile(formedRegex), depth)
+
+  engine.run()
+  return targetEngines
+
+def showBatchStats(targetEngines, stream=sys.stderr):
+  for targetEngine in targetEngines:
+    stats = targetEngine.getStats()
+    utils.streamPrintFlush(
+      "%-40s pages: %5d files: %5d failures: %3d in %8.2fs => %7.2f pages/s %7.2f files/s\n"%(
+        targetEngine.getName(), stats['pages'], stats['files'], stats['failures'],
+        stats['seconds'], stats['pagesPerSecond'], stats['filesPerSecond']
+      ), stream
+    )
+
+def resumeCrawl(workerCount=crawlEngine.DEFAULT_WORKER_COUNT):
+  # Picks up the pages that an interrupted run left on the persisted frontier
+  # Returns: the number of pages that were re-queued
+  if crawlState is None:
+    return 0
+
+  pending = crawlState.pendingFrontier()
+  if not pending:
+    return 0
+
+  utils.streamPrintFlush(
+    "Resuming %d pending pages from %s\n"%(len(pending), crawlState.getPath()), sys.stderr
+  )
+  engine = newEngine(workerCount)
+  for frontierId, payload in pending:
+    engine.markSeen(urlCanon.dedupeKey(payload['url']))
+    extCompile = utils.regexCompile(payload['extPattern'])
+    engine.submitFor(
+      payload['url'], crawlPage, engine, payload['url'], extCompile, payload['depth'],
+      payload['httpDomain'], payload['baseDir'], frontierId
+    )
+
+  engine.run()
+  return len(pending)
+
+def queuePage(engine, url, extCompile, recursionDepth, httpDomain=utils.HTTPS_DOMAIN, baseDir=None):
+  # Queues url unless this crawl already saw it under any of its spellings
   if not utils.httpHeadCompile.search(url): 
     url = "%s%s"%(httpDomain, url)
 
-  decodedData = utils.dlAndDecode(url)
-  if not decodedData:
+  url = urlCanon.canonicalize(url)
+  if not url or wasVisited(url) or not engine.markSeen(urlCanon.dedupeKey(url)):
     return
-  else:
-    urls = utils.urlCompile.findall(decodedData)
-    urls = list(
-        map(lambda s: utils.repeatHttpHeadCompile.sub(utils.HTTP_HEAD_REGEX, s), urls)
-    )
-
-    if not urls:
-       capableUrls = utils.urlCapableCompile.findall(decodedData)
-       trimmedHeadUrl = url.strip('/')
 
-       for capableUrl in capableUrls:
-          trimmed = capableUrl.strip('/')
-          fixedUrl = '%s/%s'%(trimmedHeadUrl, trimmed)
-          urls.append(fixedUrl)
+  frontierId = None
+  if crawlState is not None:
+    frontierId = crawlState.pushFrontier(dict(
+      url=url, extPattern=extCompile.pattern, depth=recursionDepth,
+      httpDomain=httpDomain, baseDir=baseDir
+    ))
+
+  engine.submitFor(url, crawlPage, engine, url, extCompile, recursionDepth, httpDomain, baseDir, frontierId)
+
+def newEngine(workerCount):
+  # With a crawl state every key marked seen is also written to the seen
+  # table, which settles the Bloom filter's 'maybe' answers exactly, so a
+  # false positive neither drops an unseen page nor re-queues a queued one
+  if seenDict is None:
+    return crawlEngine.CrawlEngine(workerCount)
+  return crawlEngine.CrawlEngine(workerCount, exactLookup=wasSeen, exactRecord=recordSeen)
+
+def wasSeen(key):
+  return utils.getHash(key) in seenDict
+
+def recordSeen(key):
+  seenDict[utils.getHash(key)] = True
+
+def wasVisited(url):
+  # True iff the interrupted run this one resumes already fetched url
+  return isResuming and utils.getHash(urlCanon.dedupeKey(url)) in visitedDict
+
+def markVisited(url):
+  # Once fetched a page is never fetched again by a resumed run, the frontier
+  # entry it keeps until done covers a crash before its links are queued
+  if visitedDict is not None:
+    visitedDict[utils.getHash(urlCanon.dedupeKey(url))] = True
+
+def finishPage(frontierId):
+  if crawlState is not None:
+    crawlState.popFrontier(frontierId)
+
+def crawlPage(engine, url, extCompile, recursionDepth, httpDomain=utils.HTTPS_DOMAIN, baseDir=None, frontierId=None):
+  # Fetches a single page off the frontier, queues up downloads of its matched
+  # files and once those are done, queues up the page's links one level deeper.
+  # The page only leaves the persisted frontier once all that is done.
+  isDeferred = False
+  try:
+    isDeferred = __crawlPage(engine, url, extCompile, recursionDepth, httpDomain, baseDir, frontierId)
+  finally:
+    if not isDeferred:
+      finishPage(frontierId)
 
-    plainUrls = []
-    matchedFileUrls = []
+def __crawlPage(engine, url, extCompile, recursionDepth, httpDomain, baseDir, frontierId):
+  # Returns: True iff completion was handed over to the page's file downloads
+  if not recursionDepth:
+    return
 
-    for u in urls:
-        pathSelector = plainUrls
-        regSearch = extCompile.search(u)
-        if regSearch:
-            g = regSearch.groups(1)
-            u = '%s.%s'%(g[0], g[1])
-            pathSelector = matchedFileUrls
+  if not utils.httpHeadCompile.search(url): 
+    url = "%s%s"%(httpDomain, url)
 
-        pathSelector.append(u)
+  decodedData = utils.dlAndDecode(url)
+  if not decodedData:
+    return
+  else:
+    markVisited(url)
+    plainUrls, matchedFileUrls = linkExtractor.extractLinks(decodedData, url, extCompile)
 
     if not baseDir:
       baseDir = os.path.abspath(".")
@@ -70,49 +309,60 @@ def getFiles(url, extCompile, recursionDepth=5, httpDomain=utils.HTTPS_DOMAIN, b
     fullUrlToMemPath = os.path.join(baseDir, utils.pathCleanseCompile.sub('_', url))
     utils.createDir(fullUrlToMemPath)
 
-    # Time to download all the matched files 
-    dlResults = []
+    if not matchedFileUrls:
+      markMiss(url)
+      return
+
+    def onPageFilesDone(downloadCount):
+      try:
+        if not downloadCount:
+          # Mark this url as a bad one/miss and for the sake of crawling 
+          # not hitting dead ends, we won't crawl it anymore unless otherwise specified
+          markMiss(url)
+          return # Cut this journey short
+
+        utils.streamPrintFlush(
+         "For url %s downloaded %d files\n"%(url, downloadCount), sys.stderr
+        )
+
+        for eachUrl in plainUrls:
+          queuePage(
+            engine, eachUrl, extCompile, recursionDepth - 1,
+            baseDir=fullUrlToMemPath
+          )
+      finally:
+        finishPage(frontierId)
+
+    # Time to download all the matched files, in parallel
+    tally = crawlEngine.PageTally(len(matchedFileUrls), onPageFilesDone)
     for eachUrl in matchedFileUrls:
-        dlResults.append(dlData(eachUrl, fullUrlToMemPath))
+      engine.submitFor(eachUrl, dlForPage, eachUrl, fullUrlToMemPath, tally)
 
-    resultsList = list(filter(lambda val: val, dlResults))
+    return True
 
-    # Report to user successful saves
-    downloadCount = len(resultsList)
-    # print(downloadCount) 
-    if not downloadCount:
-      # Mark this url as a bad one/miss and for the sake of crawling 
-      # not hitting dead ends, we won't crawl it anymore unless otherwise specified
-      urlHash = getHash(url)
-      urlScoreTuple = missesDict.get(urlHash, None)
-      badCrawlCount = 0
+def dlForPage(url, dirStoragePath, tally):
+  success = False
+  try:
+    success = dlData(url, dirStoragePath)
+  finally:
+    tally.report(success)
 
-      if urlScoreTuple and len(urlScoreTuple) != 2: 
-         badCrawlCount = (urlScoreTuple[1]) + 1 # Increment the bad crawl score
+def markMiss(url):
+  urlHash = getHash(url)
+  with cacheLock:
+    urlScoreTuple = missesDict.get(urlHash, None)
+    badCrawlCount = 0
 
-      missesDict[urlHash] = (url, badCrawlCount, time.time())
-      return # Cut this journey short
-    else:
-      utils.streamPrintFlush(
-       "For url %s downloaded %d files\n"%(url, downloadCount), sys.stderr
-      )
+    if urlScoreTuple and len(urlScoreTuple) != 2: 
+       badCrawlCount = (urlScoreTuple[1]) + 1 # Increment the bad crawl score
 
-    recursionDepth -= 1
-    for eachUrl in plainUrls:
-      getFiles(eachUrl, extCompile, recursionDepth, baseDir=fullUrlToMemPath)
+    missesDict[urlHash] = (url, badCrawlCount, time.time())
 
-def getHash(data):
-  try:
-    bEncodedData = utils.byteFyer(data, **utils.encodingArgs) 
-    hashDigest = utils.md5(bEncodedData).hexdigest()
-  except Exception:
-   return None
-  else:
-   return hashDigest
+getHash = utils.getHash
 
-def dlData(url, dirStoragePath=None):
- # Args: A url
- # Download the data from the url and write it to memory
+def dlData(url, dirStoragePath=None, maxSize=None):
+ # Args: A url, maxSize => Byte limit for the file, defaults to MAX_FILE_SIZE
+ # Download the data from the url and stream it to memory in chunks
  # Returns: True iff the data was successfully written, else: False
  if not (url and utils.httpHeadCompile.search(url)):
     return None
@@ -122,65 +372,83 @@ def dlData(url, dirStoragePath=None):
    utils.streamPrintFlush("Cannot hash the provided URL")
    return
   
- isMiss = missesDict.get(urlStrHash, None) 
- if isMiss:
-    if DEBUG:
-      utils.streamPrintFlush("Uncrawlable link: %s"%(url))
-    return None
+ with cacheLock:
+   isMiss = missesDict.get(urlStrHash, None) 
+   if isMiss:
+      if DEBUG:
+        utils.streamPrintFlush("Uncrawlable link: %s"%(url))
+      return None
+
+   alreadyIn = hitsDict.get(urlStrHash, None) or (urlStrHash in inFlight)
+   if alreadyIn:
+     if DEBUG: utils.streamPrintFlush("\033[32mAlready downloaded %s\033[00m\n"%(url))
+     return None
+
+   # Claim the url so that no other worker downloads it concurrently
+   inFlight.add(urlStrHash)
 
- alreadyIn = hitsDict.get(urlStrHash, None)
- if alreadyIn:
-   if DEBUG: utils.streamPrintFlush("\033[32mAlready downloaded %s\033[00m\n"%(url))
-   return None
+ try:
+   return __saveToDisk(url, urlStrHash, dirStoragePath, maxSize)
+ finally:
+   with cacheLock:
+     inFlight.discard(urlStrHash)
+
+def __saveToDisk(url, urlStrHash, dirStoragePath=None, maxSize=None):
+ if maxSize is None:
+   maxSize = MAX_FILE_SIZE
 
  try:
-   data = utils.urlGetter.urlopen(url)
+   with utils.openUrl(url) as data:
+     return __writeResponse(url, urlStrHash, data, dirStoragePath, maxSize)
  except Exception:
    return False
+
+def __writeResponse(url, urlStrHash, data, dirStoragePath=None, maxSize=None):
+ fileSearch = utils.endNameCompile.findall(url)
+ if not fileSearch:
+   return False
+
+ fileName = fileSearch[0]
+ fnameExtensionSeparate = utils.fnameCompile.findall(fileName)
+ if not fnameExtensionSeparate:
+   return False # Raise error possibly
+
+ proposedName, extension = fnameExtensionSeparate[0]
+  
+ # availableName = fileNameTrie.getSuggestion(proposedName)
+ # if not availableName:
+ #    print(
+ #      "Sorry no alternate suggestions for %s could be proposed"%(fileName)
+ #    )
+ #    return False
+
+ fileName = "%s.%s"%(proposedName, extension)
+ # fileNameTrie.addSeq(availableName, 0, len(availableName)) # Mark this entry as taken
+
+ if dirStoragePath and os.path.exists(dirStoragePath):
+    fileName = os.path.join(dirStoragePath, fileName)
+
+ utils.streamPrintFlush("From url %s\n"%(url), sys.stderr)
+
+ try:
+   written = utils.streamToFile(data, fileName, maxSize=maxSize)
+ except Exception: 
+   written = None
+
+ if written is None:
+   utils.streamPrintFlush("Failed to write %s to memory\n"%(fileName), sys.stderr) 
+   return False
  else:
-   fileSearch = utils.endNameCompile.findall(url)
-   if not fileSearch:
-     return False
-
-   fileName = fileSearch[0]
-   fnameExtensionSeparate = utils.fnameCompile.findall(fileName)
-   if not fnameExtensionSeparate:
-     return False # Raise error possibly
-
-   proposedName, extension = fnameExtensionSeparate[0]
-    
-   # availableName = fileNameTrie.getSuggestion(proposedName)
-   # if not availableName:
-   #    print(
-   #      "Sorry no alternate suggestions for %s could be proposed"%(fileName)
-   #    )
-   #    return False
-
-   fileName = "%s.%s"%(proposedName, extension)
-   # fileNameTrie.addSeq(availableName, 0, len(availableName)) # Mark this entry as taken
-
-   if dirStoragePath and os.path.exists(dirStoragePath):
-      fileName = os.path.join(dirStoragePath, fileName)
-
-   utils.streamPrintFlush("From url %s\n"%(url), sys.stderr)
-
-   try:
-     f = open(fileName, 'wb')
-     f.write(data.read())
-     f.close()
-   except: 
-     utils.streamPrintFlush("Failed to write %s to memory\n"%(fileName), sys.stderr) 
-     return False
-   else:
-     utils.streamPrintFlush("Wrote %s to memory\n"%(fileName), sys.stderr)
-     
-     # Let's now cache that url and mark it's content as already visited
-     # where the urlString hash is the key and downloaded urls are the values
+   utils.streamPrintFlush("Wrote %s to memory\n"%(fileName), sys.stderr)
+   
+   # Let's now cache that url and mark it's content as already visited
+   # where the urlString hash is the key and downloaded urls are the values
+   with cacheLock:
      markedContent = hitsDict.get(urlStrHash, [])
      markedContent.append(url)
      hitsDict[urlStrHash] = markedContent
 
-     return True
+   return True
 
 def readFromStream(stream=sys.stdin):
   try:
@@ -191,7 +459,51 @@ def readFromStream(stream=sys.stdin):
     EOFState = (lineIn == "")
     return lineIn, EOFState
 
+def cliParser():
+  parser = optparse.OptionParser()
+  parser.add_option('-s', '--state', dest='statePath', default='', help=\
+    "Persist hits, misses and the frontier to this SQLite file eg %s"%(
+      crawlStateModule.DEFAULT_STATE_PATH
+    ))
+  parser.add_option('-r', '--resume', dest='resume', action='store_true', default=False,
+    help="Resume pages left pending by an interrupted run, requires --state")
+  parser.add_option('-c', '--cache', dest='cachePath', default='', help=\
+    "Revalidate pages against this ETag/Last-Modified cache file eg %s"%(
+      httpCache.DEFAULT_CACHE_PATH
+    ))
+  parser.add_option('-w', '--workers', dest='workerCount', type='int',
+    default=crawlEngine.DEFAULT_WORKER_COUNT, help="Number of concurrent workers")
+  parser.add_option('-b', '--batch', dest='batch', action='store_true', default=False, help=\
+    "Crawl every target of the manifest files given as arguments, laid out like"+\
+    " the answers to the prompts eg ./oxy, all at once. '-' or none reads stdin")
+  parser.add_option('-p', '--per-target', dest='perTargetWorkers', type='int', default=None,
+    help="With --batch, most workers any one target may use, all of them by default")
+  return parser.parse_args()
+
 def main():
+  options, args = cliParser()
+  if options.cachePath:
+    utils.useHttpCache(httpCache.HttpCache(options.cachePath))
+
+  if options.statePath:
+    useCrawlState(crawlStateModule.CrawlState(options.statePath), options.resume)
+    if options.resume:
+      resumeCrawl(options.workerCount)
+  elif options.resume:
+    utils.streamPrintFlush("--resume requires a --state file\n", sys.stderr)
+
+  if options.batch:
+    targets = []
+    for manifestPath in (args or ['-']):
+      if manifestPath == '-':
+        targets.extend(readManifest(sys.stdin))
+      else:
+        with open(manifestPath) as f:
+          targets.extend(readManifest(f))
+
+    showBatchStats(runBatch(targets, options.workerCount, options.perTargetWorkers))
+    return
+
   while True:
     try:
       utils.streamPrintFlush(
@@ -234,7 +546,7 @@ def main():
         continue
 
       if extCompile:
-        getFiles(baseUrl, extCompile, rDepth)
+        getFiles(baseUrl, extCompile, rDepth, workerCount=options.workerCount)
 
   utils.streamPrintFlush("Bye..\n",sys.stderr)
 if __name__ == '__main__':
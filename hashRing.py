@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+# Consistent hash ring with weighted virtual nodes. Keys are placed with a
+# fixed digest (md5) so every process routes a key to the same node, unlike
+# str.__hash__ which is salted per process. Adding or removing a node only
+# moves the keys in the arcs that node gains or loses.
+
+import bisect
+import hashlib
+
+DEFAULT_VNODE_COUNT = 160 # Virtual nodes per unit of weight
+RING_SIZE = 1<<64
+
+def ringHash(key):
+    if not isinstance(key, bytes):
+        key = str(key).encode('utf-8')
+    return int(hashlib.md5(key).hexdigest()[:16], 16)
+
+class HashRing:
+    def __init__(self, nodes=None, vnodeCount=DEFAULT_VNODE_COUNT):
+        # nodes => Iterable of nodes or a dict mapping node to its weight
+        self.__vnodeCount = vnodeCount
+        self.__weights = dict()
+        self.__points = [] # Sorted virtual node positions
+        self.__owners = [] # Node owning the point at the same index
+
+        if hasattr(nodes, 'items'):
+            for node, weight in nodes.items():
+                self.__weights[node] = weight
+        else:
+            for node in (nodes or []):
+                self.__weights[node] = 1
+
+        self.__rebuild()
+
+    def __rebuild(self):
+        placed = []
+        for node, weight in self.__weights.items():
+            for i in range(int(round(self.__vnodeCount * weight))):
+                placed.append((ringHash('%s#%d'%(node, i)), node))
+
+        placed.sort()
+        self.__points = [point for point, node in placed]
+        self.__owners = [node for point, node in placed]
+
+    def copy(self):
+        return HashRing(dict(self.__weights), self.__vnodeCount)
+
+    def getNodes(self):
+        return list(self.__weights.keys())
+
+    def getWeight(self, node):
+        return self.__weights.get(node, 0)
+
+    def __len__(self):
+        return len(self.__weights)
+
+    def addNode(self, node, weight=1):
+        # Returns the rebalance report of the change, see 'rebalanceReport'
+        before = self.copy()
+        self.__weights[node] = weight
+        self.__rebuild()
+        return rebalanceReport(before, self)
+
+    def removeNode(self, node):
+        before = self.copy()
+        self.__weights.pop(node, None)
+        self.__rebuild()
+        return rebalanceReport(before, self)
+
+    def getNode(self, key):
+        return self.ownerAt(ringHash(key))
+
+    def ownerAt(self, position):
+        # Returns the node owning the ring position ie the first point after it
+        if not self.__points:
+            return None
+
+        index = bisect.bisect(self.__points, position) % len(self.__points)
+        return self.__owners[index]
+
+    def iterNodes(self, key):
+        # Yields each distinct node in ring order starting at key's owner,
+        # ie the order in which to fail over when the owner is unavailable
+        if not self.__points:
+            return
+
+        start = bisect.bisect(self.__points, ringHash(key))
+        seen = set()
+        total = len(self.__points)
+        for i in range(total):
+            node = self.__owners[(start + i) % total]
+            if node not in seen:
+                seen.add(node)
+                yield node
+                if len(seen) == len(self.__weights):
+                    return
+
+    def arcs(self):
+        # Returns [(start, end, node)...] covering the ring, end exclusive
+        points, owners = self.__points, self.__owners
+        if not points:
+            return []
+
+        arcs = [(0, points[0], owners[0])]
+        for i in range(1, len(points)):
+            arcs.append((points[i-1], points[i], owners[i]))
+        arcs.append((points[-1], RING_SIZE, owners[0])) # Wraps around
+        return arcs
+
+    def ownership(self):
+        # Returns the fraction of the key space owned by each node
+        shares = dict((node, 0.0) for node in self.__weights)
+        for start, end, node in self.arcs():
+            shares[node] += float(end - start) / RING_SIZE
+        return shares
+
+def rebalanceReport(before, after):
+    # Compares two rings, returning the fraction of the key space that changed
+    # owner overall, and per node the fractions it gained and lost
+    boundaries = sorted(set(
+        [0, RING_SIZE] + [end for s, end, n in before.arcs()] + [end for s, end, n in after.arcs()]
+    ))
+    gained, lost = dict(), dict()
+    moved = 0
+    for i in range(1, len(boundaries)):
+        start, end = boundaries[i-1], boundaries[i]
+        if start == end:
+            continue
+        oldOwner, newOwner = before.ownerAt(start), after.ownerAt(start)
+        if oldOwner != newOwner:
+            share = end - start
+            moved += share
+            if oldOwner is not None:
+                lost[oldOwner] = lost.get(oldOwner, 0) + float(share) / RING_SIZE
+            if newOwner is not None:
+                gained[newOwner] = gained.get(newOwner, 0) + float(share) / RING_SIZE
+
+    return dict(
+        movedFraction=float(moved) / RING_SIZE, gained=gained, lost=lost,
+        ownership=after.ownership()
+    )
+
+def main():
+    ring = HashRing(['http://192.168.1.110:8008', 'http://127.0.0.1:8009'])
+    report = ring.addNode('http://192.168.1.117:8000', weight=2)
+    print('Moved %2.2f%% of keys'%(report['movedFraction'] * 100))
+    for node, share in report['ownership'].items():
+        print(node, '%2.2f%%'%(share * 100))
+
+if __name__ == '__main__':
+    main()
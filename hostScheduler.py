@@ -0,0 +1,316 @@
+#!/usr/bin/env python3
+# Per-host politeness: token buckets spacing out requests to each domain,
+# a cap on concurrent connections per domain (waiters are served in FIFO
+# order) and a pool of keep-alive HTTP connections reused across requests.
+# Besides the blocking 'acquire', 'tryAcquire' lets crawlEngine take a host's
+# turn without parking a thread and hand it to the task that then fetches.
+
+import time
+import threading
+import collections
+
+try:
+    import http.client as httpClient
+    from urllib.parse import urlsplit, urljoin
+except ImportError: # Python2.X
+    import httplib as httpClient
+    from urlparse import urlsplit, urljoin
+
+DEFAULT_REQUESTS_PER_SECOND = 2.0
+DEFAULT_MAX_CONNECTIONS = 2 # Per host
+DEFAULT_MAX_IDLE_CONNECTIONS = 4 # Kept alive per host
+DEFAULT_MAX_REDIRECTS = 5
+REDIRECT_STATUS_CODES = (301, 302, 303, 307, 308)
+BUSY_RETRY_SECS = 0.25 # tryAcquire's retry hint when a host's connections are all in use
+
+class HttpStatusError(Exception):
+    # Raised for responses with a status code of 400 and above
+    def __init__(self, url, status, headers=None):
+        Exception.__init__(self, 'HTTP %s for %s'%(status, url))
+        self.url = url
+        self.status = status
+        self.headers = headers or {}
+
+class CrossHostRedirect(Exception):
+    # Raised by ConnectionPool.request for a redirect to another host, which
+    # the caller follows once it holds that host's politeness turn
+    def __init__(self, url, location, redirectsLeft):
+        Exception.__init__(self, 'Redirect from %s to %s'%(url, location))
+        self.url = url
+        self.location = location
+        self.redirectsLeft = redirectsLeft
+
+class TokenBucket:
+    # Refills at 'rate' tokens per second up to 'capacity' tokens
+    def __init__(self, rate, capacity=1):
+        self.__rate = float(rate)
+        self.__capacity = float(max(1, capacity))
+        self.__tokens = self.__capacity
+        self.__lastRefill = time.time()
+
+    def setRate(self, rate, capacity=None):
+        self.__refill()
+        self.__rate = float(rate)
+        if capacity is not None:
+            self.__capacity = float(max(1, capacity))
+            self.__tokens = min(self.__tokens, self.__capacity)
+
+    def getRate(self):
+        return self.__rate
+
+    def __refill(self):
+        now = time.time()
+        if self.__rate > 0:
+            self.__tokens = min(
+                self.__capacity, self.__tokens + (now - self.__lastRefill) * self.__rate
+            )
+        self.__lastRefill = now
+
+    def delayUntilAvailable(self):
+        # Returns the seconds to wait before a token can be taken, 0 if one is ready
+        self.__refill()
+        if self.__tokens >= 1:
+            return 0
+        if self.__rate <= 0: # Unthrottled
+            return 0
+        return (1 - self.__tokens) / self.__rate
+
+    def take(self):
+        self.__refill()
+        self.__tokens -= 1
+
+class HostSlot:
+    # Book-keeping for a single host: its bucket, active connections and waiters
+    def __init__(self, requestsPerSecond, maxConnections):
+        self.bucket = TokenBucket(requestsPerSecond, capacity=maxConnections)
+        self.maxConnections = maxConnections
+        self.active = 0
+        self.waiters = collections.deque()
+        self.cond = threading.Condition()
+        self.crawlDelay = None
+
+class HostScheduler:
+    def __init__(self, keyFunc=None, requestsPerSecond=DEFAULT_REQUESTS_PER_SECOND,
+            maxConnections=DEFAULT_MAX_CONNECTIONS):
+        # keyFunc maps a url to the host key that budgets are tracked by
+        self.__keyFunc = keyFunc or (lambda url: urlsplit(url).netloc.lower())
+        self.__requestsPerSecond = requestsPerSecond
+        self.__maxConnections = max(1, maxConnections)
+        self.__slots = dict()
+        self.__overrides = dict()
+        self.__lock = threading.Lock()
+        self.__local = threading.local() # heldKey => Host turn given by holdTurn
+
+    def hostKey(self, url):
+        return self.__keyFunc(url) or url
+
+    def __getSlot(self, key):
+        with self.__lock:
+            slot = self.__slots.get(key, None)
+            if slot is None:
+                rps, maxConns = self.__overrides.get(
+                    key, (self.__requestsPerSecond, self.__maxConnections)
+                )
+                slot = HostSlot(rps, maxConns)
+                self.__slots[key] = slot
+
+            return slot
+
+    def setHostLimits(self, url, requestsPerSecond=None, maxConnections=None):
+        # Overrides the default budget of the host that 'url' belongs to
+        key = self.hostKey(url)
+        rps = self.__requestsPerSecond if requestsPerSecond is None else requestsPerSecond
+        maxConns = max(1, maxConnections or self.__maxConnections)
+        with self.__lock:
+            self.__overrides[key] = (rps, maxConns)
+
+        slot = self.__getSlot(key)
+        with slot.cond:
+            slot.maxConnections = maxConns
+            slot.bucket.setRate(rps, capacity=maxConns)
+            if slot.crawlDelay:
+                slot.bucket.setRate(min(rps, 1.0/slot.crawlDelay), capacity=1)
+            slot.cond.notify_all()
+
+    def setCrawlDelay(self, url, delaySecs):
+        # Honours robots.txt 'Crawl-delay': at most one request every 'delaySecs'
+        try:
+            delaySecs = float(delaySecs)
+        except (TypeError, ValueError):
+            return False
+
+        if delaySecs <= 0:
+            return False
+
+        slot = self.__getSlot(self.hostKey(url))
+        with slot.cond:
+            slot.crawlDelay = delaySecs
+            rate = slot.bucket.getRate()
+            if rate <= 0 or rate > 1.0/delaySecs:
+                rate = 1.0/delaySecs
+            slot.bucket.setRate(rate, capacity=1)
+            slot.cond.notify_all()
+
+        return True
+
+    def tryAcquire(self, url):
+        # Takes the turn to hit the host of 'url' and returns 0 if it is free
+        # right away, else returns the seconds after which to try again
+        slot = self.__getSlot(self.hostKey(url))
+        with slot.cond:
+            if slot.waiters or slot.active >= slot.maxConnections:
+                return BUSY_RETRY_SECS
+
+            delay = slot.bucket.delayUntilAvailable()
+            if delay:
+                return delay
+
+            slot.bucket.take()
+            slot.active += 1
+            return 0
+
+    def holdTurn(self, url):
+        # Gives a turn taken by tryAcquire to the calling thread: its next
+        # 'acquire' for the host returns at once and uses it up
+        self.__local.heldKey = self.hostKey(url)
+
+    def dropTurn(self, url):
+        # Releases the turn given by holdTurn unless an 'acquire' used it
+        if getattr(self.__local, 'heldKey', None) is not None:
+            self.__local.heldKey = None
+            self.release(url)
+
+    def acquire(self, url):
+        # Blocks until it is this caller's turn to hit the host of 'url'
+        key = self.hostKey(url)
+        if getattr(self.__local, 'heldKey', None) == key:
+            self.__local.heldKey = None # See holdTurn
+            return
+
+        slot = self.__getSlot(key)
+        ticket = object()
+        with slot.cond:
+            slot.waiters.append(ticket)
+            while True:
+                if slot.waiters[0] is ticket and slot.active < slot.maxConnections:
+                    delay = slot.bucket.delayUntilAvailable()
+                    if not delay:
+                        break
+                    slot.cond.wait(delay)
+                else:
+                    slot.cond.wait()
+
+            slot.waiters.popleft()
+            slot.bucket.take()
+            slot.active += 1
+            slot.cond.notify_all()
+
+    def release(self, url):
+        slot = self.__getSlot(self.hostKey(url))
+        with slot.cond:
+            slot.active = max(0, slot.active - 1)
+            slot.cond.notify_all()
+
+class ConnectionPool:
+    # Keeps idle keep-alive connections per (scheme, host:port) for reuse
+    def __init__(self, maxIdlePerHost=DEFAULT_MAX_IDLE_CONNECTIONS):
+        self.__maxIdlePerHost = maxIdlePerHost
+        self.__idle = dict()
+        self.__lock = threading.Lock()
+
+    def __getConnection(self, key, timeout):
+        with self.__lock:
+            idleList = self.__idle.get(key, None)
+            if idleList:
+                return idleList.pop(), True
+
+        return self.__newConnection(key, timeout), False
+
+    def __newConnection(self, key, timeout):
+        scheme, netloc = key
+        if scheme == 'https':
+            return httpClient.HTTPSConnection(netloc, timeout=timeout)
+        return httpClient.HTTPConnection(netloc, timeout=timeout)
+
+    def __putConnection(self, key, conn):
+        with self.__lock:
+            idleList = self.__idle.setdefault(key, [])
+            if len(idleList) < self.__maxIdlePerHost:
+                idleList.append(conn)
+                return
+
+        conn.close()
+
+    def __send(self, key, path, headers, timeout):
+        conn, isReused = self.__getConnection(key, timeout)
+        try:
+            conn.timeout = timeout
+            if conn.sock is not None:
+                conn.sock.settimeout(timeout)
+            conn.request('GET', path, headers=headers)
+            return conn, conn.getresponse()
+        except (httpClient.HTTPException, IOError, OSError):
+            conn.close()
+            if not isReused:
+                raise
+
+        # The server dropped the kept-alive connection, retry on a fresh one
+        conn = self.__newConnection(key, timeout)
+        conn.request('GET', path, headers=headers)
+        return conn, conn.getresponse()
+
+    def request(self, url, headers=None, timeout=None, maxRedirects=DEFAULT_MAX_REDIRECTS):
+        # Performs a GET following redirects on the same host, raising
+        # CrossHostRedirect for one to another host. The caller must pass
+        # the returned response to 'release' once done reading it
+        for i in range(maxRedirects + 1):
+            parts = urlsplit(url)
+            scheme = (parts.scheme or 'http').lower()
+            key = (scheme, parts.netloc.lower())
+            path = parts.path or '/'
+            if parts.query:
+                path = '%s?%s'%(path, parts.query)
+
+            conn, response = self.__send(key, path, headers or {}, timeout)
+            response.url = url
+            response.poolKey = key
+            response.poolConnection = conn
+
+            location = response.getheader('Location')
+            if response.status in REDIRECT_STATUS_CODES and location:
+                response.read()
+                self.release(response)
+                location = urljoin(url, location)
+                if i < maxRedirects and urlsplit(location).netloc.lower() != key[1]:
+                    raise CrossHostRedirect(url, location, maxRedirects - i - 1)
+                url = location
+                continue
+
+            if response.status >= 400:
+                responseHeaders = dict(response.getheaders())
+                response.read()
+                self.release(response)
+                raise HttpStatusError(url, response.status, responseHeaders)
+
+            return response
+
+        raise HttpStatusError(url, 310, {}) # Too many redirects
+
+    def release(self, response):
+        conn = getattr(response, 'poolConnection', None)
+        if conn is None:
+            return
+
+        response.poolConnection = None
+        if response.isclosed() and not response.will_close:
+            self.__putConnection(response.poolKey, conn)
+        else: # Partially read or server asked to close, cannot be reused
+            conn.close()
+
+    def closeAll(self):
+        with self.__lock:
+            idle, self.__idle = self.__idle, dict()
+
+        for idleList in idle.values():
+            for conn in idleList:
+                conn.close()
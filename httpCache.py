@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+# HTTP revalidation cache: remembers the ETag/Last-Modified validators and
+# body of each fetched url so that later fetches can be made conditional and
+# a '304 Not Modified' answered from disk. Bodies live in a SQLite file whose
+# total size is bounded, least recently used entries being evicted first.
+
+import time
+import sqlite3
+import hashlib
+import threading
+import collections
+
+DEFAULT_CACHE_PATH = 'httpCache.db'
+DEFAULT_MAX_BYTES = 256 * (1<<20)
+
+def urlKey(url):
+    return hashlib.md5(url.encode('utf-8')).hexdigest()
+
+def getHeader(headers, name):
+    # Works for both http.client responses and plain dicts of headers
+    if hasattr(headers, 'getheader'):
+        return headers.getheader(name)
+    if hasattr(headers, 'get'):
+        return headers.get(name, None)
+    return None
+
+class HttpCache:
+    def __init__(self, dbPath=DEFAULT_CACHE_PATH, maxBytes=DEFAULT_MAX_BYTES):
+        self.__dbPath = dbPath
+        self.__maxBytes = maxBytes
+        self.__lock = threading.RLock()
+        self.__conn = sqlite3.connect(dbPath, check_same_thread=False)
+        self.__conn.execute('PRAGMA journal_mode=WAL')
+        self.__conn.execute(
+            'CREATE TABLE IF NOT EXISTS entries (urlHash TEXT PRIMARY KEY, url TEXT, '
+            'etag TEXT, lastModified TEXT, body BLOB, size INTEGER, lastAccess REAL)'
+        )
+        self.__conn.commit()
+
+        # urlHash -> size, ordered from least to most recently used
+        self.__lru = collections.OrderedDict()
+        self.__totalBytes = 0
+        for key, size in self.__conn.execute(
+                'SELECT urlHash, size FROM entries ORDER BY lastAccess'):
+            self.__lru[key] = size
+            self.__totalBytes += size
+
+        self.__stats = dict(hits=0, misses=0, stores=0, evictions=0, bytesSaved=0)
+
+    def getStats(self):
+        with self.__lock:
+            stats = dict(self.__stats)
+            stats.update(entries=len(self.__lru), totalBytes=self.__totalBytes)
+            return stats
+
+    def conditionalHeaders(self, url):
+        # Returns the If-None-Match/If-Modified-Since headers to send for url
+        key = urlKey(url)
+        with self.__lock:
+            if key not in self.__lru:
+                self.__stats['misses'] += 1
+                return {}
+
+            row = self.__conn.execute(
+                'SELECT etag, lastModified FROM entries WHERE urlHash=?', (key,)
+            ).fetchone()
+
+        headers = {}
+        if row:
+            etag, lastModified = row
+            if etag:
+                headers['If-None-Match'] = etag
+            if lastModified:
+                headers['If-Modified-Since'] = lastModified
+
+        return headers
+
+    def lookup(self, url):
+        # Returns the cached body of url after a 304, or None if it was evicted
+        key = urlKey(url)
+        with self.__lock:
+            row = self.__conn.execute(
+                'SELECT body FROM entries WHERE urlHash=?', (key,)
+            ).fetchone()
+            if not row:
+                return None
+
+            self.__lru.pop(key, None)
+            body = bytes(row[0])
+            self.__lru[key] = len(body)
+            self.__conn.execute(
+                'UPDATE entries SET lastAccess=? WHERE urlHash=?', (time.time(), key)
+            )
+            self.__conn.commit()
+            self.__stats['hits'] += 1
+            self.__stats['bytesSaved'] += len(body)
+            return body
+
+    def store(self, url, body, headers):
+        # Caches body iff the response carried validators to revalidate it with
+        etag = getHeader(headers, 'ETag')
+        lastModified = getHeader(headers, 'Last-Modified')
+        cacheControl = (getHeader(headers, 'Cache-Control') or '').lower()
+        if not (etag or lastModified) or 'no-store' in cacheControl:
+            return False
+
+        size = len(body)
+        if size > self.__maxBytes:
+            return False
+
+        key = urlKey(url)
+        with self.__lock:
+            self.__totalBytes -= self.__lru.pop(key, 0)
+            self.__conn.execute(
+                'INSERT OR REPLACE INTO entries '
+                '(urlHash, url, etag, lastModified, body, size, lastAccess) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                (key, url, etag, lastModified, sqlite3.Binary(body), size, time.time())
+            )
+            self.__lru[key] = size
+            self.__totalBytes += size
+            self.__stats['stores'] += 1
+            self.__evict()
+            self.__conn.commit()
+
+        return True
+
+    def __evict(self):
+        while self.__totalBytes > self.__maxBytes and self.__lru:
+            key, size = self.__lru.popitem(last=False)
+            self.__totalBytes -= size
+            self.__conn.execute('DELETE FROM entries WHERE urlHash=?', (key,))
+            self.__stats['evictions'] += 1
+
+    def close(self):
+        with self.__lock:
+            self.__conn.close()
+
+def main():
+    import sys
+    cache = HttpCache(sys.argv[1] if len(sys.argv) > 1 else DEFAULT_CACHE_PATH)
+    print(cache.getStats())
+
+if __name__ == '__main__':
+    main()
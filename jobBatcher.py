@@ -0,0 +1,224 @@
+#!/usr/bin/env python3
+# Batches up file urls destined for the job table. Urls are grouped per
+# owning address on the router's ring and a group is flushed once it reaches
+# 'batchSize' urls or has waited 'flushInterval' seconds. Batches for different
+# owners, and up to 'perDriverConcurrency' batches for the same owner, are
+# submitted concurrently so REST latency overlaps instead of adding up url by
+# url. WorkerDrivers are only resolved once a batch is being submitted, off the
+# crawler threads, as resolving may wait on a node still initializing.
+
+import sys
+import time
+import threading
+
+from concurrent.futures import ThreadPoolExecutor
+
+import utils
+
+DEFAULT_BATCH_SIZE = 32
+DEFAULT_FLUSH_INTERVAL = 2.0 # Seconds
+DEFAULT_PER_DRIVER_CONCURRENCY = 4
+MAX_ATTEMPTS = 3 # Per url, retried on whichever node the router fails over to
+
+class Batch:
+    def __init__(self, owner):
+        self.owner = owner # Ring address the urls hash to
+        self.items = [] # [(url, parentUrl, attempt, onDone)...]
+        self.createdAt = time.time()
+
+class JobBatcher:
+    # Args: submittedCache => Mapping of utils.getHash(url) to True for urls
+    #         already known to be in the job table, updated as batches land
+    def __init__(self, router, submittedCache, batchSize=DEFAULT_BATCH_SIZE,
+            flushInterval=DEFAULT_FLUSH_INTERVAL, perDriverConcurrency=DEFAULT_PER_DRIVER_CONCURRENCY):
+        self.__router = router
+        self.__cache = submittedCache
+        self.__batchSize = max(1, batchSize)
+        self.__flushInterval = flushInterval
+        self.__perDriverConcurrency = max(1, perDriverConcurrency)
+
+        self.__lock = threading.Lock()
+        self.__idleCond = threading.Condition(self.__lock)
+        self.__inFlight = 0 # Batches dispatched but not yet done
+        self.__pending = dict() # owner -> Batch
+        self.__queuedHashes = set() # Waiting in a batch, not yet submitted
+        self.__driverSemaphores = dict()
+        self.__stats = dict(queued=0, memoized=0, alreadyPresent=0, submitted=0, failed=0, batches=0)
+
+        self.__executor = ThreadPoolExecutor(max_workers=4 * self.__perDriverConcurrency)
+        self.__stopEvent = threading.Event()
+        self.__flusher = threading.Thread(target=self.__flushLoop, name='job-batch-flusher')
+        self.__flusher.daemon = True
+        self.__flusher.start()
+
+    def getRouter(self):
+        return self.__router
+
+    def getStats(self):
+        with self.__lock:
+            return dict(self.__stats)
+
+    def add(self, url, parentUrl='', attempt=1, onDone=None):
+        # onDone => Called with True once url is in the job table, already
+        #           was or is queued by another caller, or with False if it
+        #           could not be submitted
+        urlHash = utils.getHash(url)
+        with self.__lock:
+            isKnown = self.__cache.get(urlHash, None) is not None or urlHash in self.__queuedHashes
+            if isKnown and attempt == 1:
+                self.__stats['memoized'] += 1
+        if isKnown:
+            return self.__settle(onDone, True, False)
+
+        owner = self.__router.getOwner(url)
+        readyBatch = None
+        with self.__lock:
+            if owner is None:
+                self.__stats['failed'] += 1
+                isQueued = False
+            elif urlHash in self.__queuedHashes: # Raced with another crawler thread
+                if attempt == 1:
+                    self.__stats['memoized'] += 1
+                isQueued = False
+            else:
+                batch = self.__pending.get(owner, None)
+                if batch is None:
+                    batch = self.__pending[owner] = Batch(owner)
+
+                batch.items.append((url, parentUrl, attempt, onDone))
+                self.__queuedHashes.add(urlHash)
+                if attempt == 1:
+                    self.__stats['queued'] += 1
+
+                if len(batch.items) >= self.__batchSize:
+                    readyBatch = self.__pending.pop(owner)
+                isQueued = True
+
+        if not isQueued:
+            return self.__settle(onDone, owner is not None, False)
+
+        if readyBatch is not None:
+            self.__dispatch(readyBatch)
+
+        return True
+
+    def __settle(self, onDone, landed, result):
+        if onDone is not None:
+            onDone(landed)
+        return result
+
+    def __flushLoop(self):
+        while not self.__stopEvent.wait(self.__flushInterval / 2.0):
+            self.flush(olderThan=self.__flushInterval)
+
+    def flush(self, olderThan=None):
+        # Dispatches pending batches, only those waiting 'olderThan' seconds if set
+        now = time.time()
+        with self.__lock:
+            ready = []
+            for key, batch in list(self.__pending.items()):
+                if olderThan is None or (now - batch.createdAt) >= olderThan:
+                    ready.append(self.__pending.pop(key))
+
+        for batch in ready:
+            self.__dispatch(batch)
+
+    def __dispatch(self, batch):
+        with self.__lock:
+            self.__inFlight += 1
+        self.__executor.submit(self.__submitBatch, batch)
+
+    def __getSemaphore(self, owner):
+        with self.__lock:
+            sem = self.__driverSemaphores.get(owner, None)
+            if sem is None:
+                sem = threading.BoundedSemaphore(self.__perDriverConcurrency)
+                self.__driverSemaphores[owner] = sem
+            return sem
+
+    def __submitBatch(self, batch):
+        # resty only exposes per record getJobs/newJob calls so a batch is a
+        # sequential run of them, overlapping with the other batches in flight
+        counts = dict(alreadyPresent=0, submitted=0, failed=0)
+        retries, settled = [], []
+        with self.__getSemaphore(batch.owner):
+            for url, parentUrl, attempt, onDone in batch.items:
+                # Usually the owner's driver, or the next healthy one on the
+                # ring if the owner's circuit opened since url was queued
+                driver = self.__router.getWorkerDriver(url)
+                if driver is None:
+                    utils.streamPrintFlush('No worker driver available for %s\n'%(url), sys.stderr)
+                    outcome = 'failed'
+                else:
+                    try:
+                        outcome = self.__submitOne(driver, url, parentUrl)
+                    except Exception as e:
+                        utils.streamPrintFlush('Failed to submit %s: %s\n'%(url, e), sys.stderr)
+                        outcome = 'failed'
+
+                # The node's circuit breaker sees every outcome, so that the
+                # odd failure of a healthy node is offset by its successes
+                if outcome == 'failed':
+                    if driver is not None:
+                        self.__router.reportFailure(driver)
+                    if attempt < MAX_ATTEMPTS:
+                        retries.append((url, parentUrl, attempt + 1, onDone))
+                        continue
+                else:
+                    self.__router.reportSuccess(driver)
+
+                counts[outcome] += 1
+                settled.append((onDone, outcome != 'failed'))
+
+        with self.__lock:
+            for url, parentUrl, attempt, onDone in batch.items:
+                self.__queuedHashes.discard(utils.getHash(url))
+            for key, value in counts.items():
+                self.__stats[key] += value
+            self.__stats['batches'] += 1
+
+        for onDone, landed in settled:
+            self.__settle(onDone, landed, None)
+        for url, parentUrl, attempt, onDone in retries: # Rerouted if the node's circuit opened
+            self.add(url, parentUrl, attempt, onDone)
+
+        with self.__lock:
+            self.__inFlight -= 1
+            self.__idleCond.notify_all()
+
+    def __submitOne(self, driver, url, parentUrl):
+        urlHash = utils.getHash(url)
+        query = driver.restDriver.getJobs(message=url)
+        if (hasattr(query, 'keys') and query.get('data', None) and len(query['data'])):
+            print('Was submitted to the cloud by another crawler', url)
+            self.__cache[urlHash] = True
+            return 'alreadyPresent'
+
+        saveResponse = driver.restDriver.newJob(
+            message=url, assignedWorker_id=driver.getWorkerId(),
+            metaData=parentUrl, author=driver.getDefaultAuthor()
+        )
+        if saveResponse.get('status_code', 400) == 200:
+            print('Successfully submitted', url, 'to the cloud')
+            self.__cache[urlHash] = True
+            return 'submitted'
+
+        utils.streamPrintFlush(
+            'Failed to submit %s: status %s\n'%(url, saveResponse.get('status_code', None)), sys.stderr
+        )
+        return 'failed'
+
+    def close(self):
+        # Flushes everything still pending and waits for all batches to land
+        self.__stopEvent.set()
+        self.__flusher.join()
+        while True:
+            self.flush()
+            with self.__lock:
+                while self.__inFlight:
+                    self.__idleCond.wait()
+                if not self.__pending: # No retries were queued up meanwhile
+                    break
+
+        self.__executor.shutdown(wait=True)
+        return self.getStats()
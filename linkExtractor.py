@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+# Single pass link extraction shared by the crawlers. The document is
+# tokenized once by an incremental HTML parser: link carrying attributes are
+# canonicalized against the page url and raw urls inside text or scripts are picked
+# up from the text nodes, each link being classified as a file or a page as
+# it is found. Links are told apart by urlCanon.dedupeKey but kept as written.
+
+import utils
+import urlCanon
+
+try:
+    from html.parser import HTMLParser
+    from urllib.parse import urljoin
+except ImportError: # Python2.X
+    from HTMLParser import HTMLParser
+    from urlparse import urljoin
+
+LINK_ATTRIBUTES = frozenset(('href', 'src', 'data-src', 'data-href', 'action'))
+SKIPPED_SCHEMES = ('javascript:', 'mailto:', 'data:', 'tel:', '#')
+textUrlCompile = utils.regexCompile(r'https?://[^\s"\'<>()]+')
+repeatHeadCompile = utils.regexCompile('^(https?://)+(?=https?://)') # http://http://x
+TRAILING_PUNCTUATION = '.,;:!?'
+
+class LinkExtractor(HTMLParser):
+    # Args: baseUrl => The url of the page, relative links are resolved against it
+    #       extCompile => Pattern matching the file urls, see utils.extensionify
+    def __init__(self, baseUrl, extCompile=None):
+        try:
+            HTMLParser.__init__(self, convert_charrefs=True)
+        except TypeError: # Python2.X
+            HTMLParser.__init__(self)
+
+        self.__baseUrl = baseUrl
+        self.__extCompile = extCompile
+        self.__seen = set()
+        self.__found = []
+
+    def handle_starttag(self, tag, attrs):
+        if tag == 'base':
+            for name, value in attrs:
+                if name == 'href' and value:
+                    self.__baseUrl = urljoin(self.__baseUrl, value.strip())
+            return
+
+        for name, value in attrs:
+            if value and name in LINK_ATTRIBUTES:
+                self.__addLink(value)
+
+    handle_startendtag = handle_starttag
+
+    def handle_data(self, data):
+        if 'http' in data:
+            for url in textUrlCompile.findall(data):
+                self.__addLink(url.rstrip(TRAILING_PUNCTUATION))
+
+    def __addLink(self, link):
+        link = link.strip()
+        if not link or link.lower().startswith(SKIPPED_SCHEMES):
+            return
+
+        link = repeatHeadCompile.sub('', link)
+        url = urlCanon.canonicalize(link, self.__baseUrl)
+        if not url:
+            return
+
+        isFile = False
+        if self.__extCompile is not None:
+            regSearch = self.__extCompile.search(url)
+            if regSearch:
+                g = regSearch.groups(1)
+                url = '%s.%s'%(g[0], g[1])
+                isFile = True
+
+        key = urlCanon.dedupeKey(url)
+        if key not in self.__seen:
+            self.__seen.add(key)
+            self.__found.append((url, isFile))
+
+    def popLinks(self):
+        # Returns the [(url, isFile)...] found since the last call
+        found, self.__found = self.__found, []
+        return found
+
+def extractLinks(data, baseUrl, extCompile=None):
+    # Returns: (pageUrls, fileUrls) found in the document 'data'
+    extractor = LinkExtractor(baseUrl, extCompile)
+    try:
+        extractor.feed(data)
+        extractor.close()
+    except Exception: # Keep whatever was found before the markup broke down
+        pass
+
+    pageUrls, fileUrls = [], []
+    for url, isFile in extractor.popLinks():
+        (fileUrls if isFile else pageUrls).append(url)
+
+    return pageUrls, fileUrls
+
+def main():
+    import sys
+    url = sys.argv[1] if len(sys.argv) > 1 else 'http://www.cbc.ca'
+    extCompile = utils.regexCompile(utils.extensionify(utils.DEFAULT_EXTENSIONS_REGEX))
+    pageUrls, fileUrls = extractLinks(utils.dlAndDecode(url) or '', url, extCompile)
+    print('Pages', len(pageUrls), 'Files', fileUrls)
+
+if __name__ == '__main__':
+    main()
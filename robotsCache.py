@@ -0,0 +1,227 @@
+#!/usr/bin/env python3
+# Shared robots.txt cache. Each domain's entry expires after a TTL taken from
+# the response's Cache-Control/Expires headers. Failed fetches are remembered
+# too: a 4XX means there are no rules to honour, while a 5XX or an
+# unreachable host means the site may not be crawled for a while.
+# Concurrent lookups of a domain being fetched wait on that one fetch. Entries
+# can be snapshotted to disk for other crawler processes to load at startup.
+
+import os
+import re
+import json
+import time
+import tempfile
+import threading
+
+try:
+    from email.utils import parsedate_tz, mktime_tz
+except ImportError: # Python2.X
+    from email.Utils import parsedate_tz, mktime_tz
+
+import utils
+import hostScheduler
+
+DEFAULT_TTL = 24 * 60 * 60 # Seconds
+DEFAULT_NEGATIVE_TTL = 10 * 60 # For 5XX responses and unreachable hosts
+MIN_TTL = 60
+MAX_TTL = 7 * 24 * 60 * 60
+DEFAULT_FETCH_TIMEOUT = 10 # Seconds
+
+STATUS_OK = 'ok' # Rules were fetched
+STATUS_UNAVAILABLE = 'unavailable' # 4XX, no restrictions
+STATUS_UNREACHABLE = 'unreachable' # 5XX or network failure, nothing allowed
+
+maxAgeCompile = re.compile(r'max-age\s*=\s*(\d+)', re.IGNORECASE)
+
+class RobotsEntry:
+    def __init__(self, status, robotFile, expiresAt, rules=None):
+        self.status = status
+        self.robotFile = robotFile
+        self.expiresAt = expiresAt
+        self.rules = rules
+
+    def isExpired(self, now=None):
+        return (now or time.time()) >= self.expiresAt
+
+    def toDict(self):
+        return dict(status=self.status, robotFile=self.robotFile, expiresAt=self.expiresAt)
+
+def ttlFromHeaders(headers, defaultTtl=DEFAULT_TTL):
+    # headers => Any mapping of the response's headers, names in any case
+    headers = dict((name.lower(), value) for name, value in headers.items())
+    cacheControl = headers.get('cache-control', None) or ''
+    maxAgeSearch = maxAgeCompile.search(cacheControl)
+    if maxAgeSearch:
+        ttl = int(maxAgeSearch.groups(1)[0])
+    elif 'no-cache' in cacheControl or 'no-store' in cacheControl:
+        ttl = MIN_TTL
+    else:
+        expires = parsedate_tz(headers.get('expires', None) or '')
+        ttl = (mktime_tz(expires) - time.time()) if expires else defaultTtl
+
+    return min(MAX_TTL, max(MIN_TTL, ttl))
+
+def fetchRobotFile(robotsUrl, timeout=DEFAULT_FETCH_TIMEOUT, defaultTtl=DEFAULT_TTL,
+        negativeTtl=DEFAULT_NEGATIVE_TTL):
+    # Returns: (status, robotFile, ttl)
+    try:
+        with utils.openUrl(robotsUrl, timeout=timeout) as response:
+            body = response.read()
+            headers = dict(response.getheaders())
+    except hostScheduler.HttpStatusError as e:
+        if 400 <= e.status < 500:
+            return STATUS_UNAVAILABLE, '', ttlFromHeaders(e.headers, defaultTtl)
+        return STATUS_UNREACHABLE, '', negativeTtl
+    except Exception: # Timeouts, refused connections, bad responses
+        return STATUS_UNREACHABLE, '', negativeTtl
+
+    try:
+        robotFile = body.decode('utf-8', 'replace')
+    except AttributeError: # Python2.X str
+        robotFile = body
+
+    return STATUS_OK, robotFile, ttlFromHeaders(headers, defaultTtl)
+
+class RobotsCache:
+    # Args: compileFunc => callable(domain, robotFile) returning the compiled
+    #         rules of a successfully fetched robots.txt
+    #       fetchFunc => callable(robotsUrl) returning (status, robotFile, ttl)
+    def __init__(self, compileFunc, fetchFunc=fetchRobotFile, snapshotPath=None):
+        self.__compileFunc = compileFunc
+        self.__fetchFunc = fetchFunc
+        self.__snapshotPath = snapshotPath
+        self.__entries = dict()
+        self.__inFlight = dict() # domain -> threading.Event set once fetched
+        self.__lock = threading.Lock()
+        self.__stats = dict(hits=0, fetches=0, negative=0, waits=0)
+
+        if snapshotPath:
+            self.loadSnapshot(snapshotPath)
+
+    def getStats(self):
+        with self.__lock:
+            stats = dict(self.__stats)
+            stats['entries'] = len(self.__entries)
+            return stats
+
+    def peek(self, domain):
+        # Returns the fresh entry for domain if any, never fetching
+        with self.__lock:
+            entry = self.__entries.get(domain, None)
+
+        if entry is not None and not entry.isExpired():
+            return entry
+        return None
+
+    def isFetching(self, domain):
+        with self.__lock:
+            return domain in self.__inFlight
+
+    def get(self, domain):
+        # Returns domain's entry, fetching robots.txt at most once at a time
+        while True:
+            with self.__lock:
+                entry = self.__entries.get(domain, None)
+                if entry is not None and not entry.isExpired():
+                    self.__stats['hits'] += 1
+                    return entry
+
+                event = self.__inFlight.get(domain, None)
+                isLeader = event is None
+                if isLeader:
+                    event = self.__inFlight[domain] = threading.Event()
+                else:
+                    self.__stats['waits'] += 1
+
+            if not isLeader:
+                event.wait()
+                continue # The leader's result is in __entries now
+
+            try:
+                return self.__fetch(domain)
+            finally:
+                with self.__lock:
+                    self.__inFlight.pop(domain, None)
+                event.set()
+
+    def __fetch(self, domain):
+        status, robotFile, ttl = self.__fetchFunc(utils.robotsTxt(domain))
+        entry = self.__makeEntry(domain, status, robotFile, time.time() + ttl)
+        with self.__lock:
+            self.__entries[domain] = entry
+            self.__stats['fetches'] += 1
+            if status != STATUS_OK:
+                self.__stats['negative'] += 1
+        return entry
+
+    def __makeEntry(self, domain, status, robotFile, expiresAt):
+        rules = None
+        if status == STATUS_OK and robotFile:
+            rules = self.__compileFunc(domain, robotFile)
+        return RobotsEntry(status, robotFile, expiresAt, rules)
+
+    def loadSnapshot(self, path=None):
+        # Adds the still fresh entries of the snapshot at path
+        path = path or self.__snapshotPath
+        if not (path and os.path.exists(path)):
+            return 0
+
+        try:
+            with open(path, 'r') as f:
+                snapshot = json.load(f)
+        except (IOError, ValueError):
+            return 0
+
+        now, loaded = time.time(), 0
+        for domain, saved in snapshot.items():
+            if saved.get('expiresAt', 0) <= now:
+                continue
+
+            with self.__lock:
+                current = self.__entries.get(domain, None)
+            if current is not None and current.expiresAt >= saved['expiresAt']:
+                continue
+
+            entry = self.__makeEntry(
+                domain, saved['status'], saved.get('robotFile', ''), saved['expiresAt']
+            )
+            with self.__lock:
+                self.__entries[domain] = entry
+            loaded += 1
+
+        return loaded
+
+    def saveSnapshot(self, path=None):
+        # Merges our fresh entries into the snapshot at path, keeping whichever
+        # of ours and another process's entry expires later
+        path = path or self.__snapshotPath
+        if not path:
+            return 0
+
+        snapshot = dict()
+        if os.path.exists(path):
+            try:
+                with open(path, 'r') as f:
+                    snapshot = json.load(f)
+            except (IOError, ValueError):
+                snapshot = dict()
+
+        now = time.time()
+        with self.__lock:
+            for domain, entry in self.__entries.items():
+                saved = snapshot.get(domain, None)
+                if not entry.isExpired(now) and (saved is None or saved['expiresAt'] < entry.expiresAt):
+                    snapshot[domain] = entry.toDict()
+
+        snapshot = dict((d, e) for d, e in snapshot.items() if e['expiresAt'] > now)
+        dirPath = os.path.dirname(os.path.abspath(path))
+        fd, tmpPath = tempfile.mkstemp(prefix='.robots.', suffix='.json', dir=dirPath)
+        with os.fdopen(fd, 'w') as f:
+            json.dump(snapshot, f)
+        os.chmod(tmpPath, utils.NEW_FILE_MODE)
+        if hasattr(os, 'replace'):
+            os.replace(tmpPath, path)
+        else: # Python2.X
+            os.rename(tmpPath, path)
+
+        return len(snapshot)
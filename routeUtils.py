@@ -1,33 +1,239 @@
 #!/usr/bin/env python3
 import re
+import time
 import random
+import threading
+
+from concurrent.futures import ThreadPoolExecutor
 
 from resty import restDriver
-from routing import RouterManager
+
+import hashRing
 
 ipPortRegCompile = re.compile('(.+):([^:]+)$', re.UNICODE)
+
+DEFAULT_HEALTH_INTERVAL = 30 # Seconds between health checks of every node
+DEFAULT_INIT_WAIT = 5 # Seconds a request waits on a node still initializing
+DEFAULT_FAILURE_THRESHOLD = 3
+DEFAULT_RESET_TIMEOUT = 60 # Seconds an open circuit waits before a trial request
+
+class CircuitBreaker:
+    CLOSED, OPEN, HALF_OPEN = 'closed', 'open', 'half-open'
+
+    def __init__(self, failureThreshold=DEFAULT_FAILURE_THRESHOLD, resetTimeout=DEFAULT_RESET_TIMEOUT):
+        self.__failureThreshold = failureThreshold
+        self.__resetTimeout = resetTimeout
+        self.__failures = 0
+        self.__openedAt = 0
+        self.__trialAt = None # When the one request let through half-open went
+        self.__state = self.CLOSED
+        self.__lock = threading.Lock()
+
+    def getState(self):
+        return self.__state
+
+    def allowRequest(self):
+        # An open circuit lets a single trial request through once reset, and
+        # another only if that one never reported back within resetTimeout
+        with self.__lock:
+            now = time.time()
+            if self.__state == self.OPEN:
+                if now - self.__openedAt < self.__resetTimeout:
+                    return False
+                self.__state = self.HALF_OPEN
+            elif self.__state == self.HALF_OPEN:
+                if self.__trialAt is not None and now - self.__trialAt < self.__resetTimeout:
+                    return False
+            else:
+                return True
+
+            self.__trialAt = now
+            return True
+
+    def recordSuccess(self):
+        with self.__lock:
+            self.__failures = 0
+            self.__trialAt = None
+            self.__state = self.CLOSED
+
+    def recordFailure(self):
+        with self.__lock:
+            self.__failures += 1
+            self.__trialAt = None
+            if self.__state == self.HALF_OPEN or self.__failures >= self.__failureThreshold:
+                self.__state = self.OPEN
+                self.__openedAt = time.time()
+
+class NodeState:
+    def __init__(self, addr, target):
+        self.addr = addr
+        self.target = target # (ip, port)
+        self.driver = None
+        self.future = None
+        self.breaker = CircuitBreaker()
+        self.lock = threading.Lock()
+
 class Router:
-    def __init__(self, addrList, hashBase=10):
-        self.__addrList = addrList
-        self.__addrToDriverMap = {}
-        self.initAddrMapping(addrList, hashBase)
-
-    def initAddrMapping(self, addrList, hashBase=10):
-        self.__routeManager = RouterManager.RouterManager(hashBase=hashBase, serverAddrList=addrList)
-
-        routeMapList = self.__routeManager.getRoutingAddresses()
-        
-        for addr in routeMapList: 
-            # Build WorkerManagers
-            ipPortSearch = ipPortRegCompile.search(addr)
-            if ipPortSearch:
-                target = ipPortSearch.groups(1)
-                wD = WorkerDriver(*target)
-                self.__addrToDriverMap[addr] = wD
+    # WorkerDrivers are built lazily and concurrently in the background, so a
+    # dead or slow address no longer holds up startup. Requests for a key go
+    # to the first node on the ring, from the key's owner onwards, whose
+    # circuit breaker is closed and whose driver is up.
+    def __init__(self, addrList, vnodeCount=hashRing.DEFAULT_VNODE_COUNT, weights=None,
+            healthInterval=DEFAULT_HEALTH_INTERVAL, initWait=DEFAULT_INIT_WAIT):
+        # weights => Optional dict of address to relative capacity, default 1
+        self.__addrList = list(addrList)
+        self.__nodes = {}
+        self.__ring = hashRing.HashRing(vnodeCount=vnodeCount)
+        self.__initWait = initWait
+        self.__executor = ThreadPoolExecutor(max_workers=max(4, len(self.__addrList)))
+        self.__stopEvent = threading.Event()
+        self.initAddrMapping(self.__addrList, weights)
+
+        self.__healthInterval = healthInterval
+        self.__healthThread = threading.Thread(target=self.__healthLoop, name='router-health')
+        self.__healthThread.daemon = True
+        self.__healthThread.start()
+
+    def initAddrMapping(self, addrList, weights=None):
+        weights = weights or {}
+        for addr in addrList: # The initial membership, nothing is rebalanced
+            self.addServer(addr, weights.get(addr, 1), verbose=False)
+
+    def addServer(self, addr, weight=1, verbose=True):
+        # Places addr on the ring and starts building its WorkerDriver
+        # verbose => Print the rebalance report of the membership change
+        # Returns: the ring's rebalance report or None if addr was unusable
+        ipPortSearch = ipPortRegCompile.search(addr)
+        if not ipPortSearch:
+            return None
+
+        node = NodeState(addr, ipPortSearch.groups(1))
+        self.__nodes[addr] = node
+        if addr not in self.__addrList:
+            self.__addrList.append(addr)
+
+        report = self.__ring.addNode(addr, weight)
+        if verbose:
+            self.printRebalanceReport('Added %s'%(addr), report)
+        self.__ensureDriver(node)
+        return report
+
+    def removeServer(self, addr):
+        self.__nodes.pop(addr, None)
+        if addr in self.__addrList:
+            self.__addrList.remove(addr)
+
+        report = self.__ring.removeNode(addr)
+        self.printRebalanceReport('Removed %s'%(addr), report)
+        return report
+
+    def printRebalanceReport(self, title, report):
+        print('%s: %2.2f%% of keys moved'%(title, report['movedFraction'] * 100))
+        for addr, share in report['ownership'].items():
+            print('\t%s owns %2.2f%%'%(addr, share * 100))
+
+    def getRing(self):
+        return self.__ring
+
+    def __buildDriver(self, node):
+        try:
+            driver = WorkerDriver(*node.target)
+        except Exception as e:
+            print('Failed to initialize worker driver for', node.addr, e)
+            node.breaker.recordFailure()
+        else:
+            node.driver = driver
+            node.breaker.recordSuccess()
+
+    def __ensureDriver(self, node, isAllowed=False):
+        # Kicks off building node's driver unless one exists or is being built
+        # isAllowed => The caller already got node's breaker to let it through
+        with node.lock:
+            if node.driver is not None:
+                return None
+            if node.future is None or node.future.done():
+                if not (isAllowed or node.breaker.allowRequest()):
+                    return None
+                node.future = self.__executor.submit(self.__buildDriver, node)
+            return node.future
+
+    def getOwner(self, item):
+        # Returns the address owning item on the ring, healthy or not, at once
+        for addr in self.__ring.iterNodes(item):
+            return addr
+        return None
 
     def getWorkerDriver(self, item):
-        associatedAddr = self.__routeManager.getRoute(item.__hash__())
-        return self.__addrToDriverMap.get(associatedAddr, None)
+        # Routes on a fixed digest of item so that every crawler process
+        # agrees on which server owns it, failing over along the ring.
+        # May wait up to initWait on each node still initializing so callers
+        # that must not block, like crawler threads, should use getOwner
+        for addr in self.__ring.iterNodes(item):
+            node = self.__nodes.get(addr, None)
+            if node is None or not node.breaker.allowRequest():
+                continue
+
+            if node.driver is None:
+                future = self.__ensureDriver(node, isAllowed=True)
+                if future is not None:
+                    try:
+                        future.result(timeout=self.__initWait)
+                    except Exception: # Still initializing, try the next node
+                        pass
+
+            if node.driver is not None:
+                return node.driver
+
+        return None
+
+    def __nodeOf(self, driver):
+        for node in list(self.__nodes.values()):
+            if node.driver is driver:
+                return node
+
+    def reportFailure(self, driver):
+        # Callers report failed requests so that broken nodes get routed around
+        node = self.__nodeOf(driver)
+        if node is not None:
+            node.breaker.recordFailure()
+
+    def reportSuccess(self, driver):
+        node = self.__nodeOf(driver)
+        if node is not None:
+            node.breaker.recordSuccess()
+
+    def getHealth(self):
+        # Returns {addr: (circuitState, isInitialized)...}
+        return dict(
+            (addr, (node.breaker.getState(), node.driver is not None))
+            for addr, node in list(self.__nodes.items())
+        )
+
+    def __healthLoop(self):
+        while not self.__stopEvent.wait(self.__healthInterval):
+            for node in list(self.__nodes.values()):
+                if node.driver is None:
+                    self.__ensureDriver(node)
+                elif node.breaker.allowRequest():
+                    self.__executor.submit(self.__checkNode, node)
+
+    def __checkNode(self, node):
+        try:
+            isAlive = node.driver.isAlive()
+        except Exception:
+            isAlive = False
+
+        if isAlive:
+            node.breaker.recordSuccess()
+        else:
+            node.breaker.recordFailure()
+
+    def close(self):
+        self.__stopEvent.set()
+        try: # Drivers not being built yet never will be
+            self.__executor.shutdown(wait=False, cancel_futures=True)
+        except TypeError: # Before Python 3.9
+            self.__executor.shutdown(wait=False)
 
 class WorkerDriver:
     def __init__(self, ip, port):
@@ -75,6 +281,10 @@ class WorkerDriver:
 
             # print('addrList', addrList)
             
+    def isAlive(self):
+        response = self.restDriver.getWorkers(select='id', format='short')
+        return hasattr(response, 'get') and response.get('status_code', 400) == 200
+
     def getWorkerId(self):
         return self.__workerId
 
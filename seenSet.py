@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+# Memory compact seen-set for the crawl frontier: a scalable Bloom filter that
+# adds a larger, tighter filter each time the current one fills up, so memory
+# grows with the log of the number of urls rather than with their text.
+# Bloom filters answer 'maybe seen' falsely at a bounded rate; an optional
+# exact lookup can be supplied to settle those answers, along with the record
+# function keeping it up to date with every key added.
+
+import math
+import hashlib
+import threading
+
+DEFAULT_INITIAL_CAPACITY = 1<<16
+DEFAULT_ERROR_RATE = 0.0001
+GROWTH_FACTOR = 2
+TIGHTENING_RATIO = 0.5
+
+class BloomFilter:
+    def __init__(self, capacity, errorRate):
+        self.capacity = capacity
+        self.count = 0
+        bitCount = int(math.ceil(-capacity * math.log(errorRate) / (math.log(2) ** 2)))
+        self.__bitCount = max(8, bitCount)
+        self.__hashCount = max(1, int(round(math.log(2) * self.__bitCount / capacity)))
+        self.__bits = bytearray((self.__bitCount + 7) // 8)
+
+    def __indices(self, key):
+        # Double hashing: h1 + i*h2 for i in [0, k)
+        digest = hashlib.md5(key.encode('utf-8')).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        for i in range(self.__hashCount):
+            yield (h1 + i * h2) % self.__bitCount
+
+    def __contains__(self, key):
+        bits = self.__bits
+        for index in self.__indices(key):
+            if not bits[index >> 3] & (1 << (index & 7)):
+                return False
+        return True
+
+    def add(self, key):
+        bits = self.__bits
+        for index in self.__indices(key):
+            bits[index >> 3] |= (1 << (index & 7))
+        self.count += 1
+
+    def isFull(self):
+        return self.count >= self.capacity
+
+    def byteSize(self):
+        return len(self.__bits)
+
+class ScalableBloomFilter:
+    def __init__(self, initialCapacity=DEFAULT_INITIAL_CAPACITY, errorRate=DEFAULT_ERROR_RATE):
+        self.__initialCapacity = initialCapacity
+        self.__errorRate = errorRate
+        self.__filters = []
+        self.__addFilter()
+
+    def __addFilter(self):
+        n = len(self.__filters)
+        capacity = self.__initialCapacity * (GROWTH_FACTOR ** n)
+        # Tightening each new filter keeps the compound error rate bounded
+        errorRate = self.__errorRate * (1 - TIGHTENING_RATIO) * (TIGHTENING_RATIO ** n)
+        self.__filters.append(BloomFilter(capacity, errorRate))
+
+    def __contains__(self, key):
+        for bFilter in reversed(self.__filters):
+            if key in bFilter:
+                return True
+        return False
+
+    def add(self, key):
+        current = self.__filters[-1]
+        if current.isFull():
+            self.__addFilter()
+            current = self.__filters[-1]
+        current.add(key)
+
+    def __len__(self):
+        return sum(bFilter.count for bFilter in self.__filters)
+
+    def byteSize(self):
+        return sum(bFilter.byteSize() for bFilter in self.__filters)
+
+class SeenSet:
+    # Args: exactLookup => Optional callable(key) returning whether key was
+    #         really seen, consulted only when the filter says 'maybe'
+    #       exactRecord => Optional callable(key) storing key for exactLookup,
+    #         called for every key added. Without it exactLookup has to know
+    #         of every added key by other means
+    def __init__(self, initialCapacity=DEFAULT_INITIAL_CAPACITY,
+            errorRate=DEFAULT_ERROR_RATE, exactLookup=None, exactRecord=None):
+        self.__bloom = ScalableBloomFilter(initialCapacity, errorRate)
+        self.__exactLookup = exactLookup
+        self.__exactRecord = exactRecord
+        self.__lock = threading.Lock()
+
+    def __contains__(self, key):
+        with self.__lock:
+            maybeSeen = key in self.__bloom
+
+        if maybeSeen and self.__exactLookup is not None:
+            return bool(self.__exactLookup(key))
+        return maybeSeen
+
+    def add(self, key):
+        # Marks key as seen. Returns True iff it had not been seen before.
+        # Lookup and record happen under one lock so that concurrent adds of
+        # a key the filter falsely reports can not both pass as new
+        with self.__lock:
+            if key in self.__bloom:
+                if self.__exactLookup is None or self.__exactLookup(key):
+                    return False
+            else:
+                self.__bloom.add(key)
+
+            if self.__exactRecord is not None:
+                self.__exactRecord(key)
+            return True
+
+    def __len__(self):
+        return len(self.__bloom)
+
+    def byteSize(self):
+        return self.__bloom.byteSize()
+
+def main():
+    seen = SeenSet(initialCapacity=1000)
+    n = 100000
+    for i in range(n):
+        seen.add('http://example.org/%d'%(i))
+    falsePositives = sum(1 for i in range(n, 2*n) if 'http://example.org/%d'%(i) in seen)
+    print('items', len(seen), 'bytes', seen.byteSize(), 'falsePositives', falsePositives)
+
+if __name__ == '__main__':
+    main()
@@ -6,16 +6,44 @@
 import sys
 
 import utils
+import crawlEngine
+import linkExtractor
+import urlCanon
+import jobBatcher
+import crawlState as crawlStateModule
+import httpCache
 import RobotParser
 from resty import restDriver
 from routeUtils import WorkerDriver, Router
 
-__LOCAL_CACHE = dict()
+__LOCAL_CACHE = dict() # Hashes of urls already submitted, see utils.getHash
+crawlState = None # Set by useCrawlState for persistent and resumable crawls
+isResuming = False # Whether this run carries on the crawl of the persisted state
+visitedDict = None # Hashes of the pages fetched by this crawl, see useCrawlState
+seenDict = None # Hashes of the keys marked seen by this crawl, see newEngine
+STATE_FLAG = '--state='
+CACHE_FLAG = '--cache='
+RESUME_FLAG = '--resume'
+ROBOTS_FLAG = '--robots='
 
 robotParser = RobotParser.RobotParser()
 DEFAULT_TIMEOUT = 5 # Seconds
 
-def extractFileUrls(url, extCompile, router, depth=5, httpDomain=utils.HTTPS_DOMAIN):
+def useCrawlState(state, resuming=False):
+  # Persists the submitted-urls cache and the frontier so that runs can resume.
+  # Unless resuming, the pages visited and keys seen by the last crawl are
+  # forgotten so that periodic recrawls fetch pages again
+  global crawlState, __LOCAL_CACHE, visitedDict, seenDict, isResuming
+  crawlState = state
+  isResuming = resuming
+  __LOCAL_CACHE = state.table('submitted')
+  visitedDict = state.table('visited')
+  seenDict = state.table('seen')
+  if not resuming:
+    visitedDict.clear()
+    seenDict.clear()
+
+def extractFileUrls(url, extCompile, router, depth=5, httpDomain=utils.HTTPS_DOMAIN, workerCount=crawlEngine.DEFAULT_WORKER_COUNT):
   # Args: url, extCompile=> A pattern object of the extension(s) to match
   #      depth => An integer that indicates how deep to scrap
   #                        Note: A negative recursion depth indicates that you want
@@ -28,6 +56,99 @@ def extractFileUrls(url, extCompile, router, depth=5, httpDomain=utils.HTTPS_DOM
     )
     return
 
+  batcher = jobBatcher.JobBatcher(router, __LOCAL_CACHE)
+  engine = newEngine(workerCount)
+  queuePage(engine, url, extCompile, batcher, depth, httpDomain)
+  try:
+    engine.run()
+  finally:
+    print('Job submissions', batcher.close())
+
+def resumeCrawl(router, workerCount=crawlEngine.DEFAULT_WORKER_COUNT):
+  # Re-queues the pages an interrupted run left on the persisted frontier
+  if crawlState is None:
+    return 0
+
+  pending = crawlState.pendingFrontier()
+  if pending:
+    print('Resuming %d pending pages from %s'%(len(pending), crawlState.getPath()))
+    batcher = jobBatcher.JobBatcher(router, __LOCAL_CACHE)
+    engine = newEngine(workerCount)
+    for frontierId, payload in pending:
+      engine.markSeen(urlCanon.dedupeKey(payload['url']))
+      engine.submitFor(
+        payload['url'], crawlPage, engine, payload['url'], utils.regexCompile(payload['extPattern']),
+        batcher, payload['depth'], payload['httpDomain'], frontierId
+      )
+    try:
+      engine.run()
+    finally:
+      print('Job submissions', batcher.close())
+
+  return len(pending)
+
+def queuePage(engine, url, extCompile, batcher, depth, httpDomain=utils.HTTPS_DOMAIN):
+  # Queues url unless this crawl already saw it under any of its spellings
+  if not utils.httpHeadCompile.search(url): 
+    url = "%s%s"%(httpDomain, url)
+
+  url = urlCanon.canonicalize(url)
+  if not url or wasVisited(url) or not engine.markSeen(urlCanon.dedupeKey(url)):
+    return
+
+  if depth: # Have the host's robots.txt ready by the time the page is crawled
+    robotParser.prefetch(url)
+
+  frontierId = None
+  if crawlState is not None:
+    frontierId = crawlState.pushFrontier(dict(
+      url=url, extPattern=extCompile.pattern, depth=depth, httpDomain=httpDomain
+    ))
+
+  engine.submitFor(url, crawlPage, engine, url, extCompile, batcher, depth, httpDomain, frontierId)
+
+def newEngine(workerCount):
+  # With a crawl state every key marked seen is also written to the seen
+  # table, which settles the Bloom filter's 'maybe' answers exactly, so a
+  # false positive neither drops an unseen page nor re-queues a queued one
+  if seenDict is None:
+    return crawlEngine.CrawlEngine(workerCount)
+  return crawlEngine.CrawlEngine(workerCount, exactLookup=wasSeen, exactRecord=recordSeen)
+
+def wasSeen(key):
+  return utils.getHash(key) in seenDict
+
+def recordSeen(key):
+  seenDict[utils.getHash(key)] = True
+
+def wasVisited(url):
+  # True iff the interrupted run this one resumes already fetched url
+  return isResuming and utils.getHash(urlCanon.dedupeKey(url)) in visitedDict
+
+def markVisited(url):
+  if visitedDict is not None:
+    visitedDict[utils.getHash(urlCanon.dedupeKey(url))] = True
+
+def finishPage(frontierId):
+  if crawlState is not None:
+    crawlState.popFrontier(frontierId)
+
+def crawlPage(engine, url, extCompile, batcher, depth, httpDomain=utils.HTTPS_DOMAIN, frontierId=None):
+  # batcher => jobBatcher.JobBatcher that the page's file urls are handed to.
+  # The page leaves the persisted frontier once they have all landed in the
+  # job table, a resumed run crawling it again otherwise
+  isDeferred = False
+  try:
+    isDeferred = __crawlPage(engine, url, extCompile, batcher, depth, httpDomain, frontierId)
+  finally:
+    if not isDeferred:
+      finishPage(frontierId)
+
+def __crawlPage(engine, url, extCompile, batcher, depth, httpDomain, frontierId):
+  # Returns: True iff completion was handed over to the page's job submissions
+  if not depth:
+    return
+
   if not utils.httpHeadCompile.search(url): 
     url = "%s%s"%(httpDomain, url)
 
@@ -39,50 +160,26 @@ def extractFileUrls(url, extCompile, router, depth=5, httpDomain=utils.HTTPS_DOM
   if not decodedData:
     return
   else:
-    urls = utils.urlCompile.findall(decodedData)
-    urls = [utils.repeatHttpHeadCompile.sub(utils.HTTP_HEAD_REGEX, s) for s in urls]
-
-    plainUrls = []
-    matchedFileUrls = []
+    markVisited(url)
+    plainUrls, matchedFileUrls = linkExtractor.extractLinks(decodedData, url, extCompile)
 
-    for u in urls:
-        pathSelector = plainUrls
-        regSearch = extCompile.search(u)
-        if regSearch:
-            rGroup = regSearch.groups(1)
-            u = '%s.%s'%(rGroup[0], rGroup[1])
-            pathSelector = matchedFileUrls
+    depth -= 1
+    for eachUrl in plainUrls:
+      queuePage(engine, eachUrl, extCompile, batcher, depth)
 
-        pathSelector.append(u)
+    fileUrls = set(matchedFileUrls)
+    if not fileUrls:
+      return
 
-    uniqFileUrls = set(matchedFileUrls)
-    dlResults = [pushUpJob(eachUrl, router, url) for eachUrl in uniqFileUrls]
-    resultsList = [val for val in dlResults if val]
+    def onPageJobsDone(landedCount):
+      if landedCount == len(fileUrls):
+        finishPage(frontierId)
 
-    depth -= 1
-    for eachUrl in plainUrls:
-      extractFileUrls(eachUrl, extCompile, router, depth)
+    tally = crawlEngine.PageTally(len(fileUrls), onPageJobsDone)
+    for eachUrl in fileUrls:
+      batcher.add(eachUrl, url, onDone=tally.report)
 
-def pushUpJob(url, router, parentUrl=''):
-    # First query if this item was already seen by this worker
-    if __LOCAL_CACHE.get(url, None) is not None:
-        print('Already locally memoized as submitted to cloud', url)
-    else:
-        # Query if this file is already present 
-        rDriver = router.getWorkerDriver(url)
-        query = rDriver.restDriver.getJobs(message=url)
-        if (hasattr(query, 'keys') and query.get('data', None) and len(query['data'])):
-            print('Was submitted to the cloud by another crawler', url)
-            __LOCAL_CACHE[url] = True
-        else:
-            saveResponse = rDriver.restDriver.newJob(
-                message=url, assignedWorker_id=rDriver.getWorkerId(),
-                metaData=parentUrl, author=rDriver.getDefaultAuthor()
-            )
-
-            if saveResponse.get('status_code', 400) == 200:
-                print('Successfully submitted', url, 'to the cloud')
-                __LOCAL_CACHE[url] = True
+    return True
 
 def readFromStream(stream=sys.stdin):
   try:
@@ -93,13 +190,56 @@ def readFromStream(stream=sys.stdin):
     EOFState = (lineIn == "")
     return lineIn, EOFState
 
+def popCliFlags():
+  # Takes out this script's own flags before resty's parser sees the arguments
+  statePath, cachePath, robotsPath, resume = '', '', '', False
+  remaining = []
+  for arg in sys.argv[1:]:
+    if arg.startswith(STATE_FLAG):
+      statePath = arg[len(STATE_FLAG):]
+    elif arg.startswith(CACHE_FLAG):
+      cachePath = arg[len(CACHE_FLAG):]
+    elif arg.startswith(ROBOTS_FLAG):
+      robotsPath = arg[len(ROBOTS_FLAG):]
+    elif arg == RESUME_FLAG:
+      resume = True
+    else:
+      remaining.append(arg)
+
+  sys.argv[1:] = remaining
+  return statePath, cachePath, robotsPath, resume
+
 def main():
+  global robotParser
+  statePath, cachePath, robotsPath, resume = popCliFlags()
   args, options = restDriver.cliParser()
+  if cachePath:
+    utils.useHttpCache(httpCache.HttpCache(cachePath))
+  if robotsPath:
+    robotParser = RobotParser.RobotParser(snapshotPath=robotsPath)
 
   # Route manager
   router = Router([
       'http://192.168.1.117:8000', 'http://192.168.1.110:8008', 'http://127.0.0.1:8009'
   ])
+
+  try:
+    if statePath:
+      useCrawlState(crawlStateModule.CrawlState(statePath), resume)
+      if resume:
+        resumeCrawl(router)
+    elif resume:
+      utils.streamPrintFlush("%s requires %sPATH\n"%(RESUME_FLAG, STATE_FLAG), sys.stderr)
+
+    crawlTargets(router, robotsPath)
+  finally: # The router's driver builds would otherwise keep the process alive
+    router.close()
+    robotParser.close()
+
+  utils.streamPrintFlush("Bye..\n",sys.stderr)
+
+def crawlTargets(router, robotsPath=''):
+  # Crawls the targets read off stdin, the answers to the prompts, until EOF
   while True:
     try:
       utils.streamPrintFlush(
@@ -154,8 +294,8 @@ def main():
 
       if extCompile:
         extractFileUrls(baseUrl, extCompile, router, rDepth)
-
-  utils.streamPrintFlush("Bye..\n",sys.stderr)
+        if robotsPath: # Let other crawler processes skip our robots.txt fetches
+          robotParser.saveSnapshot()
 
 if __name__ == '__main__':
   try:
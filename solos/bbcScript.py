@@ -2,16 +2,17 @@
 
 #Author: Emmanuel Odeke <odeke@ualberta.ca>
 #bbcScript.py v1.0 Crawl the bbc.co.uk. website.
-#Extract an xml tree, and recursively traverse the tree's links.
+#Extract the page's list items, and crawl their links on newsCrawler's engine.
 
 import re
 import sys
 
-from xml.dom import minidom
-
 from sitereader import *
+from listItemParser import iterListItems
 from newsfuncs  import *
 from newsreaderConstants import *
+import newsCrawler
+import urlCanon
 
 ################################CONSTANTS###################################
 
@@ -20,70 +21,25 @@ NEWLINE	    = '\n'
 TAB	    = '\t'
 NULL_STR    = ''
 
-##############################REGEXS########################################
-
-URL_REGEX	= r'<a\s+.*\s*href="([^<>]*)">.*</a>'
-HEADLINE_REGEX	= r'([^>]*)</a>'
-LIST_ITEM_STR	= 'li'
-urlRegCompile = re.compile(URL_REGEX, re.UNICODE)
-headlineRegCompile = re.compile(HEADLINE_REGEX, re.UNICODE)
-
 ###########################################################################
 
 def isfullUrl(linkStr):
    return (re.search(HTTP_S_HEADER,linkStr) != None)
 
-def getXMLTree(htmlString):
-   xml_tree = minidom.parseString(htmlString)
-   return xml_tree
-
-def getBBCSiteData(bbc_url, stderrStream, errorVerbosity):
-   "Return a list of links extracted from reading html content of a bbc url.\n\
-    Pass in the stderrStream io_buffer to write to output as well as the\
-     'errorVerbosity' flag to turn on/off active error reporting"
-   bbc_html_data = site_opener(bbc_url, stderrStream, errorVerbosity) 
-   if not bbc_html_data:
-      return None
-
-   try:
-      xml_tree = getXMLTree(bbc_html_data)
-
-   except Exception as e:
-      print(e)
-      return None
-   
-   elements = xml_tree.documentElement
-   li_items = elements.getElementsByTagName(LIST_ITEM_STR)
-
+def extractBBCLinks(bbc_html_data, bbc_url=bbc_url):
+   "Return (report text, links) for the list items of the html content of a\n\
+    bbc page, relative links being completed with 'bbc_url'"
    outdata  = NULL_STR
    links    = []
 
-   for item in li_items:
-
-      value = item.toprettyxml()
-
-      value = value.replace(HTML_AMPERSAND,ASCII_AMPERSAND)
-      value = value.replace(NEWLINE,NULL_STR)
-      value = value.replace(TAB,NULL_STR)
-
-      LINK_MATCH     = urlRegCompile.findall(value)
-      HEADLINE_MATCH = headlineRegCompile.search(value)
-
-      if HEADLINE_MATCH:
-         headline = HEADLINE_MATCH.groups(1)[0]
+   # One pass over the markup, see listItemParser
+   for item in iterListItems(bbc_html_data):
+      headline = item.headline()
+      if headline:
          outdata += '%-65s %s'%(headline, TAB)
 
-      if LINK_MATCH:
-         child_link = LINK_MATCH[0]
-         child_link = child_link.strip('"')
-         child_link = correctMalformed(child_link)
-         REV_FOUND  = child_link.find('rev="')
-
-         if REV_FOUND != -1:
-            child_link = child_link[ :REV_FOUND ]
-
-         child_link = re.sub('rev="(.*)"',"", str(child_link))
-
+      child_link = item.firstAnchorLink()
+      if child_link:
          if not (isfullUrl(child_link)):
             child_link = bbc_url  + child_link
 
@@ -92,20 +48,36 @@ def getBBCSiteData(bbc_url, stderrStream, errorVerbosity):
 
       outdata += NEWLINE
 
+   return outdata, links
+
+def getBBCSiteData(bbc_url, stderrStream, errorVerbosity):
+   "Return a list of links extracted from reading html content of a bbc url.\n\
+    Pass in the stderrStream io_buffer to write to output as well as the\
+     'errorVerbosity' flag to turn on/off active error reporting"
+   bbc_html_data = site_opener(bbc_url, stderrStream, errorVerbosity) 
+   if not bbc_html_data:
+      return None
+
+   outdata, links = extractBBCLinks(bbc_html_data)
    stderrStream.write(outdata)
    stderrStream.flush()
 
    return links
 
-def recurLinks(parent_link, stderr, errorVerbosity):
-   children_links    = getBBCSiteData(parent_link, stderr, errorVerbosity)
+class BBCAdapter(newsCrawler.SiteAdapter):
+   # The front page then every page it links to, see newsCrawler
+   name            = 'bbc'
+   startUrls       = (bbc_url,)
+   maxDepth        = 1
+   reportsToStderr = True
 
-   if not children_links: 
-      return None
+   def extract(self, pageUrl, data):
+      outdata, links = extractBBCLinks(data)
+      startKeys = [urlCanon.dedupeKey(url) for url in self.startUrls]
+      if urlCanon.dedupeKey(pageUrl) in startKeys: # The links about to be crawled
+         print('links', links)
+      return outdata, links
 
-   for child in children_links:
-      grand_children_links = recurLinks(child, stderr, errorVerbosity)
-      
 def main():
    parser          = command_line_parse()
    options, args   = parser
@@ -114,11 +86,13 @@ def main():
    errorVerbosity  = options.errorVerbosity
    
    stderr = setStderr(stderrFName)   
-   links  = getBBCSiteData(bbc_url, stderr, errorVerbosity)
-   print('links', links)
+   useSiteCache(options.cachePath)
+   useSiteTimeout(options.timeout)
 
-   for link in links:
-      getBBCSiteData(link, stderr, errorVerbosity)   
+   crawler = newsCrawler.NewsCrawler(
+      [BBCAdapter(stream=stderr)], stderr, errorVerbosity, workerCount=options.workerCount
+   )
+   crawler.run()
 
 if __name__ == '__main__':
    main()
@@ -2,16 +2,19 @@
 # Author: Emmanuel Odeke <odeke@ualberta.ca>
 # CNNscript.py v1.0 
 # Script to crawl the CNN website:
-#     Recursively crawl the links on the page. To control the amount of crawling, 
-#     the attribute 'recursionDepth' is checked and gives the kick to signal
-#     an end to crawling a link 
+#     Crawl the links on the page on newsCrawler's engine. To control the amount
+#     of crawling, the attribute 'recursionDepth' is checked and gives the kick
+#     to signal an end to crawling a link. Each url is fetched at most once and
+#     the number of links queued up is bounded.
 
 import re
 import sys
+import threading
 
 from sitereader import *
 from newsfuncs  import *
 from newsreaderConstants import *
+import newsCrawler
 
 #########################################CONSTANTS#####################################
 CNN_URL               = 'http://www.cnn.com/'
@@ -19,69 +22,109 @@ FROM_CLASS_LINK_REGEX = r'<li class=".*"><a href="(.*)"><span>(.*)</span></a></l
 LINK_INNER_HTML_REGEX = r'<a href="(.*)">(.*)</a>\s*'
 HEADINGS_REGEX        = r'.*<h[1-9]><span><a href="(.*)">(.*)</a></span></h[1-9]>\s*'
 IMG_ATTRIBUTES        = ['alt','width','border','height']
+IMGSRC_REGEX          = r'<.*="(https?:[^"]*\.\w+)"\s*(?:%s)=.*'%( '|'.join( IMG_ATTRIBUTES ) )
+CLEANED_URL_REGEX     = r'"?(https?:[^"]*)">([^<]*)'
+MAX_FOLLOWED_LINKS    = 500 # Most links followed in a run, across all its pages
 #######################################################################################
 
-def getLinks( xmlLine, stderr, errorVerbosity, photoLinkStorage, recursionDepth ):
-    "Extracts and prints headlines and links extracted from the xmlLine\n\
-    Mutually calls 'getCNNXML(...)' recursively, to extract xmldata for every link"
-    if ( not xmlLine ) or ( not recursionDepth ):
-        return 
-
-    recursionDepth -= 1
-    xmlLine = re.sub( HTML_AMPERSAND, ASCII_AMPERSAND, xmlLine )
-    urlLocSearchQuery = re.search( FROM_CLASS_LINK_REGEX, xmlLine )
-
-    if not urlLocSearchQuery: #Try another urlLoc pattern
-        urlLocSearchQuery = re.search( LINK_INNER_HTML_REGEX, xmlLine )
-
-    if urlLocSearchQuery:
-        urlLoc,urlLocHeadline = urlLocSearchQuery.groups()
-    
-        for attr in IMG_ATTRIBUTES:
-            #Test and Rip-out the photoLink
-            IMGSRC_REGEX = r'<.*="(https?:[^"]*\.\w+)"\s*%s=.*'%( attr )
-            imgsrcpat = re.search( IMGSRC_REGEX, urlLocHeadline )
-
-            if imgsrcpat:
-                imgresults = imgsrcpat.groups( 1 )[0]
-                photoLinkStorage += [ imgresults ]
-
-        urlLocCleaned = re.findall( r'"?(https?:[^"]*)">([^<]*)', urlLoc )
+fromClassLinkCompile = re.compile( FROM_CLASS_LINK_REGEX )
+linkInnerHtmlCompile = re.compile( LINK_INNER_HTML_REGEX )
+imgSrcCompile        = re.compile( IMGSRC_REGEX )
+cleanedUrlCompile    = re.compile( CLEANED_URL_REGEX )
+markupLeakCompile    = re.compile( r'[\s"<>]' ) # A greedy match ran past the href
+
+def iterRecords( data ):
+    "Yields a (headline, url, imageUrl or None) record for every link in the\n\
+    page data, matching the precompiled patterns line by line in one pass"
+    for xmlLine in data.splitlines():
+        if not xmlLine:
+            continue
+
+        xmlLine = xmlLine.replace( HTML_AMPERSAND, ASCII_AMPERSAND )
+        urlLocSearchQuery = fromClassLinkCompile.search( xmlLine )
+        if not urlLocSearchQuery: #Try another urlLoc pattern
+            urlLocSearchQuery = linkInnerHtmlCompile.search( xmlLine )
+        if not urlLocSearchQuery:
+            continue
+
+        urlLoc, urlLocHeadline = urlLocSearchQuery.groups()
+        imgsrcpat = imgSrcCompile.search( urlLocHeadline ) #Rip-out the photoLink
+        imageUrl  = imgsrcpat.groups( 1 )[0] if imgsrcpat else None
+
+        urlLocCleaned = cleanedUrlCompile.findall( urlLoc )
         if urlLocCleaned:
-            for extraLink in urlLocCleaned:
-                urlLoc, headLine = extraLink
-                print( '{}   :   {}\n'.format( headLine, urlLoc ))
+            for urlLoc, headLine in urlLocCleaned:
+                yield headLine, urlLoc, imageUrl
         else:
-            print( '{}   :   {}\n'.format( urlLocHeadline, urlLoc ) )
-        getCNNXML( urlLoc, stderr, errorVerbosity, photoLinkStorage, recursionDepth )
-
-def getCNNXML( CNN_URL, stderr, errorVerbosity, photoStorage, recursionDepth=5 ):
-    "Opens the url, returning the xmldata retrieved, and for every line in the data\n\
-    mutually calls 'getLinks(...)' recursively, to extract headlines, and links"
-    data = site_opener( CNN_URL, stderr, errorVerbosity )
-    if ( not data ) or ( not recursionDepth ):
-        return 
-
-    data = data.split( '\n' )
-    recursionDepth -= 1
-    #print( "RecursionDepth: ", recursionDepth )
-
-    for line in data:
-        getLinks( line, stderr, errorVerbosity, photoStorage, recursionDepth )
+            yield urlLocHeadline, urlLoc, imageUrl
+
+class CNNAdapter( newsCrawler.SiteAdapter ):
+    # Prints each link's headline and collects the photo links, see newsCrawler
+    name      = 'cnn'
+    startUrls = ( CNN_URL, )
+    maxDepth  = 1
+
+    def __init__( self, stream=None, maxDepth=None, startUrls=None, photoStorage=None,
+            maxFollowed=MAX_FOLLOWED_LINKS, printPhotos=True ):
+        newsCrawler.SiteAdapter.__init__( self, stream, maxDepth, startUrls )
+        self.photoStorage = [] if photoStorage is None else photoStorage
+        self.printPhotos = printPhotos
+        self.__maxFollowed = maxFollowed
+        self.__followed = 0
+        self.__lock = threading.Lock()
+
+    def extract( self, pageUrl, data ):
+        outLines, links = [], []
+        for headLine, urlLoc, imageUrl in iterRecords( data ):
+            if imageUrl:
+                self.photoStorage.append( imageUrl )
+            outLines.append( '{}   :   {}\n\n'.format( headLine, urlLoc ) )
+
+            if not markupLeakCompile.search( urlLoc ): # A greedy match is no url
+                links.append( urlLoc )
+
+        with self.__lock: # Links found once the budget is spent are not followed
+            links = links[:max( 0, self.__maxFollowed - self.__followed )]
+            self.__followed += len( links )
+
+        return ''.join( outLines ), links
+
+    def finish( self ):
+        if not self.printPhotos:
+            return ''
+        return ''.join( '%s\n'%( imgLink ) for imgLink in self.photoStorage )
+
+def getCNNXML( CNN_URL, stderr, errorVerbosity, photoStorage, recursionDepth=5,
+        maxFollowed=MAX_FOLLOWED_LINKS ):
+    "Crawls the url then the links found on it, printing their headlines and\n\
+    collecting photo links into photoStorage. Each hop to a link costs 2 of\n\
+    recursionDepth and a page is only read while at least 2 remain.\n\
+    Returns the number of pages fetched"
+    if recursionDepth < 2:
+        return 0
+
+    adapter = CNNAdapter(
+        maxDepth=( recursionDepth - 2 ) // 2, startUrls=[ CNN_URL ],
+        photoStorage=photoStorage, maxFollowed=maxFollowed, printPhotos=False
+    )
+    crawler = newsCrawler.NewsCrawler( [ adapter ], stderr, errorVerbosity )
+    crawler.run()
+    return crawler.getStats()['fetches']
+
 def main():
     parser          = command_line_parse()
     options, args   = parser
     stderrFName     = options.outStderr
     stderr          = setStderr( stderrFName )
     errorVerbosity  = int( options.errorVerbosity )
-
-    photoLinks = []
-    recursionDepth = 5
-
-    getCNNXML( CNN_URL, stderr, errorVerbosity, photoLinks, recursionDepth )
-
-    for imgLink in photoLinks:
-        print( imgLink )
+    useSiteCache( options.cachePath )
+    useSiteTimeout( options.timeout )
+
+    # The adapter prints the photo links once the crawl is over
+    crawler = newsCrawler.NewsCrawler(
+        [ CNNAdapter() ], stderr, errorVerbosity, workerCount=options.workerCount
+    )
+    crawler.run()
 
 if __name__ == '__main__':
     main()
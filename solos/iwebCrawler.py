@@ -14,20 +14,16 @@
 *******************************************************************
 '''
 
-import xml.parsers
 import sys
 import re
 from sitereader import *
-from xml.dom import minidom
+from newsfuncs  import *
+from listItemParser import iterListItems
+import newsCrawler
 
 BBC_URL           = "http://www.bbc.co.uk"
 
 targUrl           = BBC_URL
-HREF_STR          = "href="
-LINK_REGEX        = "href=\"([^\"]*)\"\s*"
-LINK_COMPILE      = re.compile( LINK_REGEX )
-CONTENT_REGEX     = ">([^<>\s]*)"
-CONTENT_COMPILE   = re.compile( CONTENT_REGEX )
 WHITESPACE        = r"([\t\n])*"
 
 fixFullUrl = lambda baseUrl_ChildUrl : ''.join( baseUrl_ChildUrl )
@@ -44,49 +40,53 @@ def fullAnchorage( linksList, parentUrl=targUrl ):
 def isfullUrl( testStr ):
      return ( re.search( 'https?://', testStr ) != None )
 
-def htmlTagHandler( htmlTagStr ):
-    link        = LINK_COMPILE.findall( htmlTagStr )
-    htmlTagStr  = re.sub( WHITESPACE, r'', htmlTagStr )
-    content     = CONTENT_COMPILE.findall( htmlTagStr )
+def listItemHandler( item ):
+    # item => listItemParser.ListItem
+    # Returns ( its text joined up, its full links ) or None if it lacks either
+    content = [ re.sub( WHITESPACE, r'', text ) for text in item.texts ]
+    content = [ c for c in content if c ]
+    link    = item.links
 
     if ( content and link ):
-        print( "\n %s"%('-'.join( content )) )
-        link = fullAnchorage( link )
-        return link
+        return '-'.join( content ), fullAnchorage( link )
+
+class IWebAdapter( newsCrawler.SiteAdapter ):
+    # Prints the text of each list item and its links, see newsCrawler
+    name      = 'iweb'
+    startUrls = ( targUrl, )
+    maxDepth  = 1
+
+    def extract( self, pageUrl, data ):
+        outLines, links = [], []
+        # Items stream out of the parser as they close, no DOM is built
+        for item in iterListItems( data ):
+            handled = listItemHandler( item )
+            if not handled:
+                continue
+
+            content, itemLinks = handled
+            outLines.append( "\n %s\n"%( content ) )
+            outLines.extend( "%s\n"%( link ) for link in itemLinks )
+            links.extend( itemLinks )
+
+        return ''.join( outLines ), links
 
 def recurXmlGet( targUrl, stderr, errorVerbosity, recursionDepth=2 ):
+    # Crawls targUrl and the pages it links to, recursionDepth levels in all
     if not recursionDepth:
         return 
 
-    readData = site_opener( targUrl, stderr, False )
-    try:
-        xmlDoc = minidom.parseString( readData )
-
-    except xml.parsers.expat.ExpatError as e:
-        #Not well formed string. Fix by adding <root> and </root> tags
-        readData = "<root>"+readData+"</root>"
-        xmlDoc  = minidom.parseString( readData )
-    except Exception as e:
-        print( "unidentified exception: ", e.msg )
-
-    listItems = xmlDoc.getElementsByTagName( "li" )
-    recursionDepth -= 1
-    for item in listItems:
-
-        isPrintable = hasattr( item, 'toprettyxml' )
-        if isPrintable:
-            links = htmlTagHandler( item.toprettyxml() )
-            if not links:
-                continue 
-
-            for link in links:
-                print( link )
-                try:
-                    recurXmlGet( link, stderr, errorVerbosity, recursionDepth )
-                except:
-                    continue
+    adapter = IWebAdapter( maxDepth=recursionDepth - 1, startUrls=[ targUrl ] )
+    newsCrawler.NewsCrawler( [ adapter ], stderr, errorVerbosity ).run()
+
 def main():
-    readData = recurXmlGet( targUrl, sys.stderr, False )
+    options, args = command_line_parse()
+    useSiteCache( options.cachePath )
+    useSiteTimeout( options.timeout )
+    crawler = newsCrawler.NewsCrawler(
+        [ IWebAdapter() ], sys.stderr, False, workerCount=options.workerCount
+    )
+    crawler.run()
 
 if __name__ == '__main__':
     main()
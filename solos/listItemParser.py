@@ -0,0 +1,124 @@
+#!/usr/bin/python3
+'''
+  Event driven extraction of the list items of a page: the links and text of
+  every <li> are collected while the markup streams by, without building a
+  DOM, so malformed pages and unclosed tags are tolerated the way browsers
+  tolerate them. Nested items are reported on their own and as part of the
+  items enclosing them, like getElementsByTagName('li') would.
+'''
+
+try:
+  from html.parser import HTMLParser
+except ImportError: # Python2.X
+  from HTMLParser import HTMLParser
+
+LIST_ITEM_TAG = 'li'
+LIST_TAGS = ('ul', 'ol', 'menu')
+
+class ListItem:
+  def __init__(self, listDepth):
+    self.listDepth = listDepth # Open lists enclosing the item
+    self.links = [] # Every href inside the item, in document order
+    self.anchorTexts = [] # Text of each <a> inside the item
+    self.texts = [] # Every run of text inside the item
+
+  def headline(self):
+    # The text of the item's first link with text, else None
+    for text in self.anchorTexts:
+      if text.strip():
+        return text.strip()
+    return None
+
+  def firstAnchorLink(self):
+    return self.links[0] if self.links else None
+
+  def __repr__(self):
+    return 'ListItem(links=%s, headline=%r)'%(self.links, self.headline())
+
+class ListItemParser(HTMLParser):
+  def __init__(self, onItem=None):
+    # onItem => Called with each ListItem as it closes, else see 'popItems'
+    HTMLParser.__init__(self, convert_charrefs=True)
+    self.__onItem = onItem
+    self.__open = [] # Stack of the ListItems being read
+    self.__anchors = [] # [text pieces...] of each <a> being read
+    self.__listDepth = 0
+    self.__inText = False # Data split across feeds continues the same run
+    self.__done = []
+
+  def __emit(self, item):
+    if self.__onItem is not None:
+      self.__onItem(item)
+    else:
+      self.__done.append(item)
+
+  def __closeItemsAt(self, listDepth):
+    while self.__open and self.__open[-1].listDepth >= listDepth:
+      self.__emit(self.__open.pop())
+
+  def handle_starttag(self, tag, attrs):
+    self.__inText = False
+    if tag in LIST_TAGS:
+      self.__listDepth += 1
+    elif tag == LIST_ITEM_TAG:
+      # An <li> implicitly closes the previous one of the same list
+      self.__closeItemsAt(self.__listDepth)
+      self.__open.append(ListItem(self.__listDepth))
+    elif tag == 'a':
+      self.__anchors.append([])
+
+    if self.__open:
+      href = dict(attrs).get('href', None)
+      if href:
+        for item in self.__open:
+          item.links.append(href.strip())
+
+  def handle_startendtag(self, tag, attrs):
+    self.handle_starttag(tag, attrs)
+    if tag == 'a':
+      self.handle_endtag(tag)
+
+  def handle_endtag(self, tag):
+    self.__inText = False
+    if tag in LIST_TAGS:
+      self.__closeItemsAt(self.__listDepth)
+      self.__listDepth = max(0, self.__listDepth - 1)
+    elif tag == LIST_ITEM_TAG:
+      if self.__open:
+        self.__emit(self.__open.pop())
+    elif tag == 'a' and self.__anchors:
+      text = ''.join(self.__anchors.pop())
+      for item in self.__open:
+        item.anchorTexts.append(text)
+
+  def handle_data(self, data):
+    if not self.__open:
+      return
+    for pieces in self.__anchors:
+      pieces.append(data)
+    for item in self.__open:
+      if self.__inText and item.texts:
+        item.texts[-1] += data
+      else:
+        item.texts.append(data)
+    self.__inText = True
+
+  def close(self):
+    HTMLParser.close(self)
+    self.__closeItemsAt(0)
+
+  def popItems(self):
+    items, self.__done = self.__done, []
+    return items
+
+def iterListItems(markup, chunkSize=1<<14):
+  # Yields the ListItems of markup, fed to the parser a chunk at a time
+  parser = ListItemParser()
+  for start in range(0, len(markup), chunkSize):
+    parser.feed(markup[start:start + chunkSize])
+    for item in parser.popItems():
+      yield item
+
+  parser.close()
+  for item in parser.popItems():
+    yield item
@@ -0,0 +1,183 @@
+#!/usr/bin/python3
+'''
+  Runs any number of site adapters on one shared crawl engine. An adapter
+  only knows how to pull text and links out of its site's pages; fetching,
+  dedupe and concurrency are shared, so sites are crawled side by side from
+  one process and a page wanted by several adapters is fetched once.
+    + Pages go through site_opener ie utils' pooled client, whose
+      politeScheduler enforces the per-host limits; the engine only hands a
+      page to a worker once its host has a turn free
+    + Each adapter visits a url at most once, tracked in the engine's
+      seen-set under the adapter's name
+    + Fetched pages are kept in a bounded LRU, with concurrent requests for
+      the same page waiting on the one fetch in flight
+'''
+
+import sys
+import threading
+import collections
+
+from sitereader import *
+from newsfuncs import *
+import utils
+import urlCanon
+import crawlEngine
+
+DEFAULT_PAGE_CACHE_SIZE = 256 # Pages
+
+class SiteAdapter:
+  # Extraction rules of a site. Subclasses set 'name' and 'startUrls' and
+  # override 'extract', plus 'finish' to print anything after the crawl
+  name = 'site'
+  startUrls = ()
+  maxDepth = 1 # Link hops followed from a start url
+  requestsPerSecond = None # Per host limits, utils.politeScheduler's if None
+  maxConnections = None
+  reportsToStderr = False # Print to the error stream given to newsCrawler
+
+  def __init__(self, stream=None, maxDepth=None, startUrls=None):
+    self.stream = sys.stdout if stream is None else stream
+    if startUrls is not None:
+      self.startUrls = tuple(startUrls)
+    if maxDepth is not None:
+      self.maxDepth = maxDepth
+
+  def extract(self, pageUrl, data):
+    # Returns (text to print for the page, [links to follow...])
+    return '', []
+
+  def finish(self):
+    return ''
+
+class PageCache:
+  def __init__(self, maxEntries=DEFAULT_PAGE_CACHE_SIZE):
+    self.__maxEntries = max(1, maxEntries)
+    self.__pages = collections.OrderedDict() # key -> data, None if it failed
+    self.__inFlight = dict() # key -> Event set once its fetch is done
+    self.__lock = threading.Lock()
+    self.__stats = dict(fetches=0, hits=0, waits=0)
+
+  def getStats(self):
+    with self.__lock:
+      return dict(self.__stats)
+
+  def fetch(self, url, fetchFunc):
+    # Returns fetchFunc(url), only calling it if url is not cached or
+    # being fetched by another thread already
+    key = urlCanon.dedupeKey(url) or url
+    while True:
+      with self.__lock:
+        if key in self.__pages:
+          self.__pages.move_to_end(key)
+          self.__stats['hits'] += 1
+          return self.__pages[key]
+
+        event = self.__inFlight.get(key, None)
+        if event is None:
+          event = self.__inFlight[key] = threading.Event()
+          self.__stats['fetches'] += 1
+          break
+        self.__stats['waits'] += 1
+
+      event.wait()
+
+    data = None
+    try:
+      data = fetchFunc(url)
+    finally:
+      with self.__lock:
+        self.__pages[key] = data
+        while len(self.__pages) > self.__maxEntries:
+          self.__pages.popitem(last=False)
+        self.__inFlight.pop(key).set()
+
+    return data
+
+class NewsCrawler:
+  def __init__(self, adapters, stderr=sys.stderr, errorVerbosity=True,
+      workerCount=crawlEngine.DEFAULT_WORKER_COUNT, pageCache=None):
+    self.__adapters = list(adapters)
+    self.__stderr = stderr
+    self.__errorVerbosity = errorVerbosity
+    self.__engine = crawlEngine.CrawlEngine(workerCount)
+    self.__pages = PageCache() if pageCache is None else pageCache
+    self.__outLock = threading.Lock()
+
+  def getStats(self):
+    return self.__pages.getStats()
+
+  def __open(self, url):
+    return site_opener(url, self.__stderr, self.__errorVerbosity)
+
+  def queuePage(self, adapter, url, depth=0):
+    url = urlCanon.canonicalize(url)
+    if not url:
+      return False
+
+    if not self.__engine.markSeen('%s %s'%(adapter.name, urlCanon.dedupeKey(url))):
+      return False
+    return self.__engine.submitFor(url, self.__crawlPage, adapter, url, depth)
+
+  def __crawlPage(self, adapter, url, depth):
+    data = self.__pages.fetch(url, self.__open)
+    if not data:
+      return
+
+    outText, links = adapter.extract(url, data)
+    if outText:
+      with self.__outLock: # Keep each page's output in one piece
+        utils.streamPrintFlush(outText, adapter.stream)
+
+    if depth < adapter.maxDepth:
+      for link in links:
+        childUrl = urlCanon.canonicalize(link, url)
+        if childUrl:
+          self.queuePage(adapter, childUrl, depth + 1)
+
+  def run(self):
+    for adapter in self.__adapters:
+      for url in adapter.startUrls:
+        if adapter.requestsPerSecond is not None or adapter.maxConnections is not None:
+          utils.politeScheduler.setHostLimits(
+            url, requestsPerSecond=adapter.requestsPerSecond,
+            maxConnections=adapter.maxConnections
+          )
+        self.queuePage(adapter, url)
+
+    self.__engine.run()
+    for adapter in self.__adapters:
+      utils.streamPrintFlush(adapter.finish(), adapter.stream)
+
+def siteAdapters():
+  # name -> adapter class of every bundled site
+  import bbcScript, cnnScript, iwebCrawler
+  adapters = (bbcScript.BBCAdapter, cnnScript.CNNAdapter, iwebCrawler.IWebAdapter)
+  return collections.OrderedDict((adapter.name, adapter) for adapter in adapters)
+
+def main():
+  options, args = command_line_parse()
+  stderr = setStderr(options.outStderr)
+  useSiteCache(options.cachePath)
+  useSiteTimeout(options.timeout)
+
+  available = siteAdapters()
+  names = args or list(available.keys())
+  unknown = [name for name in names if name not in available]
+  if unknown:
+    sys.stderr.write('Unknown sites %s, pick from %s\n'%(unknown, list(available.keys())))
+    sys.exit(1)
+
+  adapters = []
+  for name in names:
+    adapterClass = available[name]
+    adapters.append(adapterClass(stream=stderr if adapterClass.reportsToStderr else None))
+
+  crawler = NewsCrawler(
+    adapters, stderr, options.errorVerbosity, workerCount=options.workerCount
+  )
+  crawler.run()
+  stderr.write('%s\n'%(crawler.getStats()))
+  stderr.flush()
+
+if __name__ == '__main__':
+  main()
@@ -14,6 +14,13 @@ def command_line_parse():
   parser.add_option( "-v", "--errorVerbosity", dest="errorVerbosity", help=\
     "Set whether to write errors and exception messages to the standard error",
     default=True )
+  parser.add_option( "-c", "--cachePath", dest="cachePath", help=\
+    "Revalidate pages against the ETag/Last-Modified cache stored at this path",
+    default="" )
+  parser.add_option( "-t", "--timeout", dest="timeout", type="float", help=\
+    "Seconds to wait on a server before giving up on a page", default=None )
+  parser.add_option( "-w", "--workers", dest="workerCount", type="int", help=\
+    "Number of pages fetched concurrently", default=8 )
   ( options,args ) = parser.parse_args()
   return ( options,args )
 
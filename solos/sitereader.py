@@ -5,20 +5,43 @@
    Logs to standard error stream(if defined) any errors encountered.
 '''
 
-import urllib.request, urllib.error
+import os
 import re
+import sys
+
+# The crawler modules shared with the top level tools live one directory up
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import utils
+import httpCache
 
 UBUNTU_UAGENT = 'Mozilla/5.0 (X11; Ubuntu; Linux i686; rv:13.0) ' +\
                 'Gecko/20100101 Firefox/13.0'
+DEFAULT_SITE_TIMEOUT = 15 # Seconds
+
+# Fetches go through utils' keep-alive connection pool, see utils.openUrl
+siteTimeout = DEFAULT_SITE_TIMEOUT
 
 repCompile = re.compile(r'(.*)"', re.UNICODE|re.MULTILINE)
 # Empties any data before an unmatched terminated quotation mark with 
 correctMalformed = lambda malUrl : repCompile.sub(r'', malUrl)
 
-def site_opener(url, stderr,errorVerbosity, user_agent=UBUNTU_UAGENT):
+def useSiteCache(cachePath):
+  # Revalidates pages fetched by site_opener against the cache at cachePath
+  if cachePath:
+    return utils.useHttpCache(httpCache.HttpCache(cachePath))
+
+def useSiteTimeout(timeout):
+  # Seconds site_opener waits on a connect or read before giving up
+  global siteTimeout
+  if timeout:
+    siteTimeout = float(timeout)
+  return siteTimeout
+
+def site_opener(url, stderr,errorVerbosity, user_agent=UBUNTU_UAGENT, timeout=None):
   # Input: url->string, stderr -> file stream to log errors, 
   #        errorVerbosity ->Boolean to determine if
   #        any errors and excepts can be logged to standard error
+  #        timeout -> Seconds to wait on the server, siteTimeout by default
   # Output: Logs to stderr errors if boolean 'errorVerbosity' is set
   # Returns: Retrieved data retrieved  or None on failure
   # Make sure that the stream passed in as the standard error, can be written to
@@ -29,28 +52,32 @@ def site_opener(url, stderr,errorVerbosity, user_agent=UBUNTU_UAGENT):
     )
 
   try:
-    # Building our modified url opener to enable the use of a fake user-agent
-    modified_opener   = urllib.request.build_opener()
-    user_agent_tuple = ('user-agent', user_agent)
-    modified_opener.addheaders = [user_agent_tuple]
-
-    data = modified_opener.open(url) # Use the modified url opener to open url
+    # Reuses a pooled keep-alive connection to the host, accepting gzip/deflate
+    outdata = utils.fetchBytes(
+      url, headers={'User-Agent': user_agent}, compressed=True,
+      timeout=siteTimeout if timeout is None else timeout
+    )
   except Exception as e:
-    if errorVerbosity: #Log the error to std
-
-      # Possibly corrupted url or no internet connectionerr
-      if isinstance(e, urllib.error.URLError): 
-        errMsg = "Unknown service %s or check your Internet connection"%(url)
-      else:
-        errMsg = "While opening url '%s' error: %s encountered"%(
-          url, e.__str__())
-    
-      stderr.write("\033[31m%s\033[00m\n"%(errMsg))
-      stderr.flush()
-    return None
+    return __reportOpenError(e, url, stderr, errorVerbosity)
+
+  return __decodeData(outdata, stderr, errorVerbosity)
+
+def __reportOpenError(e, url, stderr, errorVerbosity):
+  if errorVerbosity: #Log the error to std
+
+    # Possibly corrupted url or no internet connectionerr
+    if isinstance(e, (IOError, OSError)):
+      errMsg = "Unknown service %s or check your Internet connection"%(url)
+    else:
+      errMsg = "While opening url '%s' error: %s encountered"%(
+        url, e.__str__())
+  
+    stderr.write("\033[31m%s\033[00m\n"%(errMsg))
+    stderr.flush()
+  return None
 
+def __decodeData(outdata, stderr, errorVerbosity):
   try:
-    outdata = data.read()
     decoded_data = outdata.decode() # Try decoding the data
   except Exception as e:
     # Manage error later#
@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+# URL canonicalization so that spellings of the same resource collapse into
+# one url: lower cased scheme and host, no default port, no fragment and dot
+# segments resolved, all of which leave the fetched resource unchanged.
+# 'dedupeKey' further sorts query parameters and folds http/https and
+# trailing slashes together for use as a seen-set key only: a server may
+# care about its parameters' order so urls are fetched as canonicalized.
+
+try:
+    from urllib.parse import urlsplit, urlunsplit, urljoin
+except ImportError: # Python2.X
+    from urlparse import urlsplit, urlunsplit, urljoin
+
+DEFAULT_PORTS = {'http': '80', 'https': '443'}
+DEFAULT_SCHEME = 'http'
+
+def removeDotSegments(path):
+    # RFC 3986 section 5.2.4
+    if '.' not in path:
+        return path
+
+    output = []
+    segments = path.split('/')
+    for i, segment in enumerate(segments):
+        if segment == '..':
+            if len(output) > 1:
+                output.pop()
+        elif segment != '.':
+            output.append(segment)
+
+    if segments[-1] in ('.', '..'): # '/a/b/..' resolves to the directory '/a/'
+        output.append('')
+
+    resolved = '/'.join(output)
+    if path.startswith('/') and not resolved.startswith('/'):
+        resolved = '/' + resolved
+
+    return resolved
+
+def sortQuery(query):
+    if not query:
+        return ''
+    pairs = [pair for pair in query.split('&') if pair]
+    pairs.sort()
+    return '&'.join(pairs)
+
+def canonicalize(url, baseUrl=None):
+    # Returns the canonical form of url, resolved against baseUrl if relative
+    # or None if it cannot be made into an http(s) url
+    if not url:
+        return None
+
+    url = url.strip()
+    if baseUrl:
+        url = urljoin(baseUrl, url)
+    elif '://' not in url and not url.startswith('//'):
+        url = '%s://%s'%(DEFAULT_SCHEME, url) # eg 'www.example.org/a'
+
+    try:
+        parts = urlsplit(url)
+    except ValueError:
+        return None
+
+    scheme = (parts.scheme or DEFAULT_SCHEME).lower()
+    if scheme not in DEFAULT_PORTS:
+        return None
+
+    netloc = parts.netloc.lower()
+    userInfo = ''
+    if '@' in netloc:
+        userInfo, netloc = netloc.rsplit('@', 1)
+        userInfo += '@'
+
+    if netloc.endswith(':%s'%(DEFAULT_PORTS[scheme])):
+        netloc = netloc[:netloc.rindex(':')]
+    netloc = netloc.rstrip('.:')
+    if not netloc:
+        return None
+
+    path = removeDotSegments(parts.path) or '/'
+    return urlunsplit((scheme, userInfo + netloc, path, parts.query, ''))
+
+def dedupeKey(url, baseUrl=None):
+    # Key under which url is remembered as seen: scheme-less and
+    # without a trailing slash, so http://x/a and https://x/a/ collide
+    canonical = canonicalize(url, baseUrl)
+    if canonical is None:
+        return None
+
+    key, _, query = canonical.split('://', 1)[1].partition('?')
+    if query:
+        return '%s?%s'%(key, sortQuery(query))
+    return key.rstrip('/')
+
+def main():
+    import sys
+    for url in sys.argv[1:] or ['HTTP://Example.org:80/a/./b/../c?z=1&a=2#frag']:
+        print(url, canonicalize(url), dedupeKey(url))
+
+if __name__ == '__main__':
+    main()
@@ -4,6 +4,11 @@ import os
 import re
 import sys
 import time
+import zlib
+import tempfile
+import contextlib
+
+import hostScheduler
 
 CRAWLER_NAME = 'Rosebot'
 BAD_URL_REPORT_FILE = 'badUrlsReport.txt'
@@ -16,6 +21,7 @@ pyVersion = int(sys.hexversion/(1<<24))
 
 ############################# CONSTANTS HERE ##################################
 DEFAULT_TIMEOUT = 5 # Seconds
+DEFAULT_CHUNK_SIZE = 1<<16 # Bytes read off the network at a time when streaming
 
 extensionify = lambda extStr: '([^\s]+)\.(%s)'%(extStr)
 mainDomainCompile = re.compile('(https?://[^\/]+\/?)?', re.IGNORECASE|re.UNICODE)
@@ -58,6 +64,15 @@ except ImportError:
 # Writes a message to a stream and flushes the stream
 streamPrintFlush = lambda msg, st=sys.stderr: msg and st.write(msg) and st.flush()
 
+def getHash(data):
+  try:
+    bEncodedData = byteFyer(data, **encodingArgs) 
+    hashDigest = md5(bEncodedData).hexdigest()
+  except Exception:
+   return None
+  else:
+   return hashDigest
+
 def getTopDomain(url):
     if url and hasattr(url, '__str__'):
         rSearch = mainDomainCompile.search(url)
@@ -69,18 +84,168 @@ def robotsTxt(url):
     if topDomain:
         return '%s/robots.txt'%(topDomain)
 
+# Shared by every fetch in the process so that per-host budgets are global
+politeScheduler = hostScheduler.HostScheduler(keyFunc=getTopDomain)
+connectionPool = hostScheduler.ConnectionPool()
+DEFAULT_HEADERS = {'User-Agent': CRAWLER_NAME, 'Connection': 'keep-alive'}
+ACCEPT_ENCODING = 'gzip, deflate'
+
+@contextlib.contextmanager
+def openUrl(url, headers=None, timeout=DEFAULT_TIMEOUT):
+    # Waits for the host's politeness budget then yields the response of a GET
+    # over a pooled keep-alive connection. A redirect to another host is only
+    # followed once that host's budget allows it too. Raises
+    # hostScheduler.HttpStatusError for 4XX/5XX responses and the usual socket
+    # errors on failure.
+    reqHeaders = dict(DEFAULT_HEADERS)
+    if headers:
+        reqHeaders.update(headers)
+
+    redirectsLeft = hostScheduler.DEFAULT_MAX_REDIRECTS
+    while True:
+        redirect = None
+        politeScheduler.acquire(url)
+        try:
+            try:
+                response = connectionPool.request(
+                    url, headers=reqHeaders, timeout=timeout, maxRedirects=redirectsLeft
+                )
+            except hostScheduler.CrossHostRedirect as e:
+                redirect = e
+            else:
+                try:
+                    yield response
+                finally:
+                    connectionPool.release(response)
+        finally:
+            politeScheduler.release(url)
+
+        if redirect is None:
+            return
+        url, redirectsLeft = redirect.location, redirect.redirectsLeft
+
+httpCache = None # Set by useHttpCache to revalidate pages instead of refetching them
+
+def useHttpCache(cache):
+    global httpCache
+    httpCache = cache
+    return cache
+
+def decodeContent(body, contentEncoding):
+    # Undoes a gzip or deflate Content-Encoding
+    encoding = (contentEncoding or '').strip().lower()
+    if encoding in ('gzip', 'x-gzip'):
+        return zlib.decompress(body, 16 + zlib.MAX_WBITS)
+    if encoding == 'deflate':
+        try:
+            return zlib.decompress(body)
+        except zlib.error: # Some servers send raw deflate without the zlib header
+            return zlib.decompress(body, -zlib.MAX_WBITS)
+    return body
+
+def fetchBytes(url, headers=None, timeout=DEFAULT_TIMEOUT, compressed=False):
+    # Returns the body of url. With an httpCache in use, the request carries
+    # the cached validators and a '304 Not Modified' is served from the cache.
+    # compressed => Accept gzip/deflate bodies, returned and cached decoded
+    cache = httpCache
+    baseHeaders = dict(headers or {})
+    if compressed:
+        baseHeaders['Accept-Encoding'] = ACCEPT_ENCODING
+    reqHeaders = dict(baseHeaders)
+    if cache is not None:
+        reqHeaders.update(cache.conditionalHeaders(url))
+
+    with openUrl(url, headers=reqHeaders, timeout=timeout) as response:
+        body = response.read()
+        if response.status != 304:
+            body = decodeContent(body, response.getheader('Content-Encoding'))
+        if cache is not None:
+            if response.status == 304:
+                body = cache.lookup(url)
+            else:
+                cache.store(url, body, response)
+
+    if body is None: # Evicted between the request and the 304, refetch in full
+        with openUrl(url, headers=baseHeaders, timeout=timeout) as response:
+            body = decodeContent(response.read(), response.getheader('Content-Encoding'))
+
+    return body
+
 def dlAndDecode(url):
     try:
-        dl = urlGetter.urlopen(url)
+        dlData = fetchBytes(url)
         if pyVersion >= 3:
-            dlData = dl.read().decode()
-        else:
-            dlData = dl.read()
+            dlData = dlData.decode()
     except Exception:
         return None
     else:
         return dlData
 
+def getContentLength(response):
+    try:
+        return int(response.getheader('Content-Length'))
+    except (TypeError, ValueError, AttributeError):
+        return None
+
+# The mode open() gives new files, mkstemp's 0600 temporaries are set to it
+# before being renamed into place. The umask can only be read by setting it,
+# hence the swap straight back
+NEW_FILE_MODE = 0o666 & ~os.umask(os.umask(0o022))
+
+def streamToFile(response, filePath, chunkSize=DEFAULT_CHUNK_SIZE, maxSize=None):
+    # Copies the body of 'response' to 'filePath' chunk by chunk so that memory
+    # use stays bounded by 'chunkSize'. Data goes to a temporary file next to
+    # the target that is only renamed into place once complete.
+    # Returns: the number of bytes written or None if the download was aborted
+    contentLength = getContentLength(response)
+    if maxSize is not None and contentLength is not None and contentLength > maxSize:
+        streamPrintFlush(
+            "Skipping %s: Content-Length %d exceeds %d bytes\n"%(
+                filePath, contentLength, maxSize
+            ), sys.stderr
+        )
+        return None
+
+    dirPath, baseName = os.path.split(os.path.abspath(filePath))
+    fd, tmpPath = tempfile.mkstemp(prefix='.%s.'%(baseName), suffix='.part', dir=dirPath)
+    written = 0
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            while True:
+                chunk = response.read(chunkSize)
+                if not chunk:
+                    break
+
+                written += len(chunk)
+                if maxSize is not None and written > maxSize:
+                    streamPrintFlush(
+                        "Aborting %s: exceeded %d bytes\n"%(filePath, maxSize), sys.stderr
+                    )
+                    return None
+
+                f.write(chunk)
+
+        if contentLength is not None and written < contentLength:
+            streamPrintFlush(
+                "Truncated %s: got %d of %d bytes\n"%(filePath, written, contentLength),
+                sys.stderr
+            )
+            return None
+
+        os.chmod(tmpPath, NEW_FILE_MODE)
+        if hasattr(os, 'replace'):
+            os.replace(tmpPath, filePath)
+        else: # Python2.X
+            if os.path.exists(filePath):
+                os.remove(filePath)
+            os.rename(tmpPath, filePath)
+
+        tmpPath = None
+        return written
+    finally:
+        if tmpPath and os.path.exists(tmpPath):
+            os.remove(tmpPath)
+
 def generateBadUrlReport(missesDict):
   if missesDict:
     streamPrintFlush("\033[33mWriting report to %s\033[00m\n"%(BAD_URL_REPORT_FILE))